@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Throughput benchmark of the agent logging handlers.
+
+Worker threads log records through the console and daily file handlers used
+by the agent, first directly, then behind the background log pipeline. The
+benchmark reports records per second and the time workers spend inside
+logging calls.
+
+    python benchmarks/bench_logging.py --threads 8 --records 5000
+"""
+
+import argparse
+import io
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from rich.console import Console
+from rich.logging import RichHandler
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils.logqueue import LogPipeline  # pylint: disable=wrong-import-position
+
+
+def build_logger(name, log_dir):
+    """
+    Return a logger with the agent console and file handlers.
+    """
+    bench_logger = logging.getLogger(name)
+    bench_logger.setLevel(logging.INFO)
+    bench_logger.propagate = False
+    console = RichHandler(console=Console(file=io.StringIO(), width=120))
+    file_handler = agent.DailyLogFileHandler(log_dir)
+    file_handler.setFormatter(agent.file_formatter)
+    bench_logger.addHandler(console)
+    bench_logger.addHandler(file_handler)
+    return bench_logger
+
+
+def run(bench_logger, threads, records):
+    """
+    Log records from threads workers, return the duration and call stalls.
+    """
+    stalls = []
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(index):
+        local = []
+        barrier.wait()
+        for number in range(records):
+            started = time.perf_counter()
+            bench_logger.info("Job %s nmap: line %s", index, number)
+            local.append(time.perf_counter() - started)
+        stalls.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - started, stalls
+
+
+def main():
+    """
+    Run the direct and queued handlers and print their figures.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    total = args.threads * args.records
+    print(
+        f"{'mode':<8} {'records/s':>11} {'stall p50':>10} {'stall p99':>10}"
+        f" {'stall sum':>10} {'dropped':>8}"
+    )
+    for mode in ("direct", "queued"):
+        log_dir = tempfile.mkdtemp()
+        try:
+            bench_logger = build_logger(f"bench-{mode}", log_dir)
+            pipeline = None
+            if mode == "queued":
+                pipeline = LogPipeline(bench_logger, args.queue_size).start()
+            duration, stalls = run(bench_logger, args.threads, args.records)
+            dropped = 0
+            if pipeline is not None:
+                pipeline.stop()
+                dropped = pipeline.dropped
+            stalls.sort()
+            print(
+                f"{mode:<8} {total / duration:11.0f}"
+                f" {statistics.median(stalls) * 1e6:8.1f}us"
+                f" {stalls[int(len(stalls) * 0.99)] * 1e6:8.1f}us"
+                f" {sum(stalls):9.2f}s {dropped:8}"
+            )
+        finally:
+            for handler in list(bench_logger.handlers):
+                handler.close()
+                bench_logger.removeHandler(handler)
+            shutil.rmtree(log_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Contention benchmark of NSE cache resolution.
+
+Many worker threads resolve overlapping sets of NSE scripts while half of
+the scripts are already cached, first with one lock shared by every script
+(the previous behavior), then with the per-script locks used by the agent.
+Jobs that only need cached scripts should not wait behind large refreshes.
+
+    python benchmarks/bench_nse_cache.py --jobs 32 --scripts 16 --size 2000000
+"""
+
+import argparse
+import base64
+import hashlib
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+
+
+def make_descriptors(scripts, size):
+    """
+    Return controller descriptors for scripts of size random bytes.
+    """
+    descriptors = []
+    for index in range(scripts):
+        content = os.urandom(size)
+        descriptors.append(
+            {
+                "name": f"bench-{index}.nse",
+                "hash": hashlib.sha256(content).hexdigest(),
+                "content_b64": base64.b64encode(content).decode(),
+            }
+        )
+    return descriptors
+
+
+def run(descriptors, jobs, per_job, global_lock):
+    """
+    Resolve descriptor sets from jobs threads, return the total duration and
+    the per-job durations of warm and cold jobs.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(tmp_dir, "nse_cache"))
+    shared = threading.Lock()
+    warm = descriptors[: len(descriptors) // 2]
+    cold = descriptors[len(descriptors) // 2 :]
+    job_messages = []
+    for start in range(jobs):
+        pool = warm if start % 2 == 0 else cold
+        job_messages.append(
+            {
+                "nse_scripts": [
+                    pool[(start + offset) % len(pool)] for offset in range(per_job)
+                ]
+            }
+        )
+    barrier = threading.Barrier(jobs + 1)
+    durations = {"warm": [], "cold": []}
+
+    def resolve(index, job_message):
+        barrier.wait()
+        job_started = time.perf_counter()
+        agent._resolve_nse_targets(  # pylint: disable=protected-access
+            job_message, f"bench-{index}"
+        )
+        kind = "warm" if index % 2 == 0 else "cold"
+        durations[kind].append(time.perf_counter() - job_started)
+
+    patches = [
+        mock.patch.dict(agent.CONFIG, {"THIS_DIR": tmp_dir}),
+        mock.patch.object(agent, "NSE_STORE", None),
+        mock.patch.object(agent, "NSE_SCRIPT_LOCKS", {}),
+    ]
+    if global_lock:
+        patches.append(
+            mock.patch.object(agent, "_nse_script_lock", lambda _name: shared)
+        )
+    try:
+        for patcher in patches:
+            patcher.start()
+        agent._resolve_nse_targets(  # pylint: disable=protected-access
+            {"nse_scripts": warm}, "warmup"
+        )
+        threads = [
+            threading.Thread(target=resolve, args=(index, job_message))
+            for index, job_message in enumerate(job_messages)
+        ]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started, durations
+    finally:
+        for patcher in reversed(patches):
+            patcher.stop()
+        shutil.rmtree(tmp_dir)
+
+
+def main():
+    """
+    Run both locking strategies and print their durations.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--jobs", type=int, default=32)
+    parser.add_argument("--scripts", type=int, default=16)
+    parser.add_argument("--per-job", type=int, default=4)
+    parser.add_argument("--size", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    logging.getLogger("Plum_Agent").setLevel(logging.WARNING)
+    descriptors = make_descriptors(args.scripts, args.size)
+    print(f"{'strategy':<18} {'total':>10} {'warm p50':>10} {'cold p50':>10}")
+    for label, global_lock in (("global lock", True), ("per-script locks", False)):
+        total, durations = run(descriptors, args.jobs, args.per_job, global_lock)
+        print(
+            f"{label:<18} {total * 1000:8.1f}ms"
+            f" {statistics.median(durations['warm']) * 1000:8.1f}ms"
+            f" {statistics.median(durations['cold']) * 1000:8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
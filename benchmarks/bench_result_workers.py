@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Responsiveness benchmark of result conversion in threads and processes.
+
+Several scan worker threads convert a large synthetic Nmap report at the same
+time, as happens when parallel jobs finish together. A ticker thread standing
+for the daemon loop sleeps 5 ms at a time and records how late it wakes up.
+The conversion runs first in the worker threads, then in result worker
+processes.
+
+    python benchmarks/bench_result_workers.py --jobs 4 --hosts 2000
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+from bench_xml_conversion import (  # pylint: disable=wrong-import-position
+    write_synthetic_report,
+)
+from utils.netutils import WIRE_FORMAT_LEGACY  # pylint: disable=wrong-import-position
+from utils.postprocess import (  # pylint: disable=wrong-import-position
+    ResultConverter,
+    convert_report,
+)
+
+TICK = 0.005
+SETTINGS = {
+    "wire_format": WIRE_FORMAT_LEGACY,
+    "encoding": "gzip",
+    "level": 6,
+    "threshold": 65536,
+}
+
+
+def run(convert, reports):
+    """
+    Convert the reports in parallel threads, return the duration and the
+    ticker lateness samples.
+    """
+    lateness = []
+    done = threading.Event()
+
+    def ticker():
+        while not done.is_set():
+            started = time.perf_counter()
+            time.sleep(TICK)
+            lateness.append(time.perf_counter() - started - TICK)
+
+    ticker_thread = threading.Thread(target=ticker)
+    ticker_thread.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(reports)) as executor:
+        list(executor.map(lambda path: convert(path, {"JOB_UID": path}), reports))
+    duration = time.perf_counter() - started
+    done.set()
+    ticker_thread.join()
+    return duration, lateness
+
+
+def main():
+    """
+    Run the in-thread and process pool conversions and print their figures.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--hosts", type=int, default=2000)
+    parser.add_argument("--ports", type=int, default=4)
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        reports = []
+        for index in range(args.jobs):
+            path = os.path.join(tmp_dir, f"report-{index}.xml")
+            write_synthetic_report(path, args.hosts, args.ports)
+            reports.append(path)
+
+        converter = ResultConverter(args.jobs).start()
+        # Warm the worker processes so their start-up is not measured.
+        converter.convert(reports[0], {}, **SETTINGS)
+        modes = (
+            ("thread", lambda path, data: convert_report(path, data, **SETTINGS)),
+            ("process", lambda path, data: converter.convert(path, data, **SETTINGS)),
+        )
+        print(f"{'mode':<8} {'duration':>9} {'late p50':>9} {'late p99':>9} {'max':>9}")
+        for mode, convert in modes:
+            duration, lateness = run(convert, reports)
+            lateness.sort()
+            print(
+                f"{mode:<8} {duration:8.2f}s"
+                f" {statistics.median(lateness) * 1e3:7.2f}ms"
+                f" {lateness[int(len(lateness) * 0.99)] * 1e3:7.2f}ms"
+                f" {lateness[-1] * 1e3:7.2f}ms"
+            )
+        converter.stop()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
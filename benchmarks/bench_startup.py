@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Cold start benchmark of the agent.
+
+Fresh interpreters import the agent module with -X importtime, then run
+agent.py --help. The benchmark reports the median import time, the modules
+with the highest cumulative import time, the heavy subsystems loaded by the
+import, and the median wall time of --help.
+
+    python benchmarks/bench_startup.py --runs 10 --top 10
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+# Subsystems only some agent modes need.
+HEAVY_MODULES = ("requests", "urllib3", "asyncio", "nmap2json", "yaml", "rich")
+REPORT_HEAVY_MODULES = (
+    "import sys, agent; print(','.join(m for m in {modules!r} if m in sys.modules))"
+)
+
+
+def import_times():
+    """
+    Import the agent in a fresh interpreter, return its cumulative import
+    time per module in microseconds.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import agent"],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:") :].split("|")
+        if not fields[1].strip().isdigit():
+            continue
+        times[fields[2].strip()] = int(fields[1])
+    return times
+
+
+def help_seconds():
+    """
+    Return the wall time of agent.py --help in a fresh interpreter.
+    """
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "agent.py", "--help"],
+        cwd=SRC_DIR,
+        capture_output=True,
+        check=True,
+    )
+    return time.perf_counter() - started
+
+
+def main():
+    """
+    Run the import and --help measurements and print their figures.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    # The first run writes bytecode caches, it is not measured.
+    import_times()
+    runs = [import_times() for _ in range(args.runs)]
+    help_runs = [help_seconds() for _ in range(args.runs)]
+    loaded = subprocess.run(
+        [sys.executable, "-c", REPORT_HEAVY_MODULES.format(modules=HEAVY_MODULES)],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+    medians = {
+        module: statistics.median(run.get(module, 0) for run in runs)
+        for module in runs[0]
+    }
+    print(f"import agent   median {medians['agent'] / 1000:8.1f} ms")
+    print(f"agent --help   median {statistics.median(help_runs) * 1000:8.1f} ms")
+    print(f"heavy modules loaded by import: {loaded or 'none'}")
+    print(f"top {args.top} modules by cumulative import time:")
+    top = sorted(
+        (item for item in medians.items() if item[0] != "agent"),
+        key=lambda item: item[1],
+        reverse=True,
+    )[: args.top]
+    for module, micros in top:
+        print(f"  {micros / 1000:8.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+End-to-end throughput benchmark of the agent daemon.
+
+A copy of the agent runs in daemon mode against the local mock island of
+mock_island.py, with fake_nmap.py standing in for nmap. Once the island queue
+is scanned and delivered, the agent is drained with SIGUSR1. The benchmark is
+repeated for each scanparallel value and reports jobs per hour, the share of
+scan slot time without a running Nmap process, the delay between the end of a
+scan and the arrival of its final result, and the agent RSS.
+
+    python benchmarks/bench_throughput.py --scanparallel 1,2,4,8 --jobs 32 \
+        --nmap-seconds 2 --latency 20 --error-rate 0.05
+"""
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+from mock_island import (
+    DEFAULT_CAPABILITIES,
+    MockIsland,
+)
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+FAKE_NMAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_nmap.py")
+# Agent state that must not leak into the benchmark copy.
+IGNORED_STATE = (
+    "__pycache__",
+    "config",
+    "log",
+    "result_spool",
+    "scan_state",
+    "nse_cache",
+    "*.xml",
+    "ext_ip_cache.json",
+)
+RSS_SAMPLE_INTERVAL = 0.1
+DRAIN_TIMEOUT = 60
+
+
+def prepare_agent(work_dir, island_url, scanparallel, settings):
+    """
+    Copy the agent into work_dir with a configuration pointing at the island
+    and a nmap wrapper running fake_nmap.py. Return the agent path and the
+    wrapper directory.
+    """
+    agent_dir = os.path.join(work_dir, "agent")
+    shutil.copytree(SRC_DIR, agent_dir, ignore=shutil.ignore_patterns(*IGNORED_STATE))
+    os.makedirs(os.path.join(agent_dir, "config"))
+    config = {
+        "island": island_url,
+        "agent_key": "benchmark",
+        "ext_ip": "192.0.2.1",
+        "scanparallel": scanparallel,
+    } | settings
+    with open(
+        os.path.join(agent_dir, "config", "config.yaml"), "w", encoding="utf-8"
+    ) as handle:
+        yaml.safe_dump(config, handle)
+
+    bin_dir = os.path.join(work_dir, "bin")
+    os.makedirs(bin_dir)
+    wrapper = os.path.join(bin_dir, "nmap")
+    with open(wrapper, "w", encoding="utf-8") as handle:
+        handle.write(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_NMAP}" "$@"\n')
+    os.chmod(wrapper, 0o755)
+    return os.path.join(agent_dir, "agent.py"), bin_dir
+
+
+def rss_bytes(pid):
+    """
+    Return the resident set size of a process, None when it is unknown.
+    """
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def run_agent(args, scanparallel, settings):
+    """
+    Run the agent until the island queue is delivered, return the island, the
+    fake nmap runs and the agent RSS samples.
+    """
+    work_dir = tempfile.mkdtemp()
+    island = MockIsland(
+        args.jobs,
+        job_hosts=args.job_hosts,
+        latency=args.latency / 1000,
+        error_rate=args.error_rate,
+        capabilities=args.capabilities,
+        seed=0,
+    )
+    try:
+        island_url = island.start()
+        agent_path, bin_dir = prepare_agent(
+            work_dir, island_url, scanparallel, settings
+        )
+        nmap_log = os.path.join(work_dir, "nmap_runs.jsonl")
+        env = dict(
+            os.environ,
+            PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""),
+            FAKE_NMAP_SECONDS=str(args.nmap_seconds),
+            FAKE_NMAP_UP=str(args.up),
+            FAKE_NMAP_PORTS=str(args.ports),
+            FAKE_NMAP_LOG=nmap_log,
+        )
+        with open(os.path.join(work_dir, "agent.out"), "wb") as output:
+            agent = subprocess.Popen(  # pylint: disable=consider-using-with
+                [sys.executable, agent_path, "-d"],
+                cwd=os.path.dirname(agent_path),
+                env=env,
+                stdout=output,
+                stderr=subprocess.STDOUT,
+            )
+        rss = []
+        deadline = time.monotonic() + args.timeout
+        while not island.all_completed.is_set():
+            if agent.poll() is not None or time.monotonic() > deadline:
+                break
+            sample = rss_bytes(agent.pid)
+            if sample:
+                rss.append(sample)
+            island.all_completed.wait(RSS_SAMPLE_INTERVAL)
+        if agent.poll() is None:
+            agent.send_signal(signal.SIGUSR1)
+            try:
+                agent.wait(DRAIN_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                agent.kill()
+                agent.wait()
+        if not island.all_completed.is_set():
+            with open(os.path.join(work_dir, "agent.out"), "rb") as output:
+                tail = output.read()[-2000:].decode("utf-8", "replace")
+            print(
+                f"scanparallel {scanparallel}: {len(island.completed)}/{args.jobs}"
+                f" jobs delivered, agent output tail:\n{tail}",
+                file=sys.stderr,
+            )
+        runs = []
+        if os.path.exists(nmap_log):
+            with open(nmap_log, encoding="utf-8") as handle:
+                runs = [json.loads(line) for line in handle]
+        return island, runs, rss
+    finally:
+        island.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def summarize(scanparallel, island, runs, rss):
+    """
+    Return the figures of one agent run.
+    """
+    if not island.completed:
+        return None
+    started = min(island.leased.values())
+    ended = max(island.completed.values())
+    window = max(ended - started, 1e-9)
+    busy = sum(
+        max(0.0, min(run["end"], ended) - max(run["start"], started)) for run in runs
+    )
+    scan_ends = {}
+    for run in runs:
+        range_uid = run["report"].split(".")[0]
+        scan_ends[range_uid] = max(scan_ends.get(range_uid, 0), run["end"])
+    upload = sorted(
+        completed - scan_ends[range_uid]
+        for range_uid, completed in island.completed.items()
+        if range_uid in scan_ends
+    )
+    return {
+        "scanparallel": scanparallel,
+        "jobs": len(island.completed),
+        "jobs_hour": len(island.completed) * 3600 / window,
+        "idle": 1 - busy / (scanparallel * window),
+        "upload_p50": statistics.median(upload) if upload else float("nan"),
+        "upload_p95": upload[int(len(upload) * 0.95)] if upload else float("nan"),
+        "rss_median": statistics.median(rss) if rss else float("nan"),
+        "rss_peak": max(rss) if rss else float("nan"),
+        "getjob": island.getjob_requests,
+        "errors": island.errors,
+        "report_kb": statistics.mean(run["bytes"] for run in runs) / 1024,
+        "upload_kb": island.upload_bytes / 1024,
+    }
+
+
+def parse_setting(text):
+    """
+    Parse a key=value agent setting, the value is read as YAML.
+    """
+    key, separator, value = text.partition("=")
+    if not separator or not key:
+        raise argparse.ArgumentTypeError(f"expected key=value, got {text!r}")
+    return key, yaml.safe_load(value)
+
+
+def main():
+    """
+    Run the agent for each scanparallel value and print their figures.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scanparallel", default="1,2,4,8")
+    parser.add_argument("--jobs", type=int, default=32, help="island queue depth")
+    parser.add_argument("--job-hosts", type=int, default=256)
+    parser.add_argument("--nmap-seconds", type=float, default=2)
+    parser.add_argument("--up", type=float, default=0.1, help="share of hosts up")
+    parser.add_argument("--ports", type=int, default=2, help="open ports per host")
+    parser.add_argument("--latency", type=float, default=20, help="milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--capabilities", default=",".join(DEFAULT_CAPABILITIES))
+    parser.add_argument("--timeout", type=float, default=600, help="seconds per run")
+    parser.add_argument(
+        "--set",
+        dest="settings",
+        type=parse_setting,
+        action="append",
+        default=[],
+        help="extra agent setting as key=value, repeatable",
+    )
+    args = parser.parse_args()
+    args.capabilities = [item for item in args.capabilities.split(",") if item]
+
+    print(
+        f"{'parallel':>8} {'jobs':>5} {'jobs/h':>8} {'idle':>6}"
+        f" {'upl p50':>8} {'upl p95':>8} {'rss p50':>8} {'rss max':>8}"
+        f" {'getjob':>6} {'errors':>6} {'report':>8} {'sent':>9}"
+    )
+    for scanparallel in (int(value) for value in args.scanparallel.split(",")):
+        figures = summarize(
+            scanparallel, *run_agent(args, scanparallel, dict(args.settings))
+        )
+        if figures is None:
+            print(f"{scanparallel:>8} no job delivered")
+            continue
+        print(
+            f"{figures['scanparallel']:>8} {figures['jobs']:>5}"
+            f" {figures['jobs_hour']:>8.0f} {figures['idle'] * 100:>5.1f}%"
+            f" {figures['upload_p50'] * 1000:>6.0f}ms"
+            f" {figures['upload_p95'] * 1000:>6.0f}ms"
+            f" {figures['rss_median'] / 2**20:>6.1f}MB"
+            f" {figures['rss_peak'] / 2**20:>6.1f}MB"
+            f" {figures['getjob']:>6} {figures['errors']:>6}"
+            f" {figures['report_kb']:>6.0f}kB {figures['upload_kb']:>7.0f}kB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Memory benchmark of Nmap XML to JSON conversion.
+
+Generate a large synthetic Nmap XML report, then compare peak memory and
+duration of nmap2json.nmap_file_to_json with the streaming converter used by
+the agent. Each converter runs in its own subprocess so the peak RSS of one
+does not hide the other.
+
+    python benchmarks/bench_xml_conversion.py --hosts 2000 --ports 4
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+HOST_TEMPLATE = """<host starttime="1700000001" endtime="1700000009">
+<status state="up" reason="user-set" reason_ttl="0"/>
+<address addr="{addr}" addrtype="ipv4"/>
+<hostnames><hostname name="host-{index}.example.test" type="PTR"/></hostnames>
+<ports>
+{ports}</ports>
+</host>
+"""
+
+PORT_TEMPLATE = """<port protocol="tcp" portid="{port}">\
+<state state="{state}" reason="syn-ack" reason_ttl="64"/>
+<service name="https" product="nginx" version="1.{port}" method="probed" conf="10"/>
+<script id="ssl-cert" output="Subject: commonName=host-{index}.example.test">
+<table key="subject"><elem key="commonName">host-{index}.example.test</elem></table>
+<table key="extensions">
+<table><elem key="name">X509v3 Basic Constraints</elem><elem key="value">CA:FALSE</elem></table>
+</table>
+<elem key="pem">{pem}</elem>
+</script>
+</port>
+"""
+
+
+def write_synthetic_report(path, hosts, ports):
+    """
+    Write a synthetic report with hosts * ports open services.
+    """
+    pem = "A" * 1200
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        handle.write('<nmaprun scanner="nmap" args="nmap synthetic">\n')
+        for index in range(hosts):
+            addr = f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"
+            port_block = "".join(
+                PORT_TEMPLATE.format(
+                    port=443 + offset,
+                    state="open" if offset % 4 != 3 else "closed",
+                    index=index,
+                    pem=pem,
+                )
+                for offset in range(ports)
+            )
+            handle.write(HOST_TEMPLATE.format(addr=addr, index=index, ports=port_block))
+        handle.write("</nmaprun>\n")
+
+
+def measure(converter, path):
+    """
+    Convert and serialize a report, return duration, peak traced bytes and RSS.
+    """
+    # pylint: disable=import-outside-toplevel
+    import json
+
+    if converter == "stream":
+        from utils.xmlstream import nmap_stream_to_json as convert
+    else:
+        from nmap2json import nmap_file_to_json as convert
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    body = json.dumps(convert(path, True, True))
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{duration:.3f} {peak} {rss_kib} {len(body)}")
+
+
+def main():
+    """
+    Run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=2000)
+    parser.add_argument("--ports", type=int, default=4)
+    parser.add_argument("--measure", choices=("stream", "dom"), help=argparse.SUPPRESS)
+    parser.add_argument("--report", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.report)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report = os.path.join(tmp_dir, "report.xml")
+        write_synthetic_report(report, args.hosts, args.ports)
+        size_mib = os.path.getsize(report) / 2**20
+        print(f"Synthetic report: {args.hosts} hosts, {size_mib:.1f} MiB")
+        print(f"{'converter':<10} {'seconds':>8} {'peak MiB':>9} {'RSS MiB':>8}")
+        outputs = {}
+        for converter in ("dom", "stream"):
+            result = subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--measure",
+                    converter,
+                    "--report",
+                    report,
+                ],
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            duration, peak, rss_kib, body_size = result.stdout.split()
+            outputs[converter] = body_size
+            print(
+                f"{converter:<10} {float(duration):>8.3f} "
+                f"{int(peak) / 2**20:>9.1f} {int(rss_kib) / 1024:>8.1f}"
+            )
+        if outputs["dom"] != outputs["stream"]:
+            print("Output size mismatch between converters")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
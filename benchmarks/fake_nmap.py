@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Stand-in for the nmap executable in throughput benchmarks.
+
+The script reads the targets and the -oX report path of an agent Nmap command,
+then spends FAKE_NMAP_SECONDS writing the report host by host while printing
+Nmap progress lines. FAKE_NMAP_UP is the fraction of target addresses reported
+up and FAKE_NMAP_PORTS the open ports of each up host, they set the report
+size. When FAKE_NMAP_LOG is set, one JSON line with the run start, end and
+report size is appended to it.
+
+    FAKE_NMAP_SECONDS=2 python benchmarks/fake_nmap.py -oX out.xml \
+        --no-stylesheet 10.0.0.0/24
+"""
+
+import ipaddress
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from bench_xml_conversion import (
+    HOST_TEMPLATE,
+    PORT_TEMPLATE,
+)
+
+PROGRESS_STEPS = 20
+PHASE = "SYN Stealth Scan"
+
+
+def expand_targets(targets):
+    """
+    Return the addresses of Nmap targets, names count as one address.
+    """
+    addresses = []
+    for target in targets:
+        head, _, last = target.rpartition("-")
+        if "/" in target:
+            addresses.extend(
+                str(address) for address in ipaddress.ip_network(target, strict=False)
+            )
+        elif head and last.isdigit() and "." in head:
+            prefix, _, first = head.rpartition(".")
+            addresses.extend(
+                f"{prefix}.{octet}" for octet in range(int(first), int(last) + 1)
+            )
+        else:
+            addresses.append(target)
+    return addresses
+
+
+def parse_command(arguments):
+    """
+    Return the report path and the targets of an agent Nmap command.
+    """
+    output_xml = arguments[arguments.index("-oX") + 1]
+    rest = arguments[arguments.index("--no-stylesheet") + 1 :]
+    if rest[:1] == ["--script"]:
+        rest = rest[2:]
+    return output_xml, rest
+
+
+def host_block(index, address, ports):
+    """
+    Return the report block of an up host with ports open services.
+    """
+    port_block = "".join(
+        PORT_TEMPLATE.format(
+            port=443 + offset, state="open", index=index, pem="A" * 1200
+        )
+        for offset in range(ports)
+    )
+    return HOST_TEMPLATE.format(addr=address, index=index, ports=port_block)
+
+
+def main():
+    """
+    Emulate one Nmap run.
+    """
+    started = time.time()
+    seconds = float(os.environ.get("FAKE_NMAP_SECONDS", "5"))
+    up_ratio = float(os.environ.get("FAKE_NMAP_UP", "0.1"))
+    ports = int(os.environ.get("FAKE_NMAP_PORTS", "2"))
+    output_xml, targets = parse_command(sys.argv[1:])
+    addresses = expand_targets(targets)
+
+    print(
+        "Starting Nmap 7.94 ( https://nmap.org ) at "
+        f"{datetime.now().strftime('%Y-%m-%d %H:%M %Z').strip()}",
+        flush=True,
+    )
+    up = 0
+    step_size = max(1, -(-len(addresses) // PROGRESS_STEPS))
+    with open(output_xml, "w", encoding="utf-8") as report:
+        report.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        report.write(f'<nmaprun scanner="nmap" args="nmap {" ".join(sys.argv[1:])}">\n')
+        for first in range(0, len(addresses), step_size):
+            time.sleep(seconds * step_size / len(addresses))
+            for index in range(first, min(first + step_size, len(addresses))):
+                if int((index + 1) * up_ratio) > int(index * up_ratio):
+                    report.write(host_block(index, addresses[index], ports))
+                    up += 1
+            report.flush()
+            done = min(first + step_size, len(addresses))
+            elapsed = int(time.time() - started)
+            print(
+                f"Stats: 0:{elapsed // 60:02d}:{elapsed % 60:02d} elapsed; "
+                f"{done} hosts completed ({up} up), "
+                f"{len(addresses) - done} undergoing {PHASE}",
+                flush=True,
+            )
+            print(
+                f"{PHASE} Timing: About {done * 100 / len(addresses):.2f}% done",
+                flush=True,
+            )
+        report.write("</nmaprun>\n")
+    ended = time.time()
+    print(
+        f"Nmap done: {len(addresses)} IP addresses ({up} hosts up) "
+        f"scanned in {ended - started:.2f} seconds",
+        flush=True,
+    )
+
+    log_path = os.environ.get("FAKE_NMAP_LOG")
+    if log_path:
+        record = {
+            "report": os.path.basename(output_xml),
+            "start": started,
+            "end": ended,
+            "bytes": os.path.getsize(output_xml),
+        }
+        with open(log_path, "a", encoding="utf-8") as log:
+            log.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# coding=utf-8
+
+"""
+Local stand-in for a Plum Island controller.
+
+The server implements bot_api/beacon, getjob and sndjob with a fixed queue of
+generated jobs, a response latency and an error rate, and records when jobs
+are leased and when their results arrive. bench_throughput.py runs it in
+process; it can also be started alone to point an agent at it.
+
+    python benchmarks/mock_island.py --port 8080 --jobs 100 --latency 50
+"""
+
+import argparse
+import gzip
+import ipaddress
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CAPABILITIES = (
+    "json_body",
+    "batch_getjob",
+    "partial_results",
+    "gzip_results",
+)
+
+
+class MockIsland:
+    """
+    Serve queue_depth jobs of job_hosts addresses each. Every response waits
+    latency seconds, and error_rate of the getjob and sndjob requests are
+    answered with HTTP 503.
+    """
+
+    def __init__(
+        self,
+        queue_depth,
+        job_hosts=256,
+        latency=0.0,
+        error_rate=0.0,
+        capabilities=DEFAULT_CAPABILITIES,
+        seed=None,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.capabilities = list(capabilities)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.queue = [self._job(index, job_hosts) for index in range(queue_depth)]
+        self.queue_depth = queue_depth
+        self.leased = {}
+        self.completed = {}
+        self.getjob_requests = 0
+        self.empty_polls = 0
+        self.errors = 0
+        self.upload_bytes = 0
+        self.all_completed = threading.Event()
+        if queue_depth == 0:
+            self.all_completed.set()
+        self.server = None
+        self.thread = None
+
+    @staticmethod
+    def _job(index, job_hosts):
+        """
+        Return a job message scanning the index-th block of job_hosts
+        addresses of 10.0.0.0/8.
+        """
+        first = ipaddress.IPv4Address("10.0.0.0") + index * job_hosts
+        targets = ipaddress.summarize_address_range(first, first + job_hosts - 1)
+        return {
+            "job_uid": str(uuid.uuid4()),
+            "job": ",".join(str(network) for network in targets),
+            "nmap_ports": [80, 443],
+        }
+
+    def start(self, host="127.0.0.1", port=0):
+        """
+        Start serving in a background thread, return the island URL.
+        """
+        island = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Route the bot API endpoints to the island."""
+
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Answer one bot API request."""
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                status, answer = island.handle(
+                    self.path, body, self.headers.get("Content-Encoding")
+                )
+                payload = json.dumps(answer).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *_args):  # pylint: disable=arguments-differ
+                """Keep the benchmark output quiet."""
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+    def stop(self):
+        """
+        Stop serving.
+        """
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def handle(self, path, body, encoding):
+        """
+        Return the HTTP status and JSON answer of a bot API request.
+        """
+        time.sleep(self.latency)
+        endpoint = path.rstrip("/").rsplit("/", 1)[-1]
+        if endpoint == "beacon":
+            return 200, {"message": "ready", "capabilities": self.capabilities}
+        if endpoint not in ("getjob", "sndjob"):
+            return 404, {"message": "unknown endpoint"}
+        with self.lock:
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                return 503, {"message": "unavailable"}
+        size = len(body)
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        data = json.loads(body)
+        # Older wire formats double-encode the document.
+        if isinstance(data, str):
+            data = json.loads(data)
+        if endpoint == "getjob":
+            return 200, self._getjob(data)
+        return 200, self._sndjob(data, size)
+
+    def _getjob(self, data):
+        """
+        Lease the next queued jobs.
+        """
+        count = 1
+        if "batch_getjob" in self.capabilities:
+            count = max(1, int(data.get("JOB_COUNT") or 1))
+        now = time.time()
+        with self.lock:
+            self.getjob_requests += 1
+            jobs, self.queue = self.queue[:count], self.queue[count:]
+            if not jobs:
+                self.empty_polls += 1
+            for job in jobs:
+                self.leased[job["job_uid"]] = now
+        if "JOB_COUNT" in data and "batch_getjob" in self.capabilities:
+            return {"messages": jobs}
+        return {"message": jobs[0] if jobs else {}}
+
+    def _sndjob(self, data, size):
+        """
+        Record a result upload, the job ends with its final upload.
+        """
+        now = time.time()
+        with self.lock:
+            self.upload_bytes += size
+            job_uid = data.get("JOB_UID")
+            if data.get("JOB_COMPLETE") is not False and job_uid in self.leased:
+                self.completed.setdefault(job_uid, now)
+                if len(self.completed) == self.queue_depth:
+                    self.all_completed.set()
+        return {"message": "ok"}
+
+
+def main():
+    """
+    Serve a mock island until interrupted.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--job-hosts", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0, help="milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--capabilities", default=",".join(DEFAULT_CAPABILITIES))
+    args = parser.parse_args()
+
+    island = MockIsland(
+        args.jobs,
+        job_hosts=args.job_hosts,
+        latency=args.latency / 1000,
+        error_rate=args.error_rate,
+        capabilities=[item for item in args.capabilities.split(",") if item],
+    )
+    url = island.start(args.host, args.port)
+    print(f"Mock island serving {args.jobs} jobs on {url}")
+    try:
+        while not island.all_completed.wait(1):
+            pass
+        print(f"All {args.jobs} jobs completed")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        island.stop()
+
+
+if __name__ == "__main__":
+    main()
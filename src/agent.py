@@ -8,109 +8,91 @@ Plum Agent Main code
 import logging
 import os
 import argparse
+import atexit
 import sys
 import shlex
+import signal
 import uuid
 import time
-import json
-import base64
-import hashlib
+import functools
 import threading
-from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
-from datetime import datetime, timedelta
 import yaml
 from rich.logging import RichHandler
-from nmap2json import nmap_file_to_json
 from utils.meta import print_meta
-from utils.mutils import run_elf, terminate_running_elfs
-from utils.setup import setup
+from utils.mutils import run_elf, short_uid, terminate_running_elfs
+from utils.nmapoutput import (
+    NmapOutputProcessor,
+    RunningOutputs,
+    parse_nmap_output_rate,
+    parse_nmap_trace,
+)
+from utils.nmapargs import (
+    clamp_nmap_rates,
+    merge_nmap_defaults,
+    parse_nmap_additional_params,
+)
+from utils.nsestore import (
+    NseStore,
+    leased_nse_digests,
+    parse_nse_cache_max_mb,
+    resolve_nse_script,
+)
+from utils.setup import (
+    CAPABILITY_BATCH_GETJOB,
+    CAPABILITY_NSE_DIGEST,
+    reload_settings,
+    setup,
+)
 from utils.netutils import robust_request
-from utils.logrotation import parse_logrotation
-from utils.scanparallel import parse_scanparallel
+from utils.delivery import RESULT_DELIVERY_TIMEOUT, ResultDelivery
+from utils.postprocess import parse_result_workers
+from utils.prefetch import (
+    JobPrefetcher,
+    leased_jobs,
+    parse_prefetch_depth,
+    parse_prefetch_lease,
+)
+from utils.controlsignals import install_control_signals
+from utils.httpstats import log_connection_stats
+from utils.logqueue import LogPipeline, parse_log_queue_size
+from utils.logrotation import DailyLogFileHandler, parse_logrotation
+from utils.scanparallel import (
+    SCANPARALLEL_AUTO,
+    AdaptiveParallelism,
+    parse_scanparallel,
+    parse_scanparallel_bounds,
+)
+from utils.sharding import (
+    ScanSlots,
+    merge_shard_reports,
+    parse_shard_hosts,
+    run_shards,
+    split_targets,
+)
+from utils.ratebudget import RateBudget, parse_max_rate
+from utils.checkpoint import (
+    JobCheckpoints,
+    parse_scan_checkpoint,
+    remaining_targets,
+    scanned_targets,
+)
 from utils.scanhours import is_scanhours_active
+from utils.scheduler import NO_JOB_SLEEP, DaemonScheduler
+from utils.metrics import METRICS, MetricsServer, parse_metrics_listen
+from utils.tracing import JobTrace, parse_job_trace
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
-NO_JOB_SLEEP = 30
-STANDBY_SLEEP = 60
-BACKOFF_START = 5
-BACKOFF_MAX = 60
 NSE_CACHE_LOCK = threading.Lock()
-SHELL_CONTROL_CHARACTERS = frozenset(";&|<>`$()\r\n")
-MAX_NMAP_ADDITIONAL_PARAMS_LENGTH = 4096
+NSE_STORE = None
+JOB_CHECKPOINTS = None
+METRICS_SERVER = None
+SCHEDULER_WAKEUP = threading.Event()
+RELOAD_REQUESTED = threading.Event()
+DRAIN_REQUESTED = threading.Event()
+RUNNING_OUTPUTS = RunningOutputs()
+SCAN_SLOTS = ScanSlots(wakeup=SCHEDULER_WAKEUP)
+RATE_BUDGET = RateBudget(slots=lambda: SCAN_SLOTS.limit)
 MAX_INFO_NMAP_COMMAND_LENGTH = 132
-NMAP_DEFAULT_OPTIONS_WITH_VALUES = frozenset(
-    {"--host-timeout", "--max-retries", "--min-hostgroup"}
-)
-NMAP_RESERVED_LONG_OPTIONS = frozenset(
-    {
-        "--append-output",
-        "--exclude-ports",
-        "--no-stylesheet",
-        "--port-ratio",
-        "--resume",
-        "--script",
-        "--stylesheet",
-        "--top-ports",
-        "--webxml",
-    }
-)
-
-
-class DailyLogFileHandler(logging.FileHandler):
-    """
-    Write logs to agent-YYMMDD.log and delete logs outside the retention window.
-    """
-
-    def __init__(self, directory, keep_days=30):
-        self.directory = directory
-        self.keep_days = keep_days
-        self.current_day = datetime.now().date()
-        os.makedirs(self.directory, exist_ok=True)
-        super().__init__(self._log_path(self.current_day), mode="a", encoding="utf-8")
-        self._cleanup_old_logs()
-
-    def _log_path(self, day):
-        return os.path.join(self.directory, f"agent-{day:%y%m%d}.log")
-
-    def _cleanup_old_logs(self):
-        cutoff = datetime.now().date() - timedelta(days=self.keep_days - 1)
-        for filename in os.listdir(self.directory):
-            if not filename.startswith("agent-") or not filename.endswith(".log"):
-                continue
-
-            date_part = filename[len("agent-") : -len(".log")]
-            try:
-                log_day = datetime.strptime(date_part, "%y%m%d").date()
-            except ValueError:
-                continue
-
-            if log_day < cutoff:
-                try:
-                    os.remove(os.path.join(self.directory, filename))
-                except OSError:
-                    continue
-
-    def _rollover_if_needed(self):
-        today = datetime.now().date()
-        if today == self.current_day:
-            return
-
-        self.current_day = today
-        if self.stream:
-            self.stream.close()
-            self.stream = None
-
-        self.baseFilename = os.path.abspath(self._log_path(today))
-        self.stream = self._open()
-        self._cleanup_old_logs()
-
-    def emit(self, record):
-        self._rollover_if_needed()
-        super().emit(record)
-
-    def set_keep_days(self, keep_days):
-        self.keep_days = keep_days
-        self._cleanup_old_logs()
 
 
 # Initiate loggers.
@@ -150,282 +132,302 @@ try:
     file_handler.set_keep_days(parse_logrotation(CONFIG.get("logrotation")))
 except ValueError as error:
     logger.error("Invalid logrotation configuration, using default: %s", error)
+RESULT_DELIVERY = ResultDelivery(CONFIG)
 
 
-def _nse_cache_dir():
+def _result_spool_dir():
     """
-    Return the local cache directory for controller-managed NSE scripts.
+    Return the local spool directory for result uploads not yet delivered.
     """
-    cache_dir = os.path.join(CONFIG.get("THIS_DIR"), "nse_cache")
-    os.makedirs(cache_dir, exist_ok=True)
-    return cache_dir
+    return os.path.join(CONFIG.get("THIS_DIR"), "result_spool")
 
 
-def _safe_nse_filename(name):
+def _scan_state_dir():
     """
-    Restrict cached NSE files to their basename.
+    Return the directory of the checkpoints of running scan jobs.
     """
-    return os.path.basename(str(name or "").strip())
+    return os.path.join(CONFIG.get("THIS_DIR"), "scan_state")
 
 
-def _sha256_file(path):
+def _nse_cache_dir():
     """
-    Compute the SHA-256 of a local file.
+    Return the local cache directory for controller-managed NSE scripts.
     """
-    digest = hashlib.sha256()
-    with open(path, "rb") as handle:
-        for chunk in iter(lambda: handle.read(65536), b""):
-            digest.update(chunk)
-    return digest.hexdigest()
+    cache_dir = os.path.join(CONFIG.get("THIS_DIR"), "nse_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
 
 
-def _collect_nse_hashes():
+def _nse_store():
     """
-    Return the local NSE cache hashes keyed by filename.
+    Return the content-addressed NSE store, loading it on first use.
     """
+    global NSE_STORE  # pylint: disable=global-statement
     with NSE_CACHE_LOCK:
-        hashes = {}
-        cache_dir = _nse_cache_dir()
-        for entry in sorted(os.listdir(cache_dir)):
-            if not entry.endswith(".nse"):
-                continue
-            path = os.path.join(cache_dir, entry)
-            if os.path.isfile(path):
-                hashes[entry] = _sha256_file(path)
-        return hashes
+        if NSE_STORE is None:
+            max_mb = parse_nse_cache_max_mb(CONFIG.get("nse_cache_max_mb"))
+            NSE_STORE = NseStore(_nse_cache_dir(), max_mb * 1024 * 1024)
+        return NSE_STORE
 
 
-def _resolve_nse_targets(job_message):
+def _nse_cache_report():
+    """
+    Return the NSE cache fields of a getjob request.
+    """
+    if CAPABILITY_NSE_DIGEST in (CONFIG.get("island_capabilities") or []):
+        return {"NSE_DIGEST": _nse_store().digest()}
+    return {"NSE_HASHES": _nse_store().hashes()}
+
+
+def _resolve_nse_targets(job_message, view):
     """
     Ensure all requested NSE scripts are present locally and return the paths to use
     for Nmap. If the controller does not yet provide cache-aware payloads, fall back
-    to the raw script names for compatibility.
+    to the raw script names for compatibility. Stored scripts stay pinned until
+    _release_nse_view(view).
     """
     nse_descriptors = job_message.get("nse_scripts")
     if nse_descriptors is None:
         return job_message.get("nmap_nse") or []
 
-    with NSE_CACHE_LOCK:
-        cache_dir = _nse_cache_dir()
-        selected_paths = []
-
-        for descriptor in nse_descriptors:
-            nse_name = _safe_nse_filename(descriptor.get("name"))
-            expected_hash = str(descriptor.get("hash", "")).strip().lower()
-            if not nse_name or not expected_hash:
-                raise ValueError("Invalid NSE descriptor received from controller")
+    store = _nse_store()
+    return [
+        resolve_nse_script(store, view, descriptor) for descriptor in nse_descriptors
+    ]
 
-            nse_path = os.path.join(cache_dir, nse_name)
-            current_hash = _sha256_file(nse_path) if os.path.isfile(nse_path) else None
 
-            if current_hash != expected_hash:
-                content_b64 = descriptor.get("content_b64")
-                if not content_b64:
-                    raise ValueError(f"Missing updated NSE payload for {nse_name}")
+def _release_nse_view(view):
+    """
+    Drop the NSE scripts materialized for a job.
+    """
+    if NSE_STORE is not None:
+        NSE_STORE.release(view)
 
-                file_bytes = base64.b64decode(content_b64)
-                file_hash = hashlib.sha256(file_bytes).hexdigest()
-                if file_hash != expected_hash:
-                    raise ValueError(f"Hash mismatch for {nse_name}")
 
-                tmp_path = f"{nse_path}.{os.getpid()}.{threading.get_ident()}.tmp"
-                with open(tmp_path, "wb") as handle:
-                    handle.write(file_bytes)
-                os.replace(tmp_path, nse_path)
-                logger.info("NSE cache refresh: %s", nse_name)
-            else:
-                logger.info("NSE cache hit: %s", nse_name)
+def _build_nmap_args(
+    job_message, output_xml, nmap_ports, nmap_nse_targets, max_rate=None
+):
+    """
+    Build Nmap argv while keeping agent-managed arguments authoritative.
+    max_rate is the packets per second share of the agent rate budget.
+    """
+    additional_args = parse_nmap_additional_params(
+        job_message.get("nmap_additional_params")
+    )
+    default_args = [
+        "-T3",
+        "--host-timeout",
+        "40s",
+        "--max-retries",
+        "2",
+        "--min-hostgroup",
+        "256",
+        "-Pn",
+    ]
+    if max_rate:
+        # Lower profile rates replace the share through the default merge.
+        additional_args = clamp_nmap_rates(additional_args, max_rate)
+        default_args.extend(["--max-rate", str(max_rate)])
+    run_args = merge_nmap_defaults(default_args, additional_args)
 
-            selected_paths.append(nse_path)
+    if CONFIG.get("verbose"):
+        run_args.extend(["-v", "-script-trace"])
 
-        return selected_paths
+    run_args.extend(["-p", nmap_ports, "-oX", output_xml, "--no-stylesheet"])
+    if nmap_nse_targets:
+        run_args.extend(["--script", ",".join(nmap_nse_targets)])
+    run_args.extend(job_message.get("job", "").split(","))
+    return [argument for argument in run_args if argument]
 
 
-def _short_uid(value):
+def _format_command_for_log(executable, arguments):
     """
-    Return a compact UID for readable logs.
+    Render the exact executable argv as a copy-paste-safe command line.
     """
-    value = str(value or "")
-    if len(value) <= 12:
-        return value
-    return f"{value[:8]}...{value[-4:]}"
+    return shlex.join([executable, *arguments])
 
 
-def _nmap_option_name(token):
+def _truncate_command_for_info_log(command):
     """
-    Return the option name used for duplicate and reserved-option checks.
+    Bound the INFO command preview while reporting the original length.
     """
-    if token.startswith("--"):
-        return token.split("=", 1)[0]
-    if len(token) == 3 and token.startswith("-T") and token[2].isdigit():
-        return "-T"
-    return token
+    if len(command) <= MAX_INFO_NMAP_COMMAND_LENGTH:
+        return command
+
+    suffix = f"... [truncated, {len(command)} chars total]"
+    prefix_length = MAX_INFO_NMAP_COMMAND_LENGTH - len(suffix)
+    return f"{command[:prefix_length]}{suffix}"
 
 
-def _is_reserved_nmap_option(token):
+def _start_metrics_server():
     """
-    Keep job ports, output, and selected NSE scripts under agent control.
+    Serve the agent metrics when metrics_listen is set.
     """
-    if token in {"-", "--"}:
-        return True
-    option_name = _nmap_option_name(token)
-    if option_name in NMAP_RESERVED_LONG_OPTIONS:
-        return True
-    if token == "-p" or (token.startswith("-p") and not token.startswith("--")):
-        return True
-    return token.startswith(("-oA", "-oG", "-oN", "-oS", "-oX"))
+    global METRICS_SERVER  # pylint: disable=global-statement
+    listen = parse_metrics_listen(CONFIG.get("metrics_listen"))
+    if listen is None:
+        return None
+    METRICS.track("plum_jobs_running", lambda: SCAN_SLOTS.jobs)
+    METRICS.track("plum_scan_slots_busy", SCAN_SLOTS.busy)
+    METRICS.track("plum_scanparallel", lambda: SCAN_SLOTS.limit)
+    try:
+        METRICS_SERVER = MetricsServer(METRICS, *listen).start()
+    except OSError as error:
+        logger.error("Metrics endpoint cannot listen on %s:%s: %s", *listen, error)
+        return None
+    logger.info(
+        "Serving metrics on http://%s:%s/metrics",
+        METRICS_SERVER.host,
+        METRICS_SERVER.port,
+    )
+    return METRICS_SERVER
 
 
-def _validate_nmap_param_text(value):
+def _stop_metrics_server():
     """
-    Reject bounded-string violations and shell-control syntax.
+    Stop serving the agent metrics.
     """
-    if len(value) > MAX_NMAP_ADDITIONAL_PARAMS_LENGTH:
-        raise ValueError("nmap_additional_params exceeds 4096 characters")
-    if any(character in SHELL_CONTROL_CHARACTERS for character in value):
-        raise ValueError("nmap_additional_params contains shell-control syntax")
-    if any(ord(character) < 32 and character != "\t" for character in value):
-        raise ValueError("nmap_additional_params contains control characters")
+    global METRICS_SERVER  # pylint: disable=global-statement
+    if METRICS_SERVER is None:
+        return
+    METRICS_SERVER.stop()
+    METRICS_SERVER = None
 
 
-def _validate_nmap_param_tokens(tokens):
+def _start_job_trace():
     """
-    Reject agent-managed options and malformed default overrides.
+    Write the job trace records when job_trace is enabled.
     """
-    for index, token in enumerate(tokens):
-        if _is_reserved_nmap_option(token):
-            raise ValueError(f"Nmap option {token!r} is managed by the agent")
+    if not parse_job_trace(CONFIG.get("job_trace")):
+        return None
+    trace_log = RESULT_DELIVERY.start_trace(
+        os.path.join(CONFIG.get("THIS_DIR"), "log"),
+        parse_logrotation(CONFIG.get("logrotation")),
+    )
+    logger.info("Tracing job phases to %s", trace_log.handler.baseFilename)
+    return trace_log
+
 
-        option_name = _nmap_option_name(token)
-        if option_name not in NMAP_DEFAULT_OPTIONS_WITH_VALUES:
-            continue
-        if "=" in token:
-            if not token.split("=", 1)[1]:
-                raise ValueError(f"Nmap option {option_name!r} requires a value")
-            continue
-        if index + 1 == len(tokens) or tokens[index + 1].startswith("-"):
-            raise ValueError(f"Nmap option {option_name!r} requires a value")
+def _start_job_checkpoints():
+    """
+    Open the scan checkpoint store when scan_checkpoint is enabled.
+    """
+    global JOB_CHECKPOINTS  # pylint: disable=global-statement
+    if parse_scan_checkpoint(CONFIG.get("scan_checkpoint")):
+        JOB_CHECKPOINTS = JobCheckpoints(_scan_state_dir())
 
 
-def _parse_nmap_additional_params(value):
+def _checkpointed_jobs():
     """
-    Parse controller-provided Nmap parameters without shell evaluation.
+    Return the jobs interrupted by the previous agent run, oldest first.
     """
-    if value is None:
-        return []
-    if not isinstance(value, str):
-        raise ValueError("nmap_additional_params must be a string or null")
-    _validate_nmap_param_text(value)
-    if not value.strip():
+    if JOB_CHECKPOINTS is None:
         return []
+    jobs = JOB_CHECKPOINTS.jobs()
+    if jobs:
+        logger.info("Resuming %s interrupted jobs", len(jobs))
+    return jobs
 
-    try:
-        tokens = shlex.split(value, posix=True)
-    except ValueError as error:
-        raise ValueError(f"malformed nmap_additional_params: {error}") from error
 
-    _validate_nmap_param_tokens(tokens)
-    return tokens
+def _start_result_streamer(range_uid, output_xml):
+    """
+    Stream completed hosts while Nmap runs when the island accepts partial results.
+    """
+    on_sent = None
+    # A resumed job skips the hosts the island already received.
+    if JOB_CHECKPOINTS is not None:
+        on_sent = functools.partial(JOB_CHECKPOINTS.save_streamed, range_uid)
+    return RESULT_DELIVERY.start_streamer(range_uid, output_xml, on_sent)
 
 
-def _merge_nmap_defaults(default_args, additional_args):
+def _streamed_progress(range_uid, streamer, partial_xml):
     """
-    Remove overridden agent defaults, then append profile-level arguments.
+    Return the (hosts, batches) of a job the island already received, from
+    its streamer or from the checkpoint of the interrupted run. Batches
+    always hold the first hosts of the report in order.
     """
-    overrides = {_nmap_option_name(token) for token in additional_args}
-    merged_args = []
-    index = 0
-    while index < len(default_args):
-        token = default_args[index]
-        option_name = _nmap_option_name(token)
-        if option_name in overrides:
-            index += 2 if option_name in NMAP_DEFAULT_OPTIONS_WITH_VALUES else 1
-            continue
-        merged_args.append(token)
-        if option_name in NMAP_DEFAULT_OPTIONS_WITH_VALUES:
-            index += 1
-            merged_args.append(default_args[index])
-        index += 1
+    if streamer:
+        return streamer.hosts_sent, streamer.batches_sent
+    if partial_xml and JOB_CHECKPOINTS is not None:
+        return JOB_CHECKPOINTS.streamed(range_uid)
+    return 0, 0
 
-    return merged_args + additional_args
 
-
-def _build_nmap_args(job_message, output_xml, nmap_ports, nmap_nse_targets):
+def _nmap_output_processor(job_uid, range_uid):
     """
-    Build Nmap argv while keeping agent-managed arguments authoritative.
+    Return the processor handling the console output of a job's Nmap process.
     """
-    additional_args = _parse_nmap_additional_params(
-        job_message.get("nmap_additional_params")
+    trace_path = None
+    if parse_nmap_trace(CONFIG.get("nmap_trace")):
+        trace_dir = os.path.join(CONFIG.get("THIS_DIR"), "nmap_traces")
+        os.makedirs(trace_dir, exist_ok=True)
+        trace_path = os.path.join(trace_dir, f"{range_uid}.log.gz")
+    return NmapOutputProcessor(
+        job_uid, parse_nmap_output_rate(CONFIG.get("nmap_output_rate")), trace_path
     )
-    default_args = [
-        "-T3",
-        "--host-timeout",
-        "40s",
-        "--max-retries",
-        "2",
-        "--min-hostgroup",
-        "256",
-        "-Pn",
-    ]
-    run_args = _merge_nmap_defaults(default_args, additional_args)
 
-    if CONFIG.get("verbose"):
-        run_args.extend(["-v", "-script-trace"])
-
-    run_args.extend(["-p", nmap_ports, "-oX", output_xml, "--no-stylesheet"])
-    if nmap_nse_targets:
-        run_args.extend(["--script", ",".join(nmap_nse_targets)])
-    run_args.extend(job_message.get("job", "").split(","))
-    return [argument for argument in run_args if argument]
 
-
-def _format_command_for_log(executable, arguments):
+def job_progress():
     """
-    Render the exact executable argv as a copy-paste-safe command line.
+    Return the parsed Nmap progress of each running job keyed by job UID.
     """
-    return shlex.join([executable, *arguments])
+    return RUNNING_OUTPUTS.progress()
 
 
-def _truncate_command_for_info_log(command):
+def _batch_getjob_supported():
     """
-    Bound the INFO command preview while reporting the original length.
+    Return True when the island leases several jobs per getjob request.
     """
-    if len(command) <= MAX_INFO_NMAP_COMMAND_LENGTH:
-        return command
+    return CAPABILITY_BATCH_GETJOB in (CONFIG.get("island_capabilities") or [])
 
-    suffix = f"... [truncated, {len(command)} chars total]"
-    prefix_length = MAX_INFO_NMAP_COMMAND_LENGTH - len(suffix)
-    return f"{command[:prefix_length]}{suffix}"
 
-
-def fetch_job():
+def _request_jobs(count):
     """
-    Fetch one scan job from the controller.
+    Send one getjob request and return the jobs of the response.
     """
-
-    job_request = dict(CONFIG.get("botinfo") or {})
-    job_request["NSE_HASHES"] = _collect_nse_hashes()
+    batch = count > 1 and _batch_getjob_supported()
+    job_request = dict(CONFIG.get("botinfo") or {}) | _nse_cache_report()
+    if batch:
+        job_request["JOB_COUNT"] = count
+    started = time.monotonic()
     job = robust_request(
         CONFIG.get("APIPATH").getjob,
         method="POST",
         data=job_request,
         max_retries=1,
+        wire_format=RESULT_DELIVERY.wire_format(),
     )
-    if job is None or "message" not in job:
-        raise RuntimeError("Invalid job response from controller")
+    METRICS.observe("plum_getjob_seconds", time.monotonic() - started)
+    return leased_jobs(job, count, batch)
 
-    logger.debug("Message Received: %s", job.get("message"))
-    job_message = job.get("message") or {}
-    if not isinstance(job_message, dict):
-        raise RuntimeError("Invalid job message from controller")
 
-    # Validate JOB
-    range_toscan = job_message.get("job") or ""
-    if len(range_toscan) == 0:
+def fetch_jobs(count=1):
+    """
+    Fetch up to count scan jobs from the controller in a single request.
+    Islands without batch leasing return at most one job.
+    The NSE scripts advertised in the request are not evicted before the
+    leased jobs resolve them.
+    """
+    store = _nse_store()
+    with store.advertising():
+        jobs = _request_jobs(count)
+        store.protect(
+            leased_nse_digests(jobs),
+            parse_prefetch_lease(CONFIG.get("prefetch_lease")),
+        )
+    METRICS.inc("plum_getjob_requests_total")
+    if not jobs:
+        METRICS.inc("plum_getjob_empty_total")
         logger.info("No Job to process")
-        return None
+    return jobs
+
 
-    return job_message
+def fetch_job():
+    """
+    Fetch one scan job from the controller.
+    """
+    jobs = fetch_jobs(1)
+    return jobs[0] if jobs else None
 
 
 def run_scan_job(job_message):
@@ -433,34 +435,106 @@ def run_scan_job(job_message):
     Run one scan job already fetched from the controller.
     """
 
-    range_toscan = job_message.get("job") or ""
-
     # Validate the  UID
     range_uid = job_message.get("job_uid")
-    job_uid = _short_uid(range_uid)
+    job_uid = short_uid(range_uid)
     try:
         uuid.UUID(str(range_uid))
     except ValueError:
         logger.error("Job %s invalid UID format", job_uid)
         return False
 
-    nmap_ports_list = job_message.get("nmap_ports") or []
-    if not nmap_ports_list:
+    if not job_message.get("nmap_ports"):
         logger.error("Job %s has no port definition", job_uid)
         return False
 
-    nmap_ports = ",".join(str(i) for i in nmap_ports_list)
-    output_xml = os.path.join(CONFIG.get("THIS_DIR"), f"{range_uid}.xml")
+    checkpoints = JOB_CHECKPOINTS
+    partial_xml = None
+    if checkpoints:
+        partial_xml = checkpoints.merge_partial(
+            range_uid, CONFIG.get("THIS_DIR"), _report_path(range_uid)
+        )
+        checkpoints.save(range_uid, job_message)
+    if partial_xml:
+        addresses, names = scanned_targets(partial_xml)
+        job_message = job_message | {
+            "job": remaining_targets(job_message.get("job") or "", addresses, names)
+        }
+        logger.info("Job %s resumed, %s hosts already scanned", job_uid, len(addresses))
+
+    nse_view = uuid.uuid4().hex
+    trace = JobTrace(str(range_uid))
     try:
-        nmap_nse_targets = _resolve_nse_targets(job_message)
-        run_args = _build_nmap_args(
-            job_message, output_xml, nmap_ports, nmap_nse_targets
+        delivered = _run_scan(job_message, range_uid, nse_view, partial_xml, trace)
+    finally:
+        _release_nse_view(nse_view)
+    # Delivered jobs are traced once their result reaches the island.
+    if not delivered:
+        RESULT_DELIVERY.write_trace(
+            trace.record(status="interrupted" if delivered is None else "failed")
         )
-    except ValueError as error:
-        logger.error("Job %s cannot prepare scan: %s", job_uid, error)
-        return False
+    # An interrupted job keeps its checkpoint and is resumed on the next start.
+    if checkpoints and delivered is not None:
+        checkpoints.clear(range_uid)
+    return bool(delivered)
 
-    logger.info("Job %s received target=%s", job_uid, range_toscan)
+
+def _report_path(range_uid, index=None):
+    """
+    Return the Nmap report path of a job, or of one of its shards.
+    """
+    name = str(range_uid) if index is None else f"{range_uid}.{index}"
+    return os.path.join(CONFIG.get("THIS_DIR"), f"{name}.xml")
+
+
+def _job_shards(job_uid, range_uid, range_toscan, resumed=False):
+    """
+    Return the (targets, report path) pairs of the Nmap processes of a job.
+    The reports of a resumed job are merged with its partial report, so they
+    never use the job report path.
+    """
+    if resumed and not range_toscan:
+        return []
+    shards = split_targets(range_toscan, parse_shard_hosts(CONFIG.get("shard_hosts")))
+    if len(shards) == 1 and not resumed:
+        return [(range_toscan, _report_path(range_uid))]
+
+    if len(shards) > 1:
+        logger.info("Job %s split into %s shards", job_uid, len(shards))
+    return [
+        (targets, _report_path(range_uid, index))
+        for index, targets in enumerate(shards)
+    ]
+
+
+def _shard_builders(job_message, shards, nse_view, trace):
+    """
+    Return the argv builder of each shard, see _run_nmap. Invalid arguments
+    raise ValueError before any process starts.
+    """
+    nmap_ports = ",".join(str(i) for i in job_message.get("nmap_ports"))
+    with trace.span("nse"):
+        nmap_nse_targets = _resolve_nse_targets(job_message, nse_view)
+    with trace.span("argv"):
+        shard_builders = [
+            functools.partial(
+                _build_nmap_args,
+                job_message | {"job": targets},
+                path,
+                nmap_ports,
+                nmap_nse_targets,
+            )
+            for targets, path in shards
+        ]
+        for build_args in shard_builders:
+            build_args()
+    return shard_builders
+
+
+def _log_nmap_command(job_uid, run_args):
+    """
+    Log the Nmap command about to run, truncated at info level.
+    """
     full_command = _format_command_for_log(CONFIG.get("nmap_path"), run_args)
     logger.info(
         "Job %s Nmap command: %s",
@@ -468,36 +542,138 @@ def run_scan_job(job_message):
         _truncate_command_for_info_log(full_command),
     )
     logger.debug("Job %s full Nmap command: %s", job_uid, full_command)
+
+
+def _run_nmap(job_uid, progress_key, build_args, trace):
+    """
+    Run one Nmap process with its output processor, return its exit code.
+    build_args(max_rate=...) returns the argv for the rate budget share.
+    """
+    with RATE_BUDGET.share() as max_rate:
+        run_args = build_args(max_rate=max_rate)
+        if max_rate:
+            logger.info("Job %s rate budget share %s packets/s", job_uid, max_rate)
+        _log_nmap_command(job_uid, run_args)
+        nmap_output = _nmap_output_processor(job_uid, progress_key)
+        started = time.monotonic()
+        try:
+            with RUNNING_OUTPUTS.running(progress_key, nmap_output), trace.span("nmap"):
+                return run_elf(
+                    CONFIG.get("nmap_path"), run_args, line_handler=nmap_output.feed
+                )
+        finally:
+            METRICS.observe("plum_nmap_duration_seconds", time.monotonic() - started)
+            nmap_output.close()
+
+
+def _run_shard_processes(job_uid, range_uid, shard_builders, trace):
+    """
+    Run the Nmap processes of a job, a sharded job on the slots it borrows.
+    Return the exit code of each process, see run_shards.
+    """
+    if len(shard_builders) == 1:
+        return [_run_nmap(job_uid, range_uid, shard_builders[0], trace)]
+    return run_shards(
+        job_uid,
+        SCAN_SLOTS,
+        [
+            functools.partial(
+                _run_nmap, job_uid, f"{range_uid}.{index}", build_args, trace
+            )
+            for index, build_args in enumerate(shard_builders)
+        ],
+    )
+
+
+def _run_scan(job_message, range_uid, nse_view, partial_xml, trace):
+    """
+    Run Nmap for a validated job and deliver its results. Return True once
+    delivered, False on failure and None when Nmap was interrupted.
+    partial_xml holds the hosts scanned before the job was resumed, trace
+    times the job phases.
+    """
+    range_toscan = job_message.get("job") or ""
+    job_uid = short_uid(range_uid)
+    output_xml = _report_path(range_uid)
+    shards = _job_shards(job_uid, range_uid, range_toscan, resumed=bool(partial_xml))
+    try:
+        shard_builders = _shard_builders(job_message, shards, nse_view, trace)
+    except ValueError as error:
+        logger.error("Job %s cannot prepare scan: %s", job_uid, error)
+        return False
+
+    logger.info("Job %s received target=%s", job_uid, range_toscan)
     logger.info("Job %s scan started", job_uid)
-    return_code = run_elf(CONFIG.get("nmap_path"), run_args)
-    if return_code and return_code < 0:
+    if not shards:
+        logger.info("Job %s has no target left to scan", job_uid)
+
+    # Only a job writing its own report streams it while Nmap runs.
+    streamer = None
+    if [path for _, path in shards] == [output_xml]:
+        streamer = _start_result_streamer(range_uid, output_xml)
+    try:
+        return_codes = _run_shard_processes(job_uid, range_uid, shard_builders, trace)
+    finally:
+        streamed_results = streamer.finish() if streamer else None
+
+    if any(code is None or code < 0 for code in return_codes):
         logger.warning("Job %s scan interrupted", job_uid)
-        return False
-    if return_code:
-        logger.error("Job %s scan process exited with code %s", job_uid, return_code)
+        return None
+    for return_code in return_codes:
+        if return_code:
+            logger.error(
+                "Job %s scan process exited with code %s", job_uid, return_code
+            )
+    if len(shards) > 1 or partial_xml:
+        with trace.span("merge"):
+            merge_shard_reports(job_uid, shards, output_xml, partial_xml)
+    return _deliver_report(range_uid, partial_xml, streamer, streamed_results, trace)
+
+
+def _deliver_report(range_uid, partial_xml, streamer, streamed_results, trace):
+    """
+    Deliver the result of a finished scan, return True once it is spooled
+    or delivered. The hosts the island already received are left out, the
+    report is kept when the result cannot be sent.
+    """
+    job_uid = short_uid(range_uid)
+    output_xml = _report_path(range_uid)
+    hosts_sent, batches_sent = _streamed_progress(range_uid, streamer, partial_xml)
+    extra = None
+    if streamer or batches_sent:
+        extra = {"BATCH": batches_sent, "JOB_COMPLETE": True}
 
     results = {}
+    meta = body = None
     # fetching report.
-    if os.path.isfile(output_xml):
-        results = nmap_file_to_json(output_xml, True, True)
-        os.remove(output_xml)
+    report_found = os.path.isfile(output_xml)
+    if report_found:
+        METRICS.observe("plum_nmap_report_bytes", os.path.getsize(output_xml))
+        if streamer and not streamer.broken:
+            results = streamed_results
+        else:
+            meta, body = RESULT_DELIVERY.report_body(
+                range_uid, output_xml, hosts_sent, extra, trace
+            )
     else:
         logger.error("Job %s no scan output file", job_uid)
 
-    data = dict(CONFIG.get("botinfo") or {})
-    data = data | {"JOB_UID": str(range_uid), "RESULT": json.dumps(results)}
-
-    result_response = robust_request(
-        CONFIG.get("APIPATH").sndjob,
-        method="POST",
-        data=data,
-        max_retries=3,
-    )
-    if result_response is None:
+    if meta is None:
+        with trace.span("serialize"):
+            meta, body = RESULT_DELIVERY.body(
+                range_uid, results, RESULT_DELIVERY.timing_extra(extra, trace)
+            )
+    if not RESULT_DELIVERY.deliver(meta, body, trace):
         logger.error("Job %s result send failed", job_uid)
+        if report_found:
+            logger.error("Job %s Nmap report kept in %s", job_uid, output_xml)
         return False
+    # The report is only removed once the result is spooled or delivered.
+    if report_found:
+        os.remove(output_xml)
 
     logger.info("Job %s scan completed", job_uid)
+    log_connection_stats(logging.DEBUG)
     return True
 
 
@@ -542,133 +718,194 @@ def _scanparallel_value():
         sys.exit(7)
 
 
-def _drain_finished_jobs(running, finished=None):
+def _scanparallel_bounds():
     """
-    Remove completed worker futures and log failures.
+    Return the configured bounds of scanparallel auto.
     """
-    if finished is None:
-        finished = [future for future in running if future.done()]
+    try:
+        return parse_scanparallel_bounds(
+            CONFIG.get("scanparallel_min"), CONFIG.get("scanparallel_max")
+        )
+    except ValueError as error:
+        logger.error("Invalid scanparallel configuration: %s", error)
+        sys.exit(7)
 
-    for future in finished:
-        job_uid = running.pop(future, "unknown")
-        try:
-            if not future.result():
-                logger.error("Job %s failed", job_uid)
-        except Exception:
-            logger.exception("Job %s worker failed", job_uid)
+
+def _install_control_signals():
+    """
+    Reload the configuration on SIGHUP and drain the agent on SIGUSR1.
+    """
+    install_control_signals(
+        {signal.SIGHUP: RELOAD_REQUESTED, signal.SIGUSR1: DRAIN_REQUESTED},
+        SCHEDULER_WAKEUP,
+    )
 
 
-def _wait_for_worker_or_sleep(running, delay):
+def _reload_config():
     """
-    Sleep until a worker finishes or until delay expires.
+    Re-read the reloadable settings from config/config.yaml into CONFIG.
+    Invalid settings are logged and the current ones kept. Return True
+    when the settings were applied.
     """
-    if not running:
-        time.sleep(delay)
-        return
+    config_file = os.path.join(CONFIG.get("THIS_DIR"), "config", "config.yaml")
+    try:
+        keep_days, changed = reload_settings(CONFIG, config_file)
+    except (OSError, yaml.YAMLError) as error:
+        logger.error("Configuration reload failed: %s", error)
+        return False
+    except ValueError as error:
+        logger.error("Configuration reload rejected: %s", error)
+        return False
 
-    finished, _ = wait(set(running), timeout=delay, return_when=FIRST_COMPLETED)
-    _drain_finished_jobs(running, finished)
+    file_handler.set_keep_days(keep_days)
+    if RESULT_DELIVERY.trace_log is not None:
+        RESULT_DELIVERY.trace_log.set_keep_days(keep_days)
+    logger.info("Configuration reloaded: %s", ", ".join(changed) or "no change")
+    return True
 
 
-def _run_daemon_loop(scanparallel):
+def _scan_parallelism(scanparallel, controller=None):
     """
-    Run daemon scheduler with bounded scan parallelism.
+    Return the (controller, slot limit, worker count) of a scanparallel value.
+    A running auto controller keeps its limit within the new bounds.
     """
-    backoff_delay = BACKOFF_START
-    max_workers = max(scanparallel, 1)
+    if scanparallel != SCANPARALLEL_AUTO:
+        return None, scanparallel, max(scanparallel, 1)
 
-    logger.info("Starting to work endlessly with scanparallel=%s", scanparallel)
-    executor = ThreadPoolExecutor(max_workers=max_workers)
-    running = {}
-    last_scanhours_standby_log = None
-    try:
-        while True:
-            _drain_finished_jobs(running)
-
-            if not _scanhours_enabled():
-                now = time.monotonic()
-                if (
-                    last_scanhours_standby_log is None
-                    or now - last_scanhours_standby_log >= 3600
-                ):
-                    logger.info(
-                        "Outside scanhours %s GMT, standby", CONFIG.get("scanhours")
-                    )
-                    last_scanhours_standby_log = now
-                _wait_for_worker_or_sleep(running, STANDBY_SLEEP)
-                continue
-
-            if scanparallel == 0:
-                logger.info("scanparallel is 0, standby")
-                _wait_for_worker_or_sleep(running, STANDBY_SLEEP)
-                continue
-
-            if len(running) >= scanparallel:
-                _wait_for_worker_or_sleep(running, STANDBY_SLEEP)
-                continue
-
-            no_job = False
-            controller_error = False
-
-            while len(running) < scanparallel:
-                try:
-                    job_message = fetch_job()
-                    backoff_delay = BACKOFF_START
-                except RuntimeError as error:
-                    logger.error("%s", error)
-                    controller_error = True
-                    break
-
-                if not job_message:
-                    no_job = True
-                    break
-
-                job_uid = _short_uid(job_message.get("job_uid"))
-                future = executor.submit(run_scan_job, job_message)
-                running[future] = job_uid
-                logger.info(
-                    "Job %s queued (%s/%s running)",
-                    job_uid,
-                    len(running),
-                    scanparallel,
-                )
+    minimum, maximum = _scanparallel_bounds()
+    if controller is None:
+        controller = AdaptiveParallelism(minimum, maximum)
+    else:
+        controller.minimum, controller.maximum = minimum, maximum
+        controller.limit = min(max(controller.limit, minimum), maximum)
+    return controller, controller.limit, maximum
 
-            if controller_error:
-                logger.info("Controller backoff %ss", backoff_delay)
-                _wait_for_worker_or_sleep(running, backoff_delay)
-                backoff_delay = min(backoff_delay * 2, BACKOFF_MAX)
-            elif no_job:
-                logger.info("Sleeping %ss", NO_JOB_SLEEP)
-                _wait_for_worker_or_sleep(running, NO_JOB_SLEEP)
-    except KeyboardInterrupt:
-        logger.warning("Stopping running scans")
-        terminate_running_elfs()
-        raise
-    finally:
-        if running:
-            terminate_running_elfs()
-        executor.shutdown(wait=False, cancel_futures=True)
 
+def _start_prefetcher(scanparallel):
+    """
+    Start the job prefetcher when a prefetch depth is configured.
+    """
+    depth = parse_prefetch_depth(CONFIG.get("prefetch_depth"))
+    if depth == 0 or scanparallel == 0:
+        return None
 
-def loop(repeat):
+    prefetcher = JobPrefetcher(
+        fetch_jobs,
+        depth,
+        parse_prefetch_lease(CONFIG.get("prefetch_lease")),
+        active=_scanhours_enabled,
+        wakeup=SCHEDULER_WAKEUP,
+    )
+    logger.info("Prefetching up to %s jobs", depth)
+    prefetcher.start()
+    return prefetcher
+
+
+class _AgentScheduler(DaemonScheduler):
     """
-    Main Loop for Agent Execution
+    Daemon scheduler of the agent scan jobs.
     """
 
-    scanparallel = _scanparallel_value()
+    def parallelism(self, scanparallel, controller):
+        return _scan_parallelism(scanparallel, controller)
 
-    if repeat:
-        _run_daemon_loop(scanparallel)
-        return
+    def reload(self):
+        return _scanparallel_value() if _reload_config() else None
+
+    def run_job(self, job_message):
+        return run_scan_job(job_message)
+
+    def fetch_jobs(self, count):
+        return fetch_jobs(count)
+
+    def batch_supported(self):
+        return _batch_getjob_supported()
+
+    def scanhours_enabled(self):
+        return _scanhours_enabled()
+
+    def scanhours(self):
+        return CONFIG.get("scanhours")
+
+    def hosts_reported(self):
+        return RUNNING_OUTPUTS.hosts_reported()
+
+    def start_prefetcher(self, limit):
+        return _start_prefetcher(limit)
+
+    def terminate_running(self):
+        terminate_running_elfs()
 
+
+def _run_daemon_loop(scanparallel):
+    """
+    Run daemon scheduler with bounded scan parallelism.
+    """
+    scheduler = _AgentScheduler(
+        SCAN_SLOTS, SCHEDULER_WAKEUP, RELOAD_REQUESTED, DRAIN_REQUESTED
+    )
+    try:
+        scheduler.run(scanparallel, _checkpointed_jobs())
+    finally:
+        log_connection_stats()
+
+
+def _run_once(scanparallel):
+    """
+    Run a single scan job.
+    """
     logger.info("Starting to work one time")
+    if scanparallel == SCANPARALLEL_AUTO:
+        scanparallel = _scanparallel_bounds()[0]
     if not _scanhours_enabled():
         logger.info("Outside scanhours %s GMT, standby", CONFIG.get("scanhours"))
         return
     if scanparallel == 0:
         logger.info("scanparallel is 0, standby")
         return
-    scan()
+    SCAN_SLOTS.configure(scanparallel)
+    resumed = _checkpointed_jobs()
+    SCAN_SLOTS.job_started()
+    try:
+        if resumed:
+            run_scan_job(resumed[0])
+        else:
+            scan()
+    finally:
+        SCAN_SLOTS.job_finished()
+
+
+def loop(repeat):
+    """
+    Main Loop for Agent Execution
+    """
+
+    scanparallel = _scanparallel_value()
+
+    _nse_store()
+    RATE_BUDGET.configure(parse_max_rate(CONFIG.get("max_rate")))
+    _start_job_checkpoints()
+    _start_job_trace()
+    _start_metrics_server()
+    RESULT_DELIVERY.start_uploader(_result_spool_dir())
+    RESULT_DELIVERY.start_converter(parse_result_workers(CONFIG.get("result_workers")))
+    try:
+        if repeat:
+            _install_control_signals()
+            _run_daemon_loop(scanparallel)
+        else:
+            _run_once(scanparallel)
+    except KeyboardInterrupt:
+        RESULT_DELIVERY.stop_uploader(timeout=0)
+        raise
+    finally:
+        RESULT_DELIVERY.stop_converter()
+    # A drained agent exits only once every result was delivered.
+    RESULT_DELIVERY.stop_uploader(
+        timeout=None if DRAIN_REQUESTED.is_set() else RESULT_DELIVERY_TIMEOUT
+    )
+    _stop_metrics_server()
+    RESULT_DELIVERY.stop_trace()
 
 
 if __name__ == "__main__":
@@ -690,7 +927,7 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "-scanparallel",
-        help="Maximum scan jobs to run in parallel, 0 for standby",
+        help="Maximum scan jobs to run in parallel, 0 for standby, auto to adapt",
     )
     parser.add_argument(
         "-logrotation",
@@ -703,6 +940,14 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    # Move console and file output to the background log pipeline
+    try:
+        log_queue_size = parse_log_queue_size(CONFIG.get("log_queue_size"))
+    except ValueError as error:
+        logger.error("Invalid log_queue_size configuration: %s", error)
+        sys.exit(15)
+    log_pipeline = LogPipeline(logger, log_queue_size)
+
     # Set Verbosity if required, including requests
     if args.verbose:
         CONFIG["verbose"] = True
@@ -716,16 +961,11 @@ if __name__ == "__main__":
         for h in list(urllib3_logger.handlers):
             urllib3_logger.removeHandler(h)
 
-        # Put handler to our direct handler
-        class RedirectHandler(logging.Handler):
-            """
-            Black magic to put handler to our direct handler
-            """
-
-            def emit(self, record):
-                logger.handle(record)
+        # Send urllib3 records through the agent log pipeline
+        urllib3_logger.addHandler(log_pipeline.handler)
 
-        urllib3_logger.addHandler(RedirectHandler())
+    log_pipeline.start()
+    atexit.register(log_pipeline.stop)
 
     # Start of application.
     print_meta()
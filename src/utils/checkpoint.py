@@ -0,0 +1,256 @@
+"""
+Checkpoints of running scan jobs, resumed after an agent restart.
+"""
+
+import bisect
+import ipaddress
+import json
+import logging
+import os
+import threading
+import xml.etree.ElementTree as ET
+from utils.xmlstream import merge_nmap_reports
+
+logger = logging.getLogger("Plum_Agent")
+
+CHECKPOINT_SUFFIX = ".json"
+PARTIAL_SUFFIX = ".partial.xml"
+STREAMED_SUFFIX = ".streamed"
+
+
+def parse_scan_checkpoint(value, default=False):
+    """
+    Parse the scan checkpoint switch.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+
+    value = str(value).strip().lower()
+    if not value:
+        return default
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise ValueError("scan_checkpoint must be a boolean")
+
+
+class JobCheckpoints:
+    """
+    Store the message of each running job and the hosts its interrupted
+    Nmap processes already reported.
+
+    A job message is kept as <job_uid>.json until the job ends. The complete
+    hosts of interrupted Nmap reports are merged into <job_uid>.partial.xml
+    when the job is resumed. The hosts and batches already streamed to the
+    island are counted in <job_uid>.streamed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        for entry in os.listdir(self.directory):
+            if entry.endswith(".tmp"):
+                os.remove(os.path.join(self.directory, entry))
+
+    def _path(self, range_uid):
+        return os.path.join(self.directory, f"{range_uid}{CHECKPOINT_SUFFIX}")
+
+    def partial_path(self, range_uid):
+        """
+        Return the path of the hosts already scanned by a job.
+        """
+        return os.path.join(self.directory, f"{range_uid}{PARTIAL_SUFFIX}")
+
+    def _streamed_path(self, range_uid):
+        return os.path.join(self.directory, f"{range_uid}{STREAMED_SUFFIX}")
+
+    @staticmethod
+    def _write(path, data):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(data, handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, path)
+
+    def save(self, range_uid, job_message):
+        """
+        Persist the message of a starting job.
+        """
+        self._write(self._path(range_uid), job_message)
+
+    def save_streamed(self, range_uid, hosts_sent, batches_sent):
+        """
+        Persist the hosts and batches of a job the island received.
+        """
+        self._write(
+            self._streamed_path(range_uid),
+            {"hosts_sent": hosts_sent, "batches_sent": batches_sent},
+        )
+
+    def streamed(self, range_uid):
+        """
+        Return the (hosts, batches) of a job already streamed to the island.
+        """
+        try:
+            with open(self._streamed_path(range_uid), "r", encoding="utf-8") as handle:
+                streamed = json.load(handle)
+            return int(streamed["hosts_sent"]), int(streamed["batches_sent"])
+        except FileNotFoundError:
+            return 0, 0
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            logger.error("Job %s streamed hosts unreadable: %s", range_uid, error)
+            return 0, 0
+
+    def jobs(self):
+        """
+        Return the messages of interrupted jobs, oldest first.
+        """
+        paths = [
+            os.path.join(self.directory, entry)
+            for entry in os.listdir(self.directory)
+            if entry.endswith(CHECKPOINT_SUFFIX)
+        ]
+        messages = []
+        for path in sorted(paths, key=os.path.getmtime):
+            try:
+                with open(path, "r", encoding="utf-8") as handle:
+                    messages.append(json.load(handle))
+            except (OSError, ValueError) as error:
+                logger.error("Dropping unreadable checkpoint %s: %s", path, error)
+                os.remove(path)
+        return messages
+
+    def merge_partial(self, range_uid, report_dir, output_xml):
+        """
+        Merge the reports left in report_dir by interrupted Nmap processes of
+        a job into its partial report. Return the partial report path, None
+        for a new job.
+        """
+        partial_xml = self.partial_path(range_uid)
+        shard_reports = sorted(
+            os.path.join(report_dir, entry)
+            for entry in os.listdir(report_dir)
+            if entry.startswith(f"{range_uid}.") and entry.endswith(".xml")
+        )
+        reports = [
+            path
+            for path in dict.fromkeys([partial_xml, output_xml] + shard_reports)
+            if os.path.isfile(path)
+        ]
+        if not reports:
+            return None
+
+        merged_xml = f"{partial_xml}.merge.tmp"
+        merge_nmap_reports(reports, merged_xml, unique=True)
+        os.replace(merged_xml, partial_xml)
+        for path in reports:
+            if path != partial_xml:
+                os.remove(path)
+        return partial_xml
+
+    def clear(self, range_uid):
+        """
+        Forget a job that ended.
+        """
+        for path in (
+            self._path(range_uid),
+            self.partial_path(range_uid),
+            self._streamed_path(range_uid),
+        ):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def scanned_targets(xml_file):
+    """
+    Return the addresses and the user supplied host names of the complete
+    hosts of an Nmap XML report, which may be truncated.
+    """
+    addresses = set()
+    names = set()
+    depth = 0
+    try:
+        for event, element in ET.iterparse(xml_file, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 1 or element.tag != "host":
+                continue
+            for address in element.iter("address"):
+                if address.get("addrtype") in ("ipv4", "ipv6"):
+                    addresses.add(address.get("addr"))
+            for hostname in element.iter("hostname"):
+                if hostname.get("type") == "user":
+                    names.add(hostname.get("name", "").lower())
+            element.clear()
+    except ET.ParseError:
+        pass
+    return addresses, names
+
+
+def _unscanned_blocks(network, scanned):
+    """
+    Return the target strings of the addresses of network that were not
+    scanned, None when none was. scanned holds the sorted integers of the
+    scanned addresses of the network IP version.
+    """
+    start = int(network.network_address)
+    end = int(network.broadcast_address)
+    first = bisect.bisect_left(scanned, start)
+    last = bisect.bisect_right(scanned, end)
+    if first == last:
+        return None
+    address_class = type(network.network_address)
+
+    blocks = []
+    cursor = start
+    for value in scanned[first:last] + [end + 1]:
+        if value > cursor:
+            blocks.extend(
+                ipaddress.summarize_address_range(
+                    address_class(cursor), address_class(value - 1)
+                )
+            )
+        cursor = value + 1
+    return [
+        str(block.network_address) if block.num_addresses == 1 else str(block)
+        for block in blocks
+    ]
+
+
+def remaining_targets(targets, addresses, names):
+    """
+    Return the comma-separated targets Nmap has not reported yet. CIDR blocks
+    are reduced to their unscanned subnets, host names are dropped once
+    reported. Nmap range expressions are kept whole.
+    """
+    scanned = {4: [], 6: []}
+    for address in addresses:
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            continue
+        scanned[address.version].append(int(address))
+    for values in scanned.values():
+        values.sort()
+
+    remaining = []
+    for token in (token.strip() for token in targets.split(",")):
+        if not token:
+            continue
+        try:
+            network = ipaddress.ip_network(token, strict=False)
+        except ValueError:
+            if token.lower() not in names:
+                remaining.append(token)
+            continue
+        blocks = _unscanned_blocks(network, scanned[network.version])
+        remaining.extend([token] if blocks is None else blocks)
+    return ",".join(remaining)
@@ -0,0 +1,136 @@
+"""
+Helpers for compressed result uploads.
+"""
+
+import gzip
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+ENCODING_GZIP = "gzip"
+ENCODING_ZSTD = "zstd"
+COMPRESSION_LEVELS = {ENCODING_GZIP: (1, 9), ENCODING_ZSTD: (1, 22)}
+DEFAULT_COMPRESSION_LEVELS = {ENCODING_GZIP: 6, ENCODING_ZSTD: 3}
+
+
+def available_encodings():
+    """
+    Return the request body encodings usable on this host, preferred first.
+    """
+    if zstandard is not None:
+        return [ENCODING_ZSTD, ENCODING_GZIP]
+    return [ENCODING_GZIP]
+
+
+def parse_result_compression(value, default="auto"):
+    """
+    Parse the result upload compression: auto, gzip, zstd or none.
+    """
+    if value is None or value is True:
+        return default
+    if value is False:
+        return "none"
+
+    value = str(value).strip().lower()
+    if not value:
+        return default
+    if value in ("none", "off", "no", "false"):
+        return "none"
+    if value == "auto":
+        return value
+    if value not in COMPRESSION_LEVELS:
+        raise ValueError("result_compression must be auto, gzip, zstd or none")
+    if value not in available_encodings():
+        raise ValueError(f"result_compression {value} requires the zstandard package")
+    return value
+
+
+def parse_compression_threshold(value, default=65536):
+    """
+    Parse the minimum result size in bytes before compression is applied.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError("result_compression_threshold must be an integer >= 0")
+
+    if isinstance(value, str) and not value.strip():
+        return default
+
+    try:
+        threshold = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError(
+            "result_compression_threshold must be an integer >= 0"
+        ) from error
+
+    if threshold < 0:
+        raise ValueError("result_compression_threshold must be an integer >= 0")
+
+    return threshold
+
+
+def parse_compression_level(value, encoding):
+    """
+    Parse the compression level for the selected encoding.
+    """
+    default = DEFAULT_COMPRESSION_LEVELS.get(encoding)
+    if value is None or encoding not in COMPRESSION_LEVELS:
+        return default
+    if isinstance(value, bool):
+        raise ValueError("result_compression_level must be an integer")
+
+    if isinstance(value, str) and not value.strip():
+        return default
+
+    try:
+        level = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError("result_compression_level must be an integer") from error
+
+    low, high = COMPRESSION_LEVELS[encoding]
+    if level < low or level > high:
+        raise ValueError(
+            f"result_compression_level must be between {low} and {high} for {encoding}"
+        )
+
+    return level
+
+
+def compression_level_setting(cfg, encoding):
+    """
+    Return the configured level for encoding, result_compression_level_<encoding>
+    takes precedence over the shared result_compression_level.
+    """
+    value = cfg.get(f"result_compression_level_{encoding}")
+    if value is None:
+        value = cfg.get("result_compression_level")
+    return value
+
+
+def compress_body(body, encoding, level=None):
+    """
+    Compress a request body with the given content encoding.
+    """
+    if level is None:
+        level = DEFAULT_COMPRESSION_LEVELS[encoding]
+    if encoding == ENCODING_GZIP:
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    if encoding == ENCODING_ZSTD and zstandard is not None:
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    raise ValueError(f"Unsupported content encoding {encoding}")
+
+
+def decompress_body(body, encoding):
+    """
+    Reverse compress_body.
+    """
+    if not encoding:
+        return body
+    if encoding == ENCODING_GZIP:
+        return gzip.decompress(body)
+    if encoding == ENCODING_ZSTD and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(body)
+    raise ValueError(f"Unsupported content encoding {encoding}")
@@ -0,0 +1,61 @@
+"""
+Control signals forwarded to a listener thread through a self-pipe.
+"""
+
+import os
+import signal
+import threading
+
+# Write end of the pipe the signal handlers write to, and the control request
+# set for each signal.
+_PIPE = None
+_REQUESTS = {}
+
+
+def request_control(request, wakeup):
+    """
+    Set a control request and wake the scheduler.
+    """
+    request.set()
+    wakeup.set()
+
+
+def forward_control_signal(signum, _frame):
+    """
+    Pass a control signal to the listener thread through the control pipe.
+    The interrupted thread may hold the lock of any event, so the handler
+    only writes to the pipe.
+    """
+    try:
+        os.write(_PIPE, bytes([signum]))
+    except BlockingIOError:
+        pass  # A full pipe already wakes the listener.
+
+
+def _listen_control_signals(read_fd, wakeup):
+    """
+    Turn the signals written to the control pipe into control requests.
+    """
+    while True:
+        for signum in os.read(read_fd, 64):
+            request_control(_REQUESTS[signum], wakeup)
+
+
+def install_control_signals(requests_by_signal, wakeup):
+    """
+    Set the control request of requests_by_signal when its signal arrives,
+    then wake the scheduler.
+    """
+    global _PIPE  # pylint: disable=global-statement
+    _REQUESTS.update(requests_by_signal)
+    if _PIPE is None:
+        read_fd, _PIPE = os.pipe()
+        os.set_blocking(_PIPE, False)
+        threading.Thread(
+            target=_listen_control_signals,
+            args=(read_fd, wakeup),
+            name="control-signals",
+            daemon=True,
+        ).start()
+    for signum in requests_by_signal:
+        signal.signal(signum, forward_control_signal)
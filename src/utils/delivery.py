@@ -0,0 +1,340 @@
+"""
+Delivery of scan results to the island: payload encoding, inline posts and
+the background upload of the result spool.
+"""
+
+import json
+import logging
+import time
+
+from utils.compression import (
+    compression_level_setting,
+    decompress_body,
+    parse_compression_level,
+    parse_compression_threshold,
+)
+from utils.metrics import METRICS
+from utils.mutils import short_uid
+from utils.netutils import WIRE_FORMAT_JSON, WIRE_FORMAT_LEGACY, robust_request
+from utils.postprocess import ResultConverter, encode_result_payload
+from utils.resultstream import (
+    PartialResultStreamer,
+    parse_result_batch_hosts,
+    parse_result_batch_seconds,
+)
+from utils.setup import CAPABILITY_PARTIAL_RESULTS
+from utils.spool import ResultSpool, SpoolUploader
+from utils.tracing import TIMING_FIELD, JobTraceLog, append_span, trace_span
+from utils.xmlstream import nmap_stream_to_json
+
+logger = logging.getLogger("Plum_Agent")
+
+# Seconds a stopping agent gives the spooled results to leave.
+RESULT_DELIVERY_TIMEOUT = 300
+
+
+def log_result_size(job_uid, raw_size, body, headers):
+    """
+    Log the size of an encoded result payload.
+    """
+    encoding = headers.get("Content-Encoding")
+    if not encoding:
+        logger.info("Job %s result payload %s bytes", job_uid, raw_size)
+        return
+    logger.info(
+        "Job %s result payload %s bytes, %s bytes %s compressed",
+        job_uid,
+        raw_size,
+        len(body),
+        encoding,
+    )
+
+
+class ResultDelivery:
+    """
+    Encode scan results and deliver them to the island.
+
+    Final results are spooled for the background uploader when it runs, and
+    posted inline otherwise. Reports are converted in worker processes once
+    the converter is started. The trace of a final result travels with it
+    and is written to trace_log once the island accepted the result.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.uploader = None
+        self.converter = None
+        self.trace_log = None
+
+    def wire_format(self):
+        """
+        Return the POST body format negotiated with the island.
+        """
+        return self.config.get("wire_format") or WIRE_FORMAT_LEGACY
+
+    def encoding(self):
+        """
+        Return the encode_result_payload settings negotiated with the island.
+        """
+        encoding = self.config.get("result_encoding")
+        return {
+            "wire_format": self.wire_format(),
+            "encoding": encoding,
+            "level": parse_compression_level(
+                compression_level_setting(self.config, encoding), encoding
+            ),
+            "threshold": parse_compression_threshold(
+                self.config.get("result_compression_threshold")
+            ),
+        }
+
+    def timing_extra(self, extra, trace):
+        """
+        Add the phase timing summary to the fields of a final result when
+        job trace records are written.
+        """
+        if trace is None or self.trace_log is None:
+            return extra
+        return (extra or {}) | {TIMING_FIELD: trace.summary()}
+
+    def body(self, range_uid, results, extra=None):
+        """
+        Build the sndjob payload, return its metadata and body.
+        """
+        settings = self.encoding()
+        if settings["wire_format"] != WIRE_FORMAT_JSON:
+            results = json.dumps(results)
+        data = dict(self.config.get("botinfo") or {})
+        data = data | {"JOB_UID": str(range_uid), "RESULT": results} | (extra or {})
+        body, headers, raw_size = encode_result_payload(data, **settings)
+        log_result_size(short_uid(range_uid), raw_size, body, headers)
+        meta = {
+            "job_uid": str(range_uid),
+            "wire_format": settings["wire_format"],
+            "headers": headers,
+        }
+        return meta, body
+
+    def report_body(self, range_uid, output_xml, skip_hosts=0, extra=None, trace=None):
+        """
+        Build the sndjob payload of an Nmap XML report without its first
+        skip_hosts hosts. The conversion runs in the result worker processes
+        when they are started, it is then traced as a single convert phase.
+        """
+        started = time.monotonic()
+        if self.converter is None:
+            with trace_span(trace, "parse"):
+                results = nmap_stream_to_json(output_xml, True, True)[skip_hosts:]
+            with trace_span(trace, "serialize"):
+                meta, body = self.body(
+                    range_uid, results, self.timing_extra(extra, trace)
+                )
+            METRICS.observe(
+                "plum_result_conversion_seconds", time.monotonic() - started
+            )
+            return meta, body
+
+        settings = self.encoding()
+        data = dict(self.config.get("botinfo") or {}) | {"JOB_UID": str(range_uid)}
+        with trace_span(trace, "convert"):
+            body, headers, raw_size = self.converter.convert(
+                output_xml,
+                data,
+                self.timing_extra(extra, trace),
+                skip_hosts,
+                **settings
+            )
+        METRICS.observe("plum_result_conversion_seconds", time.monotonic() - started)
+        log_result_size(short_uid(range_uid), raw_size, body, headers)
+        meta = {
+            "job_uid": str(range_uid),
+            "wire_format": settings["wire_format"],
+            "headers": headers,
+        }
+        return meta, body
+
+    def post(self, meta, body, max_retries):
+        """
+        Post a result body to the island, return the island response or None.
+        """
+        METRICS.inc("plum_sndjob_bytes_total", len(body))
+        started = time.monotonic()
+        upload_started = time.time()
+        response = robust_request(
+            self.config.get("APIPATH").sndjob,
+            method="POST",
+            headers=meta.get("headers"),
+            max_retries=max_retries,
+            body=body,
+        )
+        METRICS.observe("plum_sndjob_seconds", time.monotonic() - started)
+        # The trace of a final result is written once the island accepted it.
+        trace_record = meta.get("trace")
+        if trace_record is not None and response is not None:
+            append_span(trace_record, "upload", upload_started, time.time())
+            self.write_trace(trace_record | {"status": "delivered"})
+        return response
+
+    def send(self, range_uid, results, max_retries, extra=None):
+        """
+        Post job results to the island, return the island response or None.
+        """
+        meta, body = self.body(range_uid, results, extra)
+        return self.post(meta, body, max_retries)
+
+    def start_streamer(self, range_uid, output_xml, on_sent=None):
+        """
+        Stream the completed hosts of a growing report while Nmap runs, None
+        when the island does not accept partial results. on_sent(hosts_sent,
+        batches_sent) records the progress of each batch sent.
+        """
+        capabilities = self.config.get("island_capabilities") or []
+        if CAPABILITY_PARTIAL_RESULTS not in capabilities:
+            return None
+
+        def send_batch(records, sequence):
+            extra = {"BATCH": sequence, "JOB_COMPLETE": False}
+            if self.send(range_uid, records, 1, extra) is None:
+                return False
+            if on_sent is not None:
+                on_sent(streamer.hosts_sent + len(records), sequence + 1)
+            return True
+
+        streamer = PartialResultStreamer(
+            short_uid(range_uid),
+            output_xml,
+            send_batch,
+            parse_result_batch_hosts(self.config.get("result_batch_hosts")),
+            parse_result_batch_seconds(self.config.get("result_batch_seconds")),
+        )
+        streamer.start()
+        return streamer
+
+    def deliver(self, meta, body, trace=None):
+        """
+        Spool an encoded job result, or send it inline when no uploader runs.
+        The job trace travels with the result and is written on delivery.
+        """
+        job_uid = short_uid(meta.get("job_uid"))
+        if trace is not None and self.trace_log is not None:
+            meta = meta | {"trace": trace.record()}
+        if self.uploader is None:
+            return self.post(meta, body, 3) is not None
+
+        try:
+            self.uploader.spool.put(meta, body)
+        except OSError as error:
+            logger.error("Job %s result spool write failed: %s", job_uid, error)
+            return self.post(meta, body, 3) is not None
+        self.uploader.notify()
+        logger.info("Job %s result spooled for upload", job_uid)
+        return True
+
+    def reencode_spooled(self, meta, body):
+        """
+        Rebuild a spooled body when the island negotiated another format since.
+        """
+        headers = meta.get("headers") or {}
+        encoding = headers.get("Content-Encoding")
+        if meta.get("wire_format") == self.wire_format() and encoding in (
+            None,
+            self.config.get("result_encoding"),
+        ):
+            return meta, body
+
+        data = json.loads(decompress_body(body, encoding))
+        if meta.get("wire_format") != WIRE_FORMAT_JSON:
+            data = json.loads(data)
+            data["RESULT"] = json.loads(data["RESULT"])
+        extra = {
+            key: value
+            for key, value in data.items()
+            if key in ("BATCH", "JOB_COMPLETE", TIMING_FIELD)
+        }
+        new_meta, body = self.body(meta.get("job_uid"), data["RESULT"], extra)
+        if "trace" in meta:
+            new_meta["trace"] = meta["trace"]
+        return new_meta, body
+
+    def upload_spooled(self, meta, body):
+        """
+        Deliver one spooled result, return True once the island accepted it.
+        """
+        job_uid = short_uid(meta.get("job_uid"))
+        try:
+            meta, body = self.reencode_spooled(meta, body)
+        except (ValueError, KeyError, TypeError) as error:
+            logger.error(
+                "Job %s spooled result is invalid, dropping: %s", job_uid, error
+            )
+            return True
+
+        if self.post(meta, body, max_retries=1) is None:
+            logger.error("Job %s result send failed, kept in spool", job_uid)
+            return False
+        logger.info("Job %s result delivered", job_uid)
+        return True
+
+    def start_trace(self, log_dir, keep_days):
+        """
+        Write the job trace records to daily trace files in log_dir.
+        """
+        self.trace_log = JobTraceLog(log_dir, keep_days)
+        return self.trace_log
+
+    def write_trace(self, record):
+        """
+        Append one job trace record when the trace is written.
+        """
+        if self.trace_log is not None:
+            self.trace_log.write(record)
+
+    def stop_trace(self):
+        """
+        Close the job trace file.
+        """
+        if self.trace_log is None:
+            return
+        self.trace_log.close()
+        self.trace_log = None
+
+    def start_uploader(self, spool_dir):
+        """
+        Start the background uploader of the result spool in spool_dir.
+        """
+        self.uploader = SpoolUploader(ResultSpool(spool_dir), self.upload_spooled)
+        self.uploader.start()
+        return self.uploader
+
+    def stop_uploader(self, timeout=RESULT_DELIVERY_TIMEOUT):
+        """
+        Give pending uploads a chance to leave, then stop the uploader.
+        Undelivered results stay spooled for the next start.
+        """
+        if self.uploader is None:
+            return
+        if not self.uploader.wait_idle(timeout):
+            logger.warning(
+                "%s results still spooled for next start", len(self.uploader.spool)
+            )
+        self.uploader.stop()
+        self.uploader = None
+
+    def start_converter(self, workers):
+        """
+        Start workers result conversion processes, none when workers is 0.
+        """
+        if workers == 0:
+            return None
+        self.converter = ResultConverter(workers).start()
+        logger.info("Converting results in %s worker processes", workers)
+        return self.converter
+
+    def stop_converter(self):
+        """
+        Stop the result conversion processes.
+        """
+        if self.converter is None:
+            return
+        self.converter.stop()
+        self.converter = None
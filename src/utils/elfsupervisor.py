@@ -0,0 +1,200 @@
+"""
+Single event loop supervising every subprocess started through run_elf.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+
+logger = logging.getLogger("Plum_Agent")
+
+PIPE_READ_SIZE = 65536
+# Longest output line logged at once, longer lines are split.
+PIPE_LINE_LIMIT = 1024 * 1024
+# Longest wait for an interrupted process, above the default grace period.
+CANCEL_WAIT = 10
+
+
+class ElfSupervisor:
+    """
+    Run subprocesses on an asyncio loop in one daemon thread.
+
+    The loop reads the output pipes of every running process, so a scan only
+    keeps the worker thread waiting for its exit code. Output lines are passed
+    to line_handler(stream, line) with stream "stdout" or "stderr", or logged
+    as info and error when no handler is given.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                _watch_children_with_pidfd(self._loop)
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="elf-supervisor", daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def submit(self, cmd, line_handler=None, finished=None):
+        """
+        Start cmd, return a concurrent future resolving to its exit code.
+        finished is set once the process was reaped, even after a cancel.
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self._run(cmd, line_handler or log_line, finished), self._ensure_loop()
+        )
+
+    def run(self, cmd, line_handler=None):
+        """
+        Run cmd and return its exit code. On KeyboardInterrupt only this
+        process is terminated before the interrupt propagates.
+        """
+        finished = threading.Event()
+        future = self.submit(cmd, line_handler, finished)
+        try:
+            return future.result()
+        except KeyboardInterrupt:
+            if future.cancel():
+                finished.wait(CANCEL_WAIT)
+            raise
+
+    def terminate_all(self, grace_period=5):
+        """
+        Terminate every running process and wait until they exited.
+        """
+        if self._loop is None or not self._thread.is_alive():
+            return
+        asyncio.run_coroutine_threadsafe(
+            self._terminate_all(grace_period), self._loop
+        ).result()
+
+    def running(self):
+        """
+        Return the pids of the running processes.
+        """
+        with self._lock:
+            return [process.pid for process in self._processes]
+
+    async def _run(self, cmd, line_handler, finished=None):
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+            )
+            with self._lock:
+                self._processes.add(process)
+            try:
+                await asyncio.gather(
+                    _pump(process.stdout, "stdout", line_handler),
+                    _pump(process.stderr, "stderr", line_handler),
+                )
+                return await process.wait()
+            except BaseException:
+                # Never leave a process running with undrained pipes.
+                await _terminate_process(process)
+                raise
+            finally:
+                with self._lock:
+                    self._processes.discard(process)
+        finally:
+            if finished is not None:
+                finished.set()
+
+    async def _terminate_all(self, grace_period):
+        with self._lock:
+            processes = [
+                process for process in self._processes if process.returncode is None
+            ]
+        for process in processes:
+            logger.warning("Terminating process pid=%s", process.pid)
+        await asyncio.gather(
+            *(_terminate_process(process, grace_period) for process in processes)
+        )
+
+
+def _watch_children_with_pidfd(loop):
+    """
+    Wait for exits through pidfds on the loop instead of one thread per process.
+    Python 3.12 does this by default, older versions need the watcher installed.
+    """
+    if sys.version_info >= (3, 12) or not hasattr(os, "pidfd_open"):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        return
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(loop)
+    asyncio.set_child_watcher(watcher)
+
+
+def log_line(stream, line):
+    """
+    Log stdout lines as info and stderr lines as error.
+    """
+    if stream == "stderr":
+        logger.error(line)
+    else:
+        logger.info(line)
+
+
+async def _pump(pipe, stream, line_handler):
+    """
+    Pass each line of a process pipe to line_handler until it closes.
+    """
+    pending = b""
+    while True:
+        chunk = await pipe.read(PIPE_READ_SIZE)
+        if not chunk:
+            break
+        *lines, pending = (pending + chunk).split(b"\n")
+        if len(pending) >= PIPE_LINE_LIMIT:
+            lines.append(pending)
+            pending = b""
+        for line in lines:
+            line_handler(stream, line.decode("utf-8", errors="replace").strip())
+    if pending:
+        line_handler(stream, pending.decode("utf-8", errors="replace").strip())
+
+
+def _signal_group(process, signum):
+    try:
+        os.killpg(os.getpgid(process.pid), signum)
+    except (AttributeError, OSError):
+        try:
+            process.send_signal(signum)
+        except ProcessLookupError:
+            pass
+
+
+async def _terminate_process(process, grace_period=5):
+    """
+    Terminate a process and its process group, kill it after grace_period.
+    """
+    if process.returncode is not None:
+        return
+
+    _signal_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), grace_period)
+        return
+    except asyncio.TimeoutError:
+        pass
+
+    _signal_group(process, signal.SIGKILL)
+    await process.wait()
+
+
+SUPERVISOR = ElfSupervisor()
@@ -0,0 +1,97 @@
+"""
+Shared keep-alive HTTP session for controller traffic.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger("Plum_Agent")
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def parse_http_pool_size(value, scanparallel=1):
+    """
+    Parse the number of pooled controller connections.
+    Default to one connection per scan slot plus one for the scheduler.
+    """
+    default = max(scanparallel, 1) + 1
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError("http_pool_size must be an integer >= 1")
+
+    if isinstance(value, str) and not value.strip():
+        return default
+
+    try:
+        pool_size = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError("http_pool_size must be an integer >= 1") from error
+
+    if pool_size < 1:
+        raise ValueError("http_pool_size must be an integer >= 1")
+
+    return pool_size
+
+
+def parse_http_keepalive(value, default=True):
+    """
+    Parse the controller keep-alive switch.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+
+    value = str(value).strip().lower()
+    if not value:
+        return default
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise ValueError("http_keepalive must be a boolean")
+
+
+def _build_session(pool_size, keepalive):
+    # requests is imported with the first session, not at agent start.
+    import requests  # pylint: disable=import-outside-toplevel
+    from utils.httptransport import (  # pylint: disable=import-outside-toplevel
+        CountingHTTPAdapter,
+    )
+
+    session = requests.Session()
+    adapter = CountingHTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if not keepalive:
+        session.headers["Connection"] = "close"
+    return session
+
+
+def configure_session(pool_size=2, keepalive=True):
+    """
+    Replace the shared session with one sized for the scan parallelism.
+    """
+    global _SESSION  # pylint: disable=global-statement
+    with _SESSION_LOCK:
+        previous = _SESSION
+        _SESSION = _build_session(pool_size, keepalive)
+    if previous is not None:
+        previous.close()
+    logger.debug(
+        "HTTP session configured pool_size=%s keepalive=%s", pool_size, keepalive
+    )
+
+
+def get_session():
+    """
+    Return the shared controller session, creating a default one if needed.
+    """
+    global _SESSION  # pylint: disable=global-statement
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            _SESSION = _build_session(2, True)
+        return _SESSION
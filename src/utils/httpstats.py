@@ -0,0 +1,47 @@
+"""
+Counters of controller requests and opened connections.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger("Plum_Agent")
+
+_STATS = {"requests": 0, "opened": 0}
+_STATS_LOCK = threading.Lock()
+
+
+def count_event(key):
+    """
+    Count a sent request or a newly opened connection.
+    """
+    with _STATS_LOCK:
+        _STATS[key] += 1
+
+
+def connection_stats():
+    """
+    Return how many requests reused a pooled connection or opened a new one.
+    """
+    with _STATS_LOCK:
+        requests_sent = _STATS["requests"]
+        opened = _STATS["opened"]
+    return {
+        "requests": requests_sent,
+        "opened": opened,
+        "reused": max(requests_sent - opened, 0),
+    }
+
+
+def log_connection_stats(level=logging.INFO):
+    """
+    Log how many controller requests reused a pooled connection.
+    """
+    stats = connection_stats()
+    logger.log(
+        level,
+        "Controller connections: %s requests, %s opened, %s reused",
+        stats["requests"],
+        stats["opened"],
+        stats["reused"],
+    )
@@ -0,0 +1,44 @@
+"""
+Transport adapter counting controller requests and opened connections.
+"""
+
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
+from utils.httpstats import count_event
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    """
+    HTTP pool counting newly opened connections.
+    """
+
+    def _new_conn(self):
+        count_event("opened")
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    """
+    HTTPS pool counting newly opened connections.
+    """
+
+    def _new_conn(self):
+        count_event("opened")
+        return super()._new_conn()
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """
+    Transport adapter counting requests and opened connections.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, *args, **kwargs):  # pylint: disable=arguments-differ
+        count_event("requests")
+        return super().send(request, *args, **kwargs)
@@ -0,0 +1,145 @@
+"""
+Background logging pipeline keeping handler I/O off the worker threads.
+"""
+
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+SENTINEL_PUT_TIMEOUT = 0.5
+
+
+def parse_log_queue_size(value, default=10000):
+    """
+    Parse the maximum number of log records waiting for the handlers.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError("log_queue_size must be an integer >= 1")
+
+    if isinstance(value, str) and not value.strip():
+        return default
+
+    try:
+        number = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError("log_queue_size must be an integer >= 1") from error
+
+    if number < 1:
+        raise ValueError("log_queue_size must be an integer >= 1")
+
+    return number
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Queue records without blocking, count the records dropped on a full queue.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+
+class DropReportingListener(QueueListener):
+    """
+    Hand queued records to the handlers and log how many were dropped.
+    """
+
+    def __init__(self, log_queue, queue_handler, logger_name, *handlers):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.queue_handler = queue_handler
+        self.logger_name = logger_name
+        self.reported = 0
+
+    def handle(self, record):
+        super().handle(record)
+        self.report_dropped()
+
+    def report_dropped(self):
+        """
+        Log the records dropped since the last report.
+        """
+        dropped = self.queue_handler.dropped
+        if dropped > self.reported:
+            record = logging.makeLogRecord(
+                {
+                    "name": self.logger_name,
+                    "levelno": logging.WARNING,
+                    "levelname": logging.getLevelName(logging.WARNING),
+                    "msg": "Log queue full, dropped %s records (%s in total)",
+                    "args": (dropped - self.reported, dropped),
+                }
+            )
+            self.reported = dropped
+            super().handle(record)
+
+    def enqueue_sentinel(self):
+        # Wait for room behind queued records, unless the listener is gone.
+        while self._thread is not None and self._thread.is_alive():
+            try:
+                self.queue.put(self._sentinel, timeout=SENTINEL_PUT_TIMEOUT)
+                return
+            except queue.Full:
+                continue
+
+
+class LogPipeline:
+    """
+    Move the handlers of a logger behind a bounded queue served by one thread.
+
+    Loggers only pay for building the record, console rendering and file
+    writes happen in the listener thread. Once maxsize records are waiting,
+    new records are dropped and counted instead of stalling the caller.
+    """
+
+    def __init__(self, target_logger, maxsize=10000):
+        self.logger = target_logger
+        self.handlers = list(target_logger.handlers)
+        self.queue = queue.Queue(maxsize)
+        self.handler = BoundedQueueHandler(self.queue)
+        self.listener = DropReportingListener(
+            self.queue, self.handler, target_logger.name, *self.handlers
+        )
+
+    @property
+    def dropped(self):
+        """
+        Return the number of records dropped so far.
+        """
+        return self.handler.dropped
+
+    def start(self):
+        """
+        Replace the logger handlers by the queue and start the listener.
+        Records below the level of every handler are not queued.
+        """
+        if self.handlers:
+            self.handler.setLevel(min(handler.level for handler in self.handlers))
+        for handler in self.handlers:
+            self.logger.removeHandler(handler)
+        self.logger.addHandler(self.handler)
+        self.listener.start()
+        return self
+
+    def stop(self):
+        """
+        Flush queued records and give the handlers back to the logger.
+        """
+        if self.listener._thread is None:  # pylint: disable=protected-access
+            return
+        self.listener.stop()
+        self.listener.report_dropped()
+        self.logger.removeHandler(self.handler)
+        for handler in self.handlers:
+            self.logger.addHandler(handler)
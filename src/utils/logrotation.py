@@ -2,6 +2,10 @@
 Helpers for log retention configuration.
 """
 
+import logging
+import os
+from datetime import datetime, timedelta
+
 
 def parse_logrotation(value, default=30):
     """
@@ -24,3 +28,68 @@ def parse_logrotation(value, default=30):
         raise ValueError("logrotation must be an integer >= 1")
 
     return days
+
+
+class DailyLogFileHandler(logging.FileHandler):
+    """
+    Write logs to <prefix>-YYMMDD<suffix>, agent-YYMMDD.log by default, and
+    delete logs outside the retention window.
+    """
+
+    def __init__(self, directory, keep_days=30, prefix="agent", suffix=".log"):
+        self.directory = directory
+        self.keep_days = keep_days
+        self.prefix = prefix
+        self.suffix = suffix
+        self.current_day = datetime.now().date()
+        os.makedirs(self.directory, exist_ok=True)
+        super().__init__(self._log_path(self.current_day), mode="a", encoding="utf-8")
+        self._cleanup_old_logs()
+
+    def _log_path(self, day):
+        return os.path.join(self.directory, f"{self.prefix}-{day:%y%m%d}{self.suffix}")
+
+    def _cleanup_old_logs(self):
+        cutoff = datetime.now().date() - timedelta(days=self.keep_days - 1)
+        for filename in os.listdir(self.directory):
+            if not filename.startswith(f"{self.prefix}-") or not filename.endswith(
+                self.suffix
+            ):
+                continue
+
+            date_part = filename[len(self.prefix) + 1 : -len(self.suffix)]
+            try:
+                log_day = datetime.strptime(date_part, "%y%m%d").date()
+            except ValueError:
+                continue
+
+            if log_day < cutoff:
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    continue
+
+    def _rollover_if_needed(self):
+        today = datetime.now().date()
+        if today == self.current_day:
+            return
+
+        self.current_day = today
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        self.baseFilename = os.path.abspath(self._log_path(today))
+        self.stream = self._open()
+        self._cleanup_old_logs()
+
+    def emit(self, record):
+        self._rollover_if_needed()
+        super().emit(record)
+
+    def set_keep_days(self, keep_days):
+        """
+        Apply a new retention and remove the logs it expires.
+        """
+        self.keep_days = keep_days
+        self._cleanup_old_logs()
@@ -0,0 +1,305 @@
+"""
+Agent counters and histograms, served in the Prometheus text format.
+"""
+
+import bisect
+import logging
+import math
+import socket
+import threading
+
+logger = logging.getLogger("Plum_Agent")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_METRICS_HOST = "127.0.0.1"
+# Controller requests and result conversion, in seconds.
+DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# Nmap processes, in seconds.
+SCAN_BUCKETS = (1, 5, 15, 30, 60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400)
+# Reports, 1 KiB to 1 GiB.
+SIZE_BUCKETS = tuple(1024 * 4**power for power in range(11))
+
+
+def parse_metrics_listen(value, default=None):
+    """
+    Parse the host:port of the metrics endpoint, None disables it.
+    A bare port listens on 127.0.0.1.
+    """
+    if value is None or value is False:
+        return default
+    if value is True:
+        raise ValueError("metrics_listen must be host:port or a port")
+
+    text = str(value).strip()
+    if not text:
+        return default
+    host, _, port = text.rpartition(":")
+    host = host.strip().strip("[]") or DEFAULT_METRICS_HOST
+    try:
+        port = int(port)
+    except ValueError as error:
+        raise ValueError("metrics_listen must be host:port or a port") from error
+
+    if not 1 <= port <= 65535:
+        raise ValueError("metrics_listen port must be between 1 and 65535")
+
+    return host, port
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """
+    One metric family and its samples by label set.
+    """
+
+    def __init__(self, kind, help_text, buckets=None):
+        self.kind = kind
+        self.help_text = help_text
+        self.buckets = buckets
+        self.samples = {}
+        self.read = None
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters, gauges and histograms.
+
+    Recording is a dictionary update under one lock, so the hooks stay in
+    place when no endpoint serves the metrics. Gauges may read their value
+    from a function when the registry is rendered.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        """
+        Declare a counter.
+        """
+        self._metrics[name] = _Metric("counter", help_text)
+
+    def gauge(self, name, help_text):
+        """
+        Declare a gauge.
+        """
+        self._metrics[name] = _Metric("gauge", help_text)
+
+    def histogram(self, name, help_text, buckets):
+        """
+        Declare a histogram with increasing bucket upper bounds.
+        """
+        self._metrics[name] = _Metric("histogram", help_text, tuple(buckets))
+
+    def inc(self, name, amount=1, **labels):
+        """
+        Add amount to a counter.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            samples = self._metrics[name].samples
+            samples[key] = samples.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """
+        Set a gauge.
+        """
+        with self._lock:
+            self._metrics[name].samples[tuple(sorted(labels.items()))] = value
+
+    def track(self, name, read):
+        """
+        Read a gauge from read() whenever the registry is rendered.
+        """
+        with self._lock:
+            self._metrics[name].read = read
+
+    def observe(self, name, value, **labels):
+        """
+        Record one histogram observation.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            metric = self._metrics[name]
+            sample = metric.samples.get(key)
+            if sample is None:
+                sample = metric.samples[key] = [[0] * (len(metric.buckets) + 1), 0, 0]
+            sample[0][bisect.bisect_left(metric.buckets, value)] += 1
+            sample[1] += value
+            sample[2] += 1
+
+    def value(self, name, **labels):
+        """
+        Return the value of a counter or gauge, the count of a histogram.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            metric = self._metrics[name]
+            read = metric.read
+            sample = metric.samples.get(key, 0)
+        if read is not None:
+            return read()
+        if metric.kind == "histogram":
+            return sample[2] if sample else 0
+        return sample
+
+    def render(self):
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = [
+                (name, metric, metric.read, dict(metric.samples))
+                for name, metric in sorted(self._metrics.items())
+            ]
+            # Histogram samples are copied, observations continue meanwhile.
+            for _, metric, _, samples in metrics:
+                if metric.kind == "histogram":
+                    for key, sample in samples.items():
+                        samples[key] = [list(sample[0]), sample[1], sample[2]]
+
+        lines = []
+        for name, metric, read, samples in metrics:
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            if read is not None:
+                try:
+                    samples = {(): read()}
+                except Exception as error:  # pylint: disable=broad-except
+                    logger.debug("Metric %s cannot be read: %s", name, error)
+                    continue
+            for key, sample in sorted(samples.items()):
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{_labels_text(key)} {_number(sample)}")
+                    continue
+                counts, total, count = sample
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets + (math.inf,), counts):
+                    cumulative += bucket_count
+                    bucket_key = key + (("le", _number(bound)),)
+                    lines.append(
+                        f"{name}_bucket{_labels_text(bucket_key)} {cumulative}"
+                    )
+                lines.append(f"{name}_sum{_labels_text(key)} {_number(total)}")
+                lines.append(f"{name}_count{_labels_text(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Serve a registry on GET /metrics from a background thread.
+    """
+
+    def __init__(self, registry, host, port):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """
+        Listen on host:port, raise OSError when the address is unavailable.
+        """
+        # The HTTP server is only imported when metrics are enabled.
+        from http.server import (  # pylint: disable=import-outside-toplevel
+            BaseHTTPRequestHandler,
+            ThreadingHTTPServer,
+        )
+
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            """Answer metrics scrapes."""
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Send the rendered registry."""
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_args):  # pylint: disable=arguments-differ
+                """Scrapes are not logged."""
+
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+
+        class Server(ThreadingHTTPServer):
+            """Listen on the address family of the configured host."""
+
+            address_family = family
+            daemon_threads = True
+
+        self._server = Server((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="metrics-server", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+METRICS = MetricsRegistry()
+METRICS.counter(
+    "plum_http_retries_total", "Controller requests retried, by bot API endpoint"
+)
+METRICS.counter(
+    "plum_http_failures_total",
+    "Controller requests abandoned after their retries, by bot API endpoint",
+)
+METRICS.counter("plum_getjob_requests_total", "getjob requests answered")
+METRICS.counter("plum_getjob_empty_total", "getjob answers without any job")
+METRICS.histogram(
+    "plum_getjob_seconds", "getjob request duration with retries", DURATION_BUCKETS
+)
+METRICS.counter(
+    "plum_scheduler_wait_seconds_total",
+    "Time the scheduler waited for a finished job, a prefetched job or a delay",
+)
+METRICS.gauge("plum_jobs_running", "Scan jobs running")
+METRICS.gauge("plum_jobs_queued", "Prefetched and resumed jobs waiting for a slot")
+METRICS.gauge("plum_scan_slots_busy", "Scan slots used by jobs and their shards")
+METRICS.gauge("plum_scanparallel", "Current scan slot limit")
+METRICS.histogram("plum_nmap_duration_seconds", "Nmap process run time", SCAN_BUCKETS)
+METRICS.histogram("plum_nmap_report_bytes", "Nmap XML report size", SIZE_BUCKETS)
+METRICS.histogram(
+    "plum_result_conversion_seconds",
+    "Nmap XML report conversion and encoding time",
+    DURATION_BUCKETS,
+)
+METRICS.counter("plum_sndjob_bytes_total", "sndjob request body bytes sent")
+METRICS.histogram(
+    "plum_sndjob_seconds", "sndjob upload duration with retries", DURATION_BUCKETS
+)
+METRICS.counter("plum_nse_cache_total", "NSE scripts resolved, by hit or refresh")
@@ -2,53 +2,71 @@
 This module hold generic common utils fonction
 """
 
+import os
 import subprocess
 import shutil
 import logging
-import threading
-import os
-import signal
-from subprocess import CalledProcessError
+from subprocess import CalledProcessError, TimeoutExpired
 
 logger = logging.getLogger("Plum_Agent")
-_RUNNING_ELFS = set()
-_RUNNING_ELFS_LOCK = threading.Lock()
+
+# Version stamped at build time, for example with git describe --tags.
+VERSION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "VERSION")
+GIT_TIMEOUT = 2
+
+
+def _git_output(*args):
+    return (
+        subprocess.check_output(
+            ["git", *args],
+            cwd=os.path.dirname(VERSION_FILE),
+            stderr=subprocess.DEVNULL,
+            timeout=GIT_TIMEOUT,
+        )
+        .decode()
+        .strip()
+    )
 
 
 def get_version():
     """
-    Retrieves the current version of the code based on git tags or commit hash.
+    Retrieves the current version of the code.
 
-    Attempts to get the latest git tag. If no tag is found or the command fails,
-    it falls back to getting the short commit hash of the HEAD. If both attempts
-    fail, it returns "unknown".
+    Reads the version stamped in utils/VERSION at build time. Without a stamp
+    it falls back to the latest git tag, then to the short commit hash of the
+    HEAD. If every attempt fails, it returns "unknown".
 
     Returns:
-        str: The git tag, a string in the format "untagged-<short_sha>", or "unknown".
+        str: The stamped version, the git tag, a string in the format
+        "untagged-<short_sha>", or "unknown".
     """
     try:
-        tag = (
-            subprocess.check_output(
-                ["git", "describe", "--tags"], stderr=subprocess.DEVNULL
-            )
-            .decode()
-            .strip()
-        )
-        return tag
-    except CalledProcessError:
+        with open(VERSION_FILE, "r", encoding="utf-8") as handle:
+            version = handle.read().strip()
+        if version:
+            return version
+    except OSError:
+        pass
+
+    try:
+        return _git_output("describe", "--tags")
+    except (CalledProcessError, TimeoutExpired, OSError):
         try:
-            sha = (
-                subprocess.check_output(
-                    ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL
-                )
-                .decode()
-                .strip()
-            )
-            return f"untagged-{sha}"
-        except CalledProcessError:
+            return f"untagged-{_git_output('rev-parse', '--short', 'HEAD')}"
+        except (CalledProcessError, TimeoutExpired, OSError):
             return "unknown"
 
 
+def short_uid(value):
+    """
+    Return a compact UID for readable logs.
+    """
+    value = str(value or "")
+    if len(value) <= 12:
+        return value
+    return f"{value[:8]}...{value[-4:]}"
+
+
 def locate_elf(filename):
     """
     This function find the path of a given executable
@@ -62,97 +80,34 @@ def locate_elf(filename):
         return (False, None)
 
 
-def _terminate_process(process, grace_period=5):
-    """
-    Terminate a process and its process group.
-    """
-    if process.poll() is not None:
-        return
-
-    try:
-        os.killpg(os.getpgid(process.pid), signal.SIGTERM)
-    except (AttributeError, OSError):
-        process.terminate()
-
-    try:
-        process.wait(timeout=grace_period)
-        return
-    except subprocess.TimeoutExpired:
-        pass
-
-    try:
-        os.killpg(os.getpgid(process.pid), signal.SIGKILL)
-    except (AttributeError, OSError):
-        process.kill()
-    process.wait()
-
-
 def terminate_running_elfs(grace_period=5):
     """
     Terminate all subprocesses started through run_elf.
     """
-    with _RUNNING_ELFS_LOCK:
-        processes = list(_RUNNING_ELFS)
+    # Imported on first use, asyncio is not needed to set the agent up.
+    from utils.elfsupervisor import (  # pylint: disable=import-outside-toplevel
+        SUPERVISOR,
+    )
 
-    for process in processes:
-        if process.poll() is None:
-            logger.warning("Terminating process pid=%s", process.pid)
-            _terminate_process(process, grace_period=grace_period)
+    SUPERVISOR.terminate_all(grace_period=grace_period)
 
 
-def run_elf(elfpath, options=None):
+def run_elf(elfpath, options=None, line_handler=None):
     """
     This function execute and wait the end of the process.
     It push log to the console.
     Error as Error, text as Info
+    The process pipes are read by the shared supervisor loop, the calling
+    thread only waits for the exit code. line_handler(stream, line) replaces
+    the console logging of the output lines.
     """
-    cmd = [elfpath] + (options if options else [])  # squash empty strings.
-
-    process = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1,
-        universal_newlines=True,
-        start_new_session=True,
+    from utils.elfsupervisor import (  # pylint: disable=import-outside-toplevel
+        SUPERVISOR,
     )
-    with _RUNNING_ELFS_LOCK:
-        _RUNNING_ELFS.add(process)
-
-    def reader(pipe, log_func, prefix=""):
-        for line in iter(pipe.readline, ""):
-            log_func(f"{prefix}{line.strip()}")
-        pipe.close()
 
-    t_out = threading.Thread(
-        target=reader, args=(process.stdout, logger.info), daemon=True
-    )
-    t_err = threading.Thread(
-        target=reader,
-        args=(
-            process.stderr,
-            logger.error,
-        ),
-        daemon=True,
-    )
-
-    try:
-        t_out.start()
-        t_err.start()
+    cmd = [elfpath] + (options if options else [])  # squash empty strings.
 
-        try:
-            return_code = process.wait()  # Wait end of Process
-        except KeyboardInterrupt:
-            _terminate_process(process)
-            raise
-
-        t_out.join()  # Wait end of output
-        t_err.join()
-        return return_code
-    finally:
-        with _RUNNING_ELFS_LOCK:
-            _RUNNING_ELFS.discard(process)
+    return SUPERVISOR.run(cmd, line_handler)  # Wait end of Process
 
 
 class Dict2obj:
@@ -2,73 +2,227 @@
 Network Related functions
 """
 
+import collections
 import logging
+import os
 import random
 import ipaddress
+import queue
 import socket
+import threading
 import time
 import json
-import requests
-from requests.exceptions import Timeout, SSLError, RequestException
+from utils.httpsession import get_session
+from utils.metrics import METRICS
 
 logger = logging.getLogger("Plum_Agent")
 
+# Legacy islands expect the JSON body to be a JSON-encoded string.
+WIRE_FORMAT_LEGACY = "legacy"
+# Negotiated islands accept the payload as a plain JSON object.
+WIRE_FORMAT_JSON = "json"
+# Services answering with the caller public address as plain text.
+EXT_IP_PROVIDERS = (
+    "https://checkip.amazonaws.com",
+    "https://ipinfo.io/ip",
+    "https://ident.me",
+    "https://wtfismyip.com/text",
+    "https://api.ipify.org",
+    "https://icanhazip.com",
+    "http://ifconfig.me/ip",
+    "https://ip.circl.lu/raw",
+)
+EXT_IP_TIMEOUT = 5
+EXT_IP_CACHE_TTL = 0
 
-def get_ext_ip():
+
+def parse_ext_ip_quorum(value, default=1):
+    """
+    Parse the number of providers that must agree on the external IP.
+    """
+    message = f"ext_ip_quorum must be an integer from 1 to {len(EXT_IP_PROVIDERS)}"
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError(message)
+
+    if isinstance(value, str) and not value.strip():
+        return default
+
+    try:
+        quorum = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError(message) from error
+
+    if not 1 <= quorum <= len(EXT_IP_PROVIDERS):
+        raise ValueError(message)
+
+    return quorum
+
+
+def parse_ext_ip_cache_ttl(value, default=EXT_IP_CACHE_TTL):
+    """
+    Parse the seconds a discovered external IP is reused, 0 disables the cache.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError("ext_ip_cache_ttl must be an integer >= 0")
+
+    if isinstance(value, str) and not value.strip():
+        return default
+
+    try:
+        ttl = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError("ext_ip_cache_ttl must be an integer >= 0") from error
+
+    if ttl < 0:
+        raise ValueError("ext_ip_cache_ttl must be an integer >= 0")
+
+    return ttl
+
+
+def _query_ext_ip(provider):
+    """
+    Return the public IP answered by provider, None on failure.
+    """
+    import requests  # pylint: disable=import-outside-toplevel
+
+    try:
+        logger.debug("Using IP external provider %s", provider)
+        with get_session().get(provider, timeout=EXT_IP_TIMEOUT) as response:
+            ip_obj = ipaddress.ip_address(response.text.strip())
+    except (
+        ConnectionError,
+        socket.gaierror,
+        TypeError,
+        ValueError,
+        requests.RequestException,
+    ) as e:
+        logger.warning(
+            "Unable to determine external IP with provider %s: %s", provider, e
+        )
+        return None
+
+    if ip_obj.is_private:
+        # If we got internal IP, we got a severe issue
+        logger.error("Abnormal, RFC1918 IP detected: %s", ip_obj)
+        return None
+    return str(ip_obj)
+
+
+def _load_cached_ext_ip(cache_path, cache_ttl):
+    try:
+        with open(cache_path, "r", encoding="utf-8") as handle:
+            cached = json.load(handle)
+        age = time.time() - float(cached["time"])
+        ip = str(ipaddress.ip_address(cached["ip"]))
+    except (OSError, KeyError, TypeError, ValueError):
+        return None
+    if not 0 <= age < cache_ttl:
+        return None
+    return ip
+
+
+def _save_cached_ext_ip(cache_path, ip):
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump({"ip": ip, "time": time.time()}, handle)
+        os.replace(tmp_path, cache_path)
+    except OSError as error:
+        logger.warning("Unable to cache external IP in %s: %s", cache_path, error)
+
+
+def get_ext_ip(quorum=1, cache_path=None, cache_ttl=0):
     """
     Resolve the external (non-RFC1918) IP (v4 or v6) of the host
     using external services.
-    """
 
-    providers = [
-        "https://checkip.amazonaws.com",
-        "https://ipinfo.io/ip",
-        "https://ident.me",
-        "https://wtfismyip.com/text",
-        "https://api.ipify.org",
-        "https://icanhazip.com",
-        "http://ifconfig.me/ip",
-        "https://ip.circl.lu/raw",
-    ]
+    Every provider is queried at once on the shared session. The first
+    address answered by quorum providers wins. Requests in flight cannot be
+    aborted: the pending ones end within EXT_IP_TIMEOUT on daemon threads that
+    nothing waits for. With cache_path and cache_ttl, an address discovered
+    less than cache_ttl seconds ago is reused without querying the providers.
+    """
+    if cache_path and cache_ttl:
+        ip = _load_cached_ext_ip(cache_path, cache_ttl)
+        if ip:
+            logger.info("Using cached external IP: %s", ip)
+            return ip
 
+    providers = list(EXT_IP_PROVIDERS)
     random.shuffle(providers)
 
+    answers = queue.Queue()
     for provider in providers:
-        try:
-            logger.debug("Using IP external provider %s", provider)
+        threading.Thread(
+            target=lambda provider=provider: answers.put(_query_ext_ip(provider)),
+            name="ext-ip",
+            daemon=True,
+        ).start()
 
-            response = requests.get(provider, timeout=5)
-            ip = response.text.strip()
-            ip_obj = ipaddress.ip_address(ip)
+    votes = collections.Counter()
+    ip = None
+    for _ in providers:
+        answer = answers.get()
+        if answer is None:
+            continue
+        votes[answer] += 1
+        if votes[answer] >= quorum:
+            ip = answer
+            break
 
-            if not ip_obj.is_private:
-                logger.info("Detected external IP: %s", ip)
-                return ip
-            else:
-                # If we got internal IP, we got a severe issue
-                logger.error("Abnormal, RFC1918 IP detected: %s", ip)
-
-        except (
-            Timeout,
-            SSLError,
-            ConnectionError,
-            socket.gaierror,
-            TypeError,
-            RequestException,
-        ) as e:
-            logger.warning(
-                "Unable to determine external IP with provider %s: %s", provider, e
+    if ip is None:
+        if votes:
+            logger.error(
+                "No external IP answered by %s providers: %s", quorum, dict(votes)
             )
+        logger.error("No more external IP provider available for discovery")
+        return None
+
+    logger.info("Detected external IP: %s", ip)
+    if cache_path and cache_ttl:
+        _save_cached_ext_ip(cache_path, ip)
+    return ip
+
+
+def encode_payload(data, wire_format=WIRE_FORMAT_LEGACY):
+    """
+    Return the JSON document sent as POST body for the selected wire format.
+    """
+    if wire_format == WIRE_FORMAT_JSON:
+        return data
+    return json.dumps(data)
+
 
-    logger.error("No more external IP provider available for discovery")
-    return None
+def serialize_payload(data, wire_format=WIRE_FORMAT_LEGACY):
+    """
+    Return the UTF-8 POST body for the selected wire format.
+    """
+    return json.dumps(encode_payload(data, wire_format)).encode("utf-8")
+
+
+def _endpoint_label(url):
+    """
+    Return the bot API endpoint name of a controller URL.
+    """
+    return url.split("?", 1)[0].rstrip("/").rsplit("/", 1)[-1]
 
 
 def robust_request(
-    url, method="GET", headers=None, data=None, params=None, max_retries=None
+    url,
+    method="GET",
+    headers=None,
+    data=None,
+    params=None,
+    max_retries=None,
+    wire_format=WIRE_FORMAT_LEGACY,
+    body=None,
 ):
     """
-    Perform GET or POST request on API
+    Perform GET or POST request on API through the shared keep-alive session
     Retry on failure with progressive delay
     Automatically parses JSON and returns a Python dict.
 
@@ -78,6 +232,8 @@ def robust_request(
     data: dict for POST
     params: dict for GET params
     max_retries: optional, None = infinite
+    wire_format: POST body encoding negotiated with the island
+    body: optional pre-serialized POST body bytes, replaces data
 
     return dict or None if max retries reached
 
@@ -93,18 +249,30 @@ def robust_request(
     if method not in ("GET", "POST"):
         raise ValueError("method must be 'GET' or 'POST'")
 
+    import requests  # pylint: disable=import-outside-toplevel
+
+    session = get_session()
     while True:
         try:
             if method == "GET":
-                response = requests.get(
+                response = session.get(
                     url, headers=headers, params=params, timeout=timeout_wait
                 )
+            elif body is not None:
+                logger.debug("Body: %s bytes", len(body))
+                response = session.post(
+                    url,
+                    headers=headers,
+                    data=body,
+                    params=params,
+                    timeout=timeout_wait,
+                )
             else:
                 logger.debug("Data: %s", data)
-                response = requests.post(
+                response = session.post(
                     url,
                     headers=headers,
-                    json=json.dumps(data),
+                    json=encode_payload(data, wire_format),
                     params=params,
                     timeout=timeout_wait,
                 )
@@ -128,4 +296,6 @@ def robust_request(
 
         if max_retries is not None and attempts >= max_retries:
             logger.error("Max retries reached. Aborting.")
+            METRICS.inc("plum_http_failures_total", endpoint=_endpoint_label(url))
             return None
+        METRICS.inc("plum_http_retries_total", endpoint=_endpoint_label(url))
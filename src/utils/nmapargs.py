@@ -0,0 +1,156 @@
+"""
+Validation and merging of controller-provided Nmap arguments.
+"""
+
+import shlex
+
+SHELL_CONTROL_CHARACTERS = frozenset(";&|<>`$()\r\n")
+MAX_NMAP_ADDITIONAL_PARAMS_LENGTH = 4096
+NMAP_DEFAULT_OPTIONS_WITH_VALUES = frozenset(
+    {"--host-timeout", "--max-retries", "--min-hostgroup", "--max-rate"}
+)
+NMAP_RATE_OPTIONS = frozenset({"--max-rate", "--min-rate"})
+NMAP_RESERVED_LONG_OPTIONS = frozenset(
+    {
+        "--append-output",
+        "--exclude-ports",
+        "--no-stylesheet",
+        "--port-ratio",
+        "--resume",
+        "--script",
+        "--stylesheet",
+        "--top-ports",
+        "--webxml",
+    }
+)
+
+
+def _nmap_option_name(token):
+    """
+    Return the option name used for duplicate and reserved-option checks.
+    """
+    if token.startswith("--"):
+        return token.split("=", 1)[0]
+    if len(token) == 3 and token.startswith("-T") and token[2].isdigit():
+        return "-T"
+    return token
+
+
+def _is_reserved_nmap_option(token):
+    """
+    Keep job ports, output, and selected NSE scripts under agent control.
+    """
+    if token in {"-", "--"}:
+        return True
+    option_name = _nmap_option_name(token)
+    if option_name in NMAP_RESERVED_LONG_OPTIONS:
+        return True
+    if token == "-p" or (token.startswith("-p") and not token.startswith("--")):
+        return True
+    return token.startswith(("-oA", "-oG", "-oN", "-oS", "-oX"))
+
+
+def _validate_nmap_param_text(value):
+    """
+    Reject bounded-string violations and shell-control syntax.
+    """
+    if len(value) > MAX_NMAP_ADDITIONAL_PARAMS_LENGTH:
+        raise ValueError("nmap_additional_params exceeds 4096 characters")
+    if any(character in SHELL_CONTROL_CHARACTERS for character in value):
+        raise ValueError("nmap_additional_params contains shell-control syntax")
+    if any(ord(character) < 32 and character != "\t" for character in value):
+        raise ValueError("nmap_additional_params contains control characters")
+
+
+def _validate_nmap_param_tokens(tokens):
+    """
+    Reject agent-managed options and malformed default overrides.
+    """
+    for index, token in enumerate(tokens):
+        if _is_reserved_nmap_option(token):
+            raise ValueError(f"Nmap option {token!r} is managed by the agent")
+
+        option_name = _nmap_option_name(token)
+        if option_name not in NMAP_DEFAULT_OPTIONS_WITH_VALUES | NMAP_RATE_OPTIONS:
+            continue
+        if "=" in token:
+            if not token.split("=", 1)[1]:
+                raise ValueError(f"Nmap option {option_name!r} requires a value")
+            continue
+        if index + 1 == len(tokens) or tokens[index + 1].startswith("-"):
+            raise ValueError(f"Nmap option {option_name!r} requires a value")
+
+
+def parse_nmap_additional_params(value):
+    """
+    Parse controller-provided Nmap parameters without shell evaluation.
+    """
+    if value is None:
+        return []
+    if not isinstance(value, str):
+        raise ValueError("nmap_additional_params must be a string or null")
+    _validate_nmap_param_text(value)
+    if not value.strip():
+        return []
+
+    try:
+        tokens = shlex.split(value, posix=True)
+    except ValueError as error:
+        raise ValueError(f"malformed nmap_additional_params: {error}") from error
+
+    _validate_nmap_param_tokens(tokens)
+    return tokens
+
+
+def merge_nmap_defaults(default_args, additional_args):
+    """
+    Remove overridden agent defaults, then append profile-level arguments.
+    """
+    overrides = {_nmap_option_name(token) for token in additional_args}
+    merged_args = []
+    index = 0
+    while index < len(default_args):
+        token = default_args[index]
+        option_name = _nmap_option_name(token)
+        if option_name in overrides:
+            index += 2 if option_name in NMAP_DEFAULT_OPTIONS_WITH_VALUES else 1
+            continue
+        merged_args.append(token)
+        if option_name in NMAP_DEFAULT_OPTIONS_WITH_VALUES:
+            index += 1
+            merged_args.append(default_args[index])
+        index += 1
+
+    return merged_args + additional_args
+
+
+def clamp_nmap_rates(additional_args, max_rate):
+    """
+    Lower profile-level --max-rate and --min-rate values to max_rate.
+    """
+    clamped_args = []
+    index = 0
+    while index < len(additional_args):
+        token = additional_args[index]
+        option_name = _nmap_option_name(token)
+        if option_name not in NMAP_RATE_OPTIONS:
+            clamped_args.append(token)
+            index += 1
+            continue
+
+        if "=" in token:
+            value = token.split("=", 1)[1]
+        else:
+            index += 1
+            value = additional_args[index]
+        try:
+            rate = float(value)
+        except ValueError as error:
+            raise ValueError(
+                f"Nmap option {option_name!r} requires a number"
+            ) from error
+        # Lower values keep their text, max_rate is an integer share.
+        clamped_args.extend([option_name, value if rate <= max_rate else str(max_rate)])
+        index += 1
+
+    return clamped_args
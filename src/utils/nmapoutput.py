@@ -0,0 +1,266 @@
+"""
+Structured handling of Nmap console output: progress, coalescing and traces.
+"""
+
+import contextlib
+import gzip
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger("Plum_Agent")
+
+STATS_RE = re.compile(
+    r"^Stats: (?P<elapsed>\S+) elapsed; (?P<completed>\d+) hosts completed "
+    r"\((?P<up>\d+) up\), (?P<undergoing>\d+) undergoing (?P<phase>.+)$"
+)
+TIMING_RE = re.compile(
+    r"^(?P<phase>.+) Timing: About (?P<percent>[\d.]+)% done"
+    r"(?:; ETC: (?P<etc>[^(]+?) \((?P<remaining>\S+) remaining\))?"
+)
+DONE_RE = re.compile(
+    r"^Nmap done: (?P<addresses>\d+) IP addresses? \((?P<up>\d+) hosts? up\) "
+    r"scanned in (?P<seconds>[\d.]+) seconds"
+)
+REPORT_PREFIX = "Nmap scan report for "
+# Log a progress update once the percentage moved by this many points.
+PROGRESS_LOG_STEP = 10
+
+
+def parse_nmap_output_rate(value, default=20):
+    """
+    Parse the number of raw Nmap output lines logged per second, 0 disables them.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError("nmap_output_rate must be an integer >= 0")
+
+    if isinstance(value, str) and not value.strip():
+        return default
+
+    try:
+        number = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError("nmap_output_rate must be an integer >= 0") from error
+
+    if number < 0:
+        raise ValueError("nmap_output_rate must be an integer >= 0")
+
+    return number
+
+
+def parse_nmap_trace(value, default=False):
+    """
+    Parse the per-job compressed Nmap output trace switch.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+
+    value = str(value).strip().lower()
+    if not value:
+        return default
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise ValueError("nmap_trace must be a boolean")
+
+
+class NmapOutputProcessor:
+    """
+    Consume the output lines of one Nmap process.
+
+    Progress lines update a structured state instead of being logged. Other
+    lines are logged with the job UID: consecutive duplicates are folded into
+    one record and at most rate lines per second are logged, the rest are only
+    counted. stderr lines are logged as errors and are never rate limited.
+    With trace_path, every line is also written to a gzip trace file.
+    """
+
+    def __init__(self, job_uid, rate=20, trace_path=None):
+        self.job_uid = job_uid
+        self.rate = rate
+        self.trace_path = trace_path
+        self.suppressed = 0
+        self.lines = 0
+        self._progress = {"hosts_reported": 0}
+        self._logged_phase = None
+        self._logged_percent = None
+        self._last = None
+        self._repeats = 0
+        self._tokens = float(rate)
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._trace = (
+            gzip.open(trace_path, "wt", encoding="utf-8") if trace_path else None
+        )
+
+    def progress(self):
+        """
+        Return a copy of the parsed progress state.
+        """
+        with self._lock:
+            return dict(self._progress)
+
+    def feed(self, stream, line):
+        """
+        Handle one output line, stream is "stdout" or "stderr".
+        """
+        with self._lock:
+            self.lines += 1
+            if self._trace is not None:
+                self._trace.write(f"{stream}: {line}\n")
+            if stream == "stdout" and self._parse_progress(line):
+                return
+            if (stream, line) == self._last:
+                self._repeats += 1
+                return
+            self._flush_repeats()
+            self._last = (stream, line)
+            self._emit(stream, line)
+
+    def close(self):
+        """
+        Flush pending records, log the summary and close the trace.
+        """
+        with self._lock:
+            self._flush_repeats()
+            self._last = None
+            if self.suppressed:
+                logger.info(
+                    "Job %s suppressed %s of %s Nmap output lines",
+                    self.job_uid,
+                    self.suppressed,
+                    self.lines,
+                )
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+                logger.info(
+                    "Job %s Nmap trace written to %s", self.job_uid, self.trace_path
+                )
+
+    def _parse_progress(self, line):
+        if line.startswith(REPORT_PREFIX):
+            self._progress["hosts_reported"] += 1
+            return False
+
+        match = STATS_RE.match(line)
+        if match:
+            self._progress.update(
+                elapsed=match["elapsed"],
+                hosts_completed=int(match["completed"]),
+                hosts_up=int(match["up"]),
+                hosts_undergoing=int(match["undergoing"]),
+                phase=match["phase"],
+            )
+            return True
+
+        match = TIMING_RE.match(line)
+        if match:
+            percent = float(match["percent"])
+            self._progress.update(
+                phase=match["phase"],
+                percent=percent,
+                etc=match["etc"],
+                remaining=match["remaining"],
+            )
+            if (
+                match["phase"] != self._logged_phase
+                or percent - self._logged_percent >= PROGRESS_LOG_STEP
+            ):
+                self._logged_phase = match["phase"]
+                self._logged_percent = percent
+                logger.info(
+                    "Job %s progress: %s %.1f%% ETC %s",
+                    self.job_uid,
+                    match["phase"],
+                    percent,
+                    match["etc"] or "unknown",
+                )
+            return True
+
+        match = DONE_RE.match(line)
+        if match:
+            self._progress.update(
+                percent=100.0,
+                addresses=int(match["addresses"]),
+                hosts_up=int(match["up"]),
+                seconds=float(match["seconds"]),
+            )
+        return False
+
+    def _allow(self):
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.rate), self._tokens + (now - self._refilled_at) * self.rate
+        )
+        self._refilled_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def _emit(self, stream, line, repeats=0):
+        suffix = f" (repeated {repeats} times)" if repeats else ""
+        if stream == "stderr":
+            logger.error("Job %s nmap: %s%s", self.job_uid, line, suffix)
+        elif self._allow():
+            logger.info("Job %s nmap: %s%s", self.job_uid, line, suffix)
+        else:
+            self.suppressed += 1 + repeats
+
+    def _flush_repeats(self):
+        if self._repeats and self._last is not None:
+            self._emit(*self._last, repeats=self._repeats)
+        self._repeats = 0
+
+
+class RunningOutputs:
+    """
+    Output processors of the running Nmap processes, and the hosts reported
+    by the finished ones.
+    """
+
+    def __init__(self):
+        self._outputs = {}
+        self._finished_hosts = 0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def running(self, key, nmap_output):
+        """
+        Register nmap_output under key for the body of the with statement.
+        """
+        with self._lock:
+            self._outputs[key] = nmap_output
+        try:
+            yield nmap_output
+        finally:
+            with self._lock:
+                self._outputs.pop(key, None)
+                self._finished_hosts += nmap_output.progress()["hosts_reported"]
+
+    def progress(self):
+        """
+        Return the parsed progress of each running Nmap process by key.
+        """
+        with self._lock:
+            return {
+                key: nmap_output.progress()
+                for key, nmap_output in self._outputs.items()
+            }
+
+    def hosts_reported(self):
+        """
+        Return the number of hosts reported since the agent started.
+        """
+        with self._lock:
+            return self._finished_hosts + sum(
+                nmap_output.progress()["hosts_reported"]
+                for nmap_output in self._outputs.values()
+            )
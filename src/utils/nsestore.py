@@ -0,0 +1,405 @@
+"""
+Content-addressed NSE script store with per-job views and LRU eviction.
+"""
+
+import base64
+import contextlib
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+import time
+from utils.metrics import METRICS
+
+logger = logging.getLogger("Plum_Agent")
+
+OBJECTS_DIRNAME = "objects"
+VIEWS_DIRNAME = "views"
+NAMES_FILENAME = "names.json"
+LEGACY_INDEX_FILENAME = ".nse_index.json"
+OBJECT_SUFFIX = ".nse"
+BLOOM_FALSE_POSITIVE_RATE = 1e-6
+BLOOM_MIN_BITS = 64
+# Downloads of one object wait for each other, objects share the lock of
+# their digest modulo the pool size.
+DOWNLOAD_LOCKS = tuple(threading.Lock() for _ in range(256))
+
+
+def parse_nse_cache_max_mb(value, default=256):
+    """
+    Parse the NSE store size cap in megabytes.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError("nse_cache_max_mb must be an integer >= 1")
+
+    if isinstance(value, str) and not value.strip():
+        return default
+
+    try:
+        number = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError("nse_cache_max_mb must be an integer >= 1") from error
+
+    if number < 1:
+        raise ValueError("nse_cache_max_mb must be an integer >= 1")
+
+    return number
+
+
+def sha256_file(path):
+    """
+    Compute the SHA-256 of a local file.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_sha256_hex(digest):
+    """
+    Return True for a lowercase sha256 hex digest.
+    """
+    return (
+        isinstance(digest, str)
+        and len(digest) == 64
+        and all(char in "0123456789abcdef" for char in digest)
+    )
+
+
+def bloom_digest(hashes, false_positive_rate=BLOOM_FALSE_POSITIVE_RATE):
+    """
+    Return a Bloom filter of sha256 hex digests.
+
+    The filter holds m bits and k probes. Probe i of a digest sets bit
+    (h1 + i * h2) mod m, where h1 is the integer of its first 16 hex characters
+    and h2 the integer of the next 16 with the lowest bit set. Bit n is bit
+    n % 8, least significant first, of byte n // 8 of the base64 bits.
+    """
+    hashes = sorted(set(hashes))
+    bits_per_item = -math.log(false_positive_rate) / math.log(2) ** 2
+    size = max(BLOOM_MIN_BITS, math.ceil(len(hashes) * bits_per_item))
+    size += -size % 8
+    probes = max(1, round(bits_per_item * math.log(2)))
+    bits = bytearray(size // 8)
+    for digest in hashes:
+        for position in _bloom_positions(digest, size, probes):
+            bits[position // 8] |= 1 << (position % 8)
+    return {
+        "type": "bloom",
+        "m": size,
+        "k": probes,
+        "count": len(hashes),
+        "bits": base64.b64encode(bytes(bits)).decode("ascii"),
+    }
+
+
+def _bloom_positions(digest, size, probes):
+    first = int(digest[:16], 16)
+    second = int(digest[16:32], 16) | 1
+    return ((first + probe * second) % size for probe in range(probes))
+
+
+def bloom_contains(filter_digest, digest):
+    """
+    Return True when a digest may be in a filter built by bloom_digest.
+    """
+    bits = base64.b64decode(filter_digest["bits"])
+    return all(
+        bits[position // 8] >> (position % 8) & 1
+        for position in _bloom_positions(digest, filter_digest["m"], filter_digest["k"])
+    )
+
+
+class NseStore:
+    """
+    Keep NSE scripts as objects named by their sha256.
+
+    Jobs pin the objects they use in a view, a directory of hard links named
+    after the scripts, so two versions of one script name can be used at once.
+    Unpinned objects are evicted least recently used first once the store
+    exceeds max_bytes. The last hash seen for each script name is kept for
+    islands that still expect a name to hash map.
+
+    Objects advertised to the island must outlive the jobs leased against
+    that advertisement: eviction is suspended while an advertisement is in
+    flight, and the objects referenced by leased jobs are protected until
+    their lease ends.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(cache_dir, OBJECTS_DIRNAME)
+        self.views_dir = os.path.join(cache_dir, VIEWS_DIRNAME)
+        self.names_path = os.path.join(cache_dir, NAMES_FILENAME)
+        self.names = {}
+        self._sizes = {}
+        self._pins = {}
+        self._protected = {}
+        self._advertising = 0
+        self._digest = None
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_dir, exist_ok=True)
+        shutil.rmtree(self.views_dir, ignore_errors=True)
+        os.makedirs(self.views_dir)
+        self._load()
+        self._migrate_legacy_files()
+        with self._lock:
+            self._evict()
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects_dir, f"{digest}{OBJECT_SUFFIX}")
+
+    def _load(self):
+        for entry in os.listdir(self.objects_dir):
+            path = os.path.join(self.objects_dir, entry)
+            digest = entry[: -len(OBJECT_SUFFIX)]
+            if not entry.endswith(OBJECT_SUFFIX) or not is_sha256_hex(digest):
+                os.remove(path)
+                continue
+            self._sizes[digest] = os.path.getsize(path)
+
+        try:
+            with open(self.names_path, "r", encoding="utf-8") as handle:
+                names = json.load(handle)
+        except FileNotFoundError:
+            names = {}
+        except (OSError, ValueError) as error:
+            logger.warning("Ignoring unreadable NSE name map: %s", error)
+            names = {}
+        if isinstance(names, dict):
+            self.names = {
+                name: digest for name, digest in names.items() if digest in self._sizes
+            }
+
+    def _migrate_legacy_files(self):
+        """
+        Import scripts cached by basename before the store existed.
+        """
+        migrated = 0
+        for entry in sorted(os.listdir(self.cache_dir)):
+            path = os.path.join(self.cache_dir, entry)
+            if entry == LEGACY_INDEX_FILENAME:
+                os.remove(path)
+                continue
+            if not entry.endswith(".nse") or not os.path.isfile(path):
+                continue
+            digest = sha256_file(path)
+            os.replace(path, self._object_path(digest))
+            self._sizes[digest] = os.path.getsize(self._object_path(digest))
+            self.names[entry] = digest
+            migrated += 1
+        if migrated:
+            logger.info("Migrated %s cached NSE scripts to the store", migrated)
+            self._save_names()
+
+    def _save_names(self):
+        tmp_path = f"{self.names_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(self.names, handle, sort_keys=True)
+        os.replace(tmp_path, self.names_path)
+
+    def _evict(self):
+        if self._advertising:
+            return
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            return
+        now = time.monotonic()
+        self._protected = {
+            digest: until for digest, until in self._protected.items() if until > now
+        }
+        candidates = sorted(
+            (os.path.getmtime(self._object_path(digest)), digest)
+            for digest in self._sizes
+            if digest not in self._pins and digest not in self._protected
+        )
+        for _used_at, digest in candidates:
+            if total <= self.max_bytes:
+                break
+            os.remove(self._object_path(digest))
+            total -= self._sizes.pop(digest)
+            self._digest = None
+            logger.info("NSE store evicted %s", digest[:12])
+        self.names = {
+            name: digest for name, digest in self.names.items() if digest in self._sizes
+        }
+        self._save_names()
+
+    @contextlib.contextmanager
+    def advertising(self):
+        """
+        Suspend eviction while the store content is advertised to the island.
+        """
+        with self._lock:
+            self._advertising += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._advertising -= 1
+                self._evict()
+
+    def protect(self, digests, seconds):
+        """
+        Keep stored objects from eviction for seconds, for jobs still leased.
+        """
+        until = time.monotonic() + seconds
+        with self._lock:
+            for digest in digests:
+                if digest in self._sizes:
+                    self._protected[digest] = max(
+                        until, self._protected.get(digest, until)
+                    )
+
+    def _pin(self, view, digest):
+        self._pins.setdefault(digest, set()).add(view)
+        os.utime(self._object_path(digest))
+
+    def pin(self, view, digest):
+        """
+        Pin a stored object for a view, return False when it is not stored.
+        """
+        with self._lock:
+            if digest not in self._sizes:
+                return False
+            self._pin(view, digest)
+            return True
+
+    def put(self, view, digest, data):
+        """
+        Store verified script bytes under their sha256 and pin them for a view.
+        """
+        path = self._object_path(digest)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as handle:
+            handle.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._sizes[digest] = len(data)
+            self._digest = None
+            self._pin(view, digest)
+            self._evict()
+
+    def link(self, view, name, digest):
+        """
+        Expose a pinned object under its script name in a view, return its path.
+        """
+        view_dir = os.path.join(self.views_dir, view)
+        os.makedirs(view_dir, exist_ok=True)
+        path = os.path.join(view_dir, name)
+        try:
+            os.link(self._object_path(digest), path)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(self._object_path(digest), path)
+        with self._lock:
+            if self.names.get(name) != digest:
+                self.names[name] = digest
+                self._save_names()
+        return path
+
+    def release(self, view):
+        """
+        Remove a view and unpin its objects.
+        """
+        shutil.rmtree(os.path.join(self.views_dir, view), ignore_errors=True)
+        with self._lock:
+            for digest in [
+                digest for digest, views in self._pins.items() if view in views
+            ]:
+                self._pins[digest].discard(view)
+                if not self._pins[digest]:
+                    del self._pins[digest]
+            self._evict()
+
+    def hashes(self):
+        """
+        Return the last stored hash of each script name.
+        """
+        with self._lock:
+            return dict(self.names)
+
+    def digest(self):
+        """
+        Return a Bloom filter of every stored object hash.
+        """
+        with self._lock:
+            if self._digest is None:
+                self._digest = bloom_digest(self._sizes)
+            return self._digest
+
+    def __contains__(self, digest):
+        with self._lock:
+            return digest in self._sizes
+
+    def size(self):
+        """
+        Return the total size in bytes of the stored objects.
+        """
+        with self._lock:
+            return sum(self._sizes.values())
+
+
+def leased_nse_digests(jobs):
+    """
+    Return the digests of the NSE scripts referenced by job messages.
+    """
+    return {
+        str(descriptor.get("hash", "")).strip().lower()
+        for job_message in jobs
+        for descriptor in job_message.get("nse_scripts") or []
+        if isinstance(descriptor, dict)
+    }
+
+
+def download_lock(digest):
+    """
+    Return the lock serializing the download of one store object.
+    """
+    return DOWNLOAD_LOCKS[int(digest, 16) % len(DOWNLOAD_LOCKS)]
+
+
+def safe_nse_filename(name):
+    """
+    Restrict cached NSE files to their basename.
+    """
+    return os.path.basename(str(name or "").strip())
+
+
+def resolve_nse_script(store, view, descriptor):
+    """
+    Ensure one NSE script is stored with the expected hash and return its path
+    in the job view. Jobs requesting the same object wait for a single download,
+    other scripts are stored in parallel unless their digests share a lock.
+    """
+    nse_name = safe_nse_filename(descriptor.get("name"))
+    expected_hash = str(descriptor.get("hash", "")).strip().lower()
+    if not nse_name or not is_sha256_hex(expected_hash):
+        raise ValueError("Invalid NSE descriptor received from controller")
+
+    with download_lock(expected_hash):
+        if store.pin(view, expected_hash):
+            logger.info("NSE cache hit: %s", nse_name)
+            METRICS.inc("plum_nse_cache_total", result="hit")
+        else:
+            content_b64 = descriptor.get("content_b64")
+            if not content_b64:
+                raise ValueError(f"Missing updated NSE payload for {nse_name}")
+
+            file_bytes = base64.b64decode(content_b64)
+            if hashlib.sha256(file_bytes).hexdigest() != expected_hash:
+                raise ValueError(f"Hash mismatch for {nse_name}")
+
+            store.put(view, expected_hash, file_bytes)
+            logger.info("NSE cache refresh: %s", nse_name)
+            METRICS.inc("plum_nse_cache_total", result="refresh")
+    return store.link(view, nse_name, expected_hash)
@@ -0,0 +1,131 @@
+"""
+Result post-processing: report conversion, serialization and compression.
+
+Large reports are converted in worker processes, so the CPU work does not hold
+the GIL of the agent process while the scheduler, the Nmap supervisor and the
+uploader keep running. The workers return ready-to-send request bodies.
+"""
+
+import json
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.compression import compress_body
+from utils.netutils import WIRE_FORMAT_JSON, serialize_payload
+from utils.xmlstream import nmap_stream_to_json
+
+logger = logging.getLogger("Plum_Agent")
+
+
+def parse_result_workers(value, default=0):
+    """
+    Parse the number of result conversion processes, 0 converts in-thread.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError("result_workers must be an integer >= 0")
+
+    if isinstance(value, str) and not value.strip():
+        return default
+
+    try:
+        workers = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError("result_workers must be an integer >= 0") from error
+
+    if workers < 0:
+        raise ValueError("result_workers must be an integer >= 0")
+
+    return workers
+
+
+def encode_result_payload(data, wire_format, encoding=None, level=None, threshold=0):
+    """
+    Serialize a result payload and compress it above threshold bytes.
+    Return the body, its request headers and the uncompressed size.
+    """
+    body = serialize_payload(data, wire_format)
+    headers = {"Content-Type": "application/json"}
+    raw_size = len(body)
+    if not encoding or raw_size < threshold:
+        return body, headers, raw_size
+
+    body = compress_body(body, encoding, level)
+    headers["Content-Encoding"] = encoding
+    return body, headers, raw_size
+
+
+def convert_report(output_xml, data, extra=None, skip_hosts=0, **encoding):
+    """
+    Convert an Nmap XML report into an encoded sndjob body.
+
+    data holds the payload fields preceding RESULT, extra the fields following
+    it. The first skip_hosts hosts of the report are left out. encoding holds
+    the encode_result_payload keyword arguments.
+    """
+    results = nmap_stream_to_json(output_xml, True, True)[skip_hosts:]
+    if encoding.get("wire_format") != WIRE_FORMAT_JSON:
+        results = json.dumps(results)
+    return encode_result_payload(data | {"RESULT": results} | (extra or {}), **encoding)
+
+
+class ResultConverter:
+    """
+    Run convert_report in a pool of worker processes.
+
+    Workers are started with the spawn method, the agent process already
+    runs threads when the pool starts. A broken pool is replaced on the next
+    conversion, the failed conversion is retried in the calling thread.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the worker processes.
+        """
+        self._pool()
+        return self
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def convert(self, output_xml, data, extra=None, skip_hosts=0, **encoding):
+        """
+        Convert a report in a worker process, see convert_report.
+        """
+        executor = self._pool()
+        try:
+            future = executor.submit(
+                convert_report, output_xml, data, extra, skip_hosts, **encoding
+            )
+            return future.result()
+        except BrokenProcessPool:
+            logger.warning("Result conversion worker died, converting in-thread")
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+        return convert_report(output_xml, data, extra, skip_hosts, **encoding)
+
+    def stop(self):
+        """
+        Stop the worker processes once their conversions are done.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,193 @@
+"""
+Bounded buffer of leased jobs kept topped up by a background fetcher.
+"""
+
+import collections
+import logging
+import threading
+import time
+from utils.mutils import short_uid
+
+logger = logging.getLogger("Plum_Agent")
+
+PREFETCH_BACKOFF_START = 5
+PREFETCH_BACKOFF_MAX = 60
+PREFETCH_NO_JOB_SLEEP = 30
+PREFETCH_STANDBY_SLEEP = 60
+
+
+def _parse_int(name, value, default, minimum):
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be an integer >= {minimum}")
+
+    if isinstance(value, str) and not value.strip():
+        return default
+
+    try:
+        number = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"{name} must be an integer >= {minimum}") from error
+
+    if number < minimum:
+        raise ValueError(f"{name} must be an integer >= {minimum}")
+
+    return number
+
+
+def parse_prefetch_depth(value, default=0):
+    """
+    Parse the number of jobs leased ahead of free scan slots, 0 disables it.
+    """
+    return _parse_int("prefetch_depth", value, default, 0)
+
+
+def parse_prefetch_lease(value, default=600):
+    """
+    Parse how many seconds a prefetched job may wait before it is dropped.
+    """
+    return _parse_int("prefetch_lease", value, default, 1)
+
+
+def leased_jobs(response, count, batch=False):
+    """
+    Return up to count job messages holding a target from a getjob response,
+    none for an empty queue. Raise RuntimeError for an invalid response.
+    """
+    if response is None or ("message" not in response and "messages" not in response):
+        raise RuntimeError("Invalid job response from controller")
+
+    if batch and "messages" in response:
+        logger.debug("Messages Received: %s", response.get("messages"))
+        job_messages = response.get("messages") or []
+        if not isinstance(job_messages, list):
+            raise RuntimeError("Invalid job message from controller")
+    else:
+        logger.debug("Message Received: %s", response.get("message"))
+        job_messages = [response.get("message") or {}]
+
+    jobs = []
+    for job_message in job_messages[:count]:
+        if not isinstance(job_message, dict):
+            raise RuntimeError("Invalid job message from controller")
+        # Validate JOB
+        if job_message.get("job"):
+            jobs.append(job_message)
+    return jobs
+
+
+class JobPrefetcher:
+    """
+    Keep up to depth jobs leased from the controller ready for free slots.
+
+    fetch(count) returns a list of up to count job messages, an empty list when
+    the queue is empty, or raises RuntimeError on controller errors. active() tells whether the agent may
+    take jobs right now. wakeup is set whenever a new job becomes available.
+
+    A job expires at its lease_expires epoch when the controller provides one,
+    otherwise lease_seconds after it was fetched. Expired jobs are dropped
+    because the controller may already have handed them to another agent.
+    """
+
+    def __init__(self, fetch, depth, lease_seconds, active=None, wakeup=None):
+        self.fetch = fetch
+        self.depth = depth
+        self.lease_seconds = lease_seconds
+        self.active = active or (lambda: True)
+        self.wakeup = wakeup
+        self._jobs = collections.deque()
+        self._space = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """
+        Start the fetcher thread.
+        """
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the fetcher thread. Buffered jobs are forgotten.
+        """
+        self._stop.set()
+        with self._space:
+            self._space.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def __len__(self):
+        with self._space:
+            return len(self._jobs)
+
+    def _expires_at(self, job_message):
+        lease_expires = job_message.get("lease_expires")
+        if isinstance(lease_expires, (int, float)) and not isinstance(
+            lease_expires, bool
+        ):
+            return time.monotonic() + lease_expires - time.time()
+        return time.monotonic() + self.lease_seconds
+
+    def put(self, job_message):
+        """
+        Buffer a leased job.
+        """
+        with self._space:
+            self._jobs.append((self._expires_at(job_message), job_message))
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def get(self):
+        """
+        Return the oldest job still under lease, or None.
+        """
+        with self._space:
+            while self._jobs:
+                expires_at, job_message = self._jobs.popleft()
+                self._space.notify_all()
+                if time.monotonic() < expires_at:
+                    return job_message
+                logger.warning(
+                    "Job %s lease expired before a slot was free, dropped",
+                    short_uid(job_message.get("job_uid")),
+                )
+        return None
+
+    def _wait_for_space(self):
+        with self._space:
+            while len(self._jobs) >= self.depth and not self._stop.is_set():
+                self._space.wait()
+
+    def _run(self):
+        backoff = PREFETCH_BACKOFF_START
+        while not self._stop.is_set():
+            self._wait_for_space()
+            if self._stop.is_set():
+                break
+            if not self.active():
+                self._stop.wait(PREFETCH_STANDBY_SLEEP)
+                continue
+
+            try:
+                jobs = self.fetch(max(self.depth - len(self), 1))
+                backoff = PREFETCH_BACKOFF_START
+            except RuntimeError as error:
+                logger.error("%s", error)
+                logger.info("Controller backoff %ss", backoff)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, PREFETCH_BACKOFF_MAX)
+                continue
+
+            for job_message in jobs:
+                self.put(job_message)
+                logger.info(
+                    "Job %s prefetched (%s/%s buffered)",
+                    short_uid(job_message.get("job_uid")),
+                    len(self),
+                    self.depth,
+                )
+
+            if not jobs:
+                logger.info("Prefetch sleeping %ss", PREFETCH_NO_JOB_SLEEP)
+                self._stop.wait(PREFETCH_NO_JOB_SLEEP)
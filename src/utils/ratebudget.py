@@ -0,0 +1,78 @@
+"""
+Agent-wide packet rate budget shared by the running Nmap processes.
+"""
+
+import contextlib
+import threading
+
+
+def parse_max_rate(value, default=0):
+    """
+    Parse the packets per second budget of all Nmap processes, 0 disables it.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError("max_rate must be an integer >= 0")
+
+    if isinstance(value, str) and not value.strip():
+        return default
+
+    try:
+        max_rate = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError("max_rate must be an integer >= 0") from error
+
+    if max_rate < 0:
+        raise ValueError("max_rate must be an integer >= 0")
+
+    return max_rate
+
+
+class RateBudget:
+    """
+    Split a packets per second budget among Nmap processes.
+
+    Nmap cannot change its rate once started, so each process keeps the share
+    it got at start: the unallocated budget divided by the slots without a
+    share. Shares of finished processes return to the budget and go to the
+    next processes. Each share is at least one packet per second, so once the
+    budget is allocated every further process adds one packet per second to
+    the total: processes are never held back waiting for a share.
+    """
+
+    def __init__(self, total=0, slots=lambda: 1):
+        self.total = total
+        self.slots = slots
+        self.allocated = 0
+        self.holders = 0
+        self._lock = threading.Lock()
+
+    def configure(self, total):
+        """
+        Set the budget in packets per second, 0 disables it.
+        """
+        with self._lock:
+            self.total = total
+
+    @contextlib.contextmanager
+    def share(self):
+        """
+        Yield the packets per second of a starting Nmap process, None without
+        a budget. The share returns to the budget on exit.
+        """
+        with self._lock:
+            if not self.total:
+                share = None
+            else:
+                free_slots = max(self.slots() - self.holders, 1)
+                share = max((self.total - self.allocated) // free_slots, 1)
+                self.allocated += share
+                self.holders += 1
+        try:
+            yield share
+        finally:
+            if share is not None:
+                with self._lock:
+                    self.allocated -= share
+                    self.holders -= 1
@@ -0,0 +1,178 @@
+"""
+Incremental delivery of host results while Nmap is still running.
+"""
+
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ET
+from utils.xmlstream import NmapXmlTail
+
+logger = logging.getLogger("Plum_Agent")
+
+TAIL_POLL_INTERVAL = 2
+
+
+def parse_result_streaming(value, default=False):
+    """
+    Parse the per-host result streaming switch.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+
+    value = str(value).strip().lower()
+    if not value:
+        return default
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise ValueError("result_streaming must be a boolean")
+
+
+def _parse_positive_int(name, value, default):
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be an integer >= 1")
+
+    if isinstance(value, str) and not value.strip():
+        return default
+
+    try:
+        number = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"{name} must be an integer >= 1") from error
+
+    if number < 1:
+        raise ValueError(f"{name} must be an integer >= 1")
+
+    return number
+
+
+def parse_result_batch_hosts(value, default=256):
+    """
+    Parse the number of host records that triggers a batch upload.
+    """
+    return _parse_positive_int("result_batch_hosts", value, default)
+
+
+def parse_result_batch_seconds(value, default=60):
+    """
+    Parse the maximum age in seconds of a pending batch.
+    """
+    return _parse_positive_int("result_batch_seconds", value, default)
+
+
+class ResultBatcher:
+    """
+    Buffer host records until the size or the age limit is reached.
+    """
+
+    def __init__(self, max_hosts, max_seconds):
+        self.max_hosts = max_hosts
+        self.max_seconds = max_seconds
+        self.records = []
+        self.first_added = None
+
+    def add(self, records):
+        """
+        Queue new host records.
+        """
+        if records and not self.records:
+            self.first_added = time.monotonic()
+        self.records.extend(records)
+
+    def due(self, now=None):
+        """
+        Return True when the pending batch must be flushed.
+        """
+        if not self.records:
+            return False
+        if len(self.records) >= self.max_hosts:
+            return True
+        if now is None:
+            now = time.monotonic()
+        return now - self.first_added >= self.max_seconds
+
+    def take(self):
+        """
+        Return and forget every pending record.
+        """
+        records, self.records = self.records, []
+        self.first_added = None
+        return records
+
+
+class PartialResultStreamer:
+    """
+    Tail a growing Nmap XML report in a background thread and push batches of
+    completed hosts through send_batch(records, sequence) -> bool.
+    Records of failed batches stay pending for the next flush or the final send.
+    """
+
+    def __init__(self, job_uid, output_xml, send_batch, max_hosts, max_seconds):
+        self.job_uid = job_uid
+        self.send_batch = send_batch
+        self.tail = NmapXmlTail(output_xml, True, True)
+        self.batcher = ResultBatcher(max_hosts, max_seconds)
+        self.batches_sent = 0
+        self.hosts_sent = 0
+        self.broken = False
+        self._retry_at = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """
+        Start tailing the report.
+        """
+        self._thread.start()
+
+    def _poll(self):
+        if self.broken:
+            return
+        try:
+            self.batcher.add(self.tail.poll())
+        except ET.ParseError as error:
+            logger.warning("Job %s stops streaming results: %s", self.job_uid, error)
+            self.broken = True
+
+    def _flush(self):
+        records = self.batcher.take()
+        if self.send_batch(records, self.batches_sent):
+            self.batches_sent += 1
+            self.hosts_sent += len(records)
+            logger.info(
+                "Job %s sent batch %s with %s hosts",
+                self.job_uid,
+                self.batches_sent,
+                len(records),
+            )
+            return
+
+        logger.warning("Job %s batch send failed, keeping hosts", self.job_uid)
+        self.batcher.add(records + self.batcher.take())
+        self._retry_at = time.monotonic() + self.batcher.max_seconds
+
+    def _run(self):
+        while not self._stop.wait(TAIL_POLL_INTERVAL):
+            self._poll()
+            if self.batcher.due() and time.monotonic() >= self._retry_at:
+                self._flush()
+
+    def finish(self):
+        """
+        Stop tailing, read the end of the report and return unsent records.
+        When the report could not be followed, broken is set and the caller
+        must convert the whole report instead. Sent batches always hold the
+        first hosts_sent hosts of the report, which the caller skips.
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._poll()
+        self.tail.close()
+        return self.batcher.take()
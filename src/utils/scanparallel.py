@@ -2,25 +2,200 @@
 Helpers for scan parallelism configuration.
 """
 
+import logging
+import os
+import time
+
+logger = logging.getLogger("Plum_Agent")
+
+SCANPARALLEL_AUTO = "auto"
+# Seconds between two adjustments of the automatic scan parallelism.
+AUTO_INTERVAL = 60
+# One minute load average per CPU above which the host is overloaded.
+AUTO_LOAD_HIGH = 1.0
+# Busy CPU fraction above which the host is overloaded.
+AUTO_CPU_HIGH = 0.9
+# Host rate ratio after an increase below which the increase is undone.
+AUTO_THROUGHPUT_DROP = 0.8
+
 
 def parse_scanparallel(value, default=1):
     """
-    Parse the maximum number of concurrent scan jobs.
+    Parse the maximum number of concurrent scan jobs, or auto.
     """
     if value is None:
         return default
     if isinstance(value, bool):
-        raise ValueError("scanparallel must be an integer >= 0")
+        raise ValueError("scanparallel must be an integer >= 0 or auto")
 
     if isinstance(value, str) and not value.strip():
         return default
+    if isinstance(value, str) and value.strip().lower() == SCANPARALLEL_AUTO:
+        return SCANPARALLEL_AUTO
 
     try:
         scanparallel = int(value)
     except (TypeError, ValueError) as error:
-        raise ValueError("scanparallel must be an integer >= 0") from error
+        raise ValueError("scanparallel must be an integer >= 0 or auto") from error
 
     if scanparallel < 0:
-        raise ValueError("scanparallel must be an integer >= 0")
+        raise ValueError("scanparallel must be an integer >= 0 or auto")
+
+    return scanparallel
+
+
+def _parse_bound(name, value, default):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return default
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be an integer >= 1")
+
+    try:
+        number = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError(f"{name} must be an integer >= 1") from error
+
+    if number < 1:
+        raise ValueError(f"{name} must be an integer >= 1")
+
+    return number
 
+
+def parse_scanparallel_bounds(minimum, maximum):
+    """
+    Parse the bounds of scanparallel auto, default 1 to the CPU count.
+    """
+    minimum = _parse_bound("scanparallel_min", minimum, 1)
+    maximum = _parse_bound("scanparallel_max", maximum, os.cpu_count() or 1)
+    if maximum < minimum:
+        raise ValueError("scanparallel_max must be >= scanparallel_min")
+    return minimum, maximum
+
+
+def max_scanparallel(scanparallel, bounds):
+    """
+    Return the highest number of concurrent jobs scanparallel can reach.
+    """
+    if scanparallel == SCANPARALLEL_AUTO:
+        return bounds[1]
     return scanparallel
+
+
+def read_cpu_times(path="/proc/stat"):
+    """
+    Return the (busy, total) CPU jiffies of the host, None when unavailable.
+    """
+    try:
+        with open(path, "r", encoding="ascii") as handle:
+            fields = handle.readline().split()
+    except OSError:
+        return None
+    if not fields or fields[0] != "cpu":
+        return None
+
+    times = [int(field) for field in fields[1:]]
+    # idle and iowait do not keep the CPU busy.
+    idle = sum(times[3:5])
+    return sum(times) - idle, sum(times)
+
+
+def read_load_per_cpu():
+    """
+    Return the one minute load average per CPU, None when unavailable.
+    """
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return None
+
+
+class AdaptiveParallelism:
+    """
+    Adjust the number of concurrent scan jobs with an AIMD policy.
+
+    Every interval the limit grows by one when all slots are busy and the host
+    has headroom. It is halved when the load average or the CPU use is too
+    high, or when the host rate fell after the previous increase, the sign
+    that the network link or the targets are saturated.
+    """
+
+    def __init__(
+        self,
+        minimum,
+        maximum,
+        interval=AUTO_INTERVAL,
+        load_per_cpu=read_load_per_cpu,
+        cpu_times=read_cpu_times,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.interval = interval
+        self.limit = minimum
+        self._load_per_cpu = load_per_cpu
+        self._cpu_times = cpu_times
+        self._checked_at = None
+        self._hosts = 0
+        self._cpu = cpu_times()
+        self._rate = None
+        self._increased = False
+
+    def update(self, busy, hosts, now=None):
+        """
+        Return the limit for busy running jobs and hosts, the total number of
+        hosts Nmap reported so far.
+        """
+        now = time.monotonic() if now is None else now
+        if self._checked_at is None:
+            self._checked_at = now
+            self._hosts = hosts
+            return self.limit
+        elapsed = now - self._checked_at
+        if elapsed < self.interval:
+            return self.limit
+
+        rate = (hosts - self._hosts) * 60 / elapsed
+        load = self._load_per_cpu()
+        cpu = self._cpu_use()
+        reason = None
+        if (load is not None and load > AUTO_LOAD_HIGH) or (
+            cpu is not None and cpu > AUTO_CPU_HIGH
+        ):
+            reason = "host overloaded"
+        elif (
+            self._increased
+            and busy >= self.limit
+            and self._rate
+            and rate < self._rate * AUTO_THROUGHPUT_DROP
+        ):
+            # Only a drop with every slot busy points at saturation.
+            reason = "host rate fell"
+
+        previous = self.limit
+        if reason:
+            self.limit = max(self.minimum, self.limit // 2)
+        elif busy >= self.limit:
+            self.limit = min(self.maximum, self.limit + 1)
+            reason = "all slots busy"
+        self._increased = self.limit > previous
+        if self.limit != previous:
+            logger.info(
+                "scanparallel auto %s -> %s, %s (load %s/cpu, cpu %s, %.0f hosts/min)",
+                previous,
+                self.limit,
+                reason,
+                "n/a" if load is None else f"{load:.2f}",
+                "n/a" if cpu is None else f"{cpu:.0%}",
+                rate,
+            )
+
+        self._checked_at = now
+        self._hosts = hosts
+        self._rate = rate
+        return self.limit
+
+    def _cpu_use(self):
+        current = self._cpu_times()
+        previous, self._cpu = self._cpu, current
+        if current is None or previous is None or current[1] <= previous[1]:
+            return None
+        return (current[0] - previous[0]) / (current[1] - previous[1])
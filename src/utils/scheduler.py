@@ -0,0 +1,319 @@
+"""
+Daemon scheduler starting scan jobs on the free scan slots.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.metrics import METRICS
+from utils.mutils import short_uid
+
+logger = logging.getLogger("Plum_Agent")
+
+NO_JOB_SLEEP = 30
+STANDBY_SLEEP = 60
+BACKOFF_START = 5
+BACKOFF_MAX = 60
+# Seconds between two standby logs outside scanhours.
+STANDBY_LOG_INTERVAL = 3600
+
+
+class DaemonScheduler:
+    """
+    Run scan jobs on a thread pool within the scan slot limit.
+
+    Each round applies a pending reload or drain request, adjusts an automatic
+    limit, then fills the free slots with interrupted jobs first, prefetched
+    jobs next, or jobs fetched from the controller. Between rounds the
+    scheduler sleeps until wakeup is set by a finished job, a prefetched job
+    or a control request. Subclasses provide the agent hooks.
+    """
+
+    def __init__(self, slots, wakeup, reload_requested, drain_requested):
+        self.slots = slots
+        self.wakeup = wakeup
+        self.reload_requested = reload_requested
+        self.drain_requested = drain_requested
+        self.controller = None
+        self.limit = 0
+        self.max_workers = 1
+        self.executor = None
+        self.running = {}
+        self.resumed = []
+        self.prefetcher = None
+        self.backoff_delay = BACKOFF_START
+        self.last_standby_log = None
+
+    def parallelism(self, scanparallel, controller):
+        """
+        Return the (controller, slot limit, worker count) of scanparallel.
+        """
+        raise NotImplementedError
+
+    def reload(self):
+        """
+        Reload the configuration, return the new scanparallel or None.
+        """
+        raise NotImplementedError
+
+    def run_job(self, job_message):
+        """
+        Run one scan job, return True once its result is delivered.
+        """
+        raise NotImplementedError
+
+    def fetch_jobs(self, count):
+        """
+        Return up to count jobs from the controller, raise RuntimeError on
+        controller errors.
+        """
+        raise NotImplementedError
+
+    def batch_supported(self):
+        """
+        Return True when the controller leases several jobs per request.
+        """
+        raise NotImplementedError
+
+    def scanhours_enabled(self):
+        """
+        Return True when jobs may run now.
+        """
+        raise NotImplementedError
+
+    def scanhours(self):
+        """
+        Return the configured scan window for the standby log.
+        """
+        raise NotImplementedError
+
+    def hosts_reported(self):
+        """
+        Return the hosts reported by Nmap since the agent started.
+        """
+        raise NotImplementedError
+
+    def start_prefetcher(self, limit):
+        """
+        Start and return the job prefetcher, None when prefetch is disabled.
+        """
+        raise NotImplementedError
+
+    def terminate_running(self):
+        """
+        Terminate the processes of the running jobs.
+        """
+        raise NotImplementedError
+
+    def run(self, scanparallel, resumed):
+        """
+        Schedule jobs until a drain request, starting with the resumed jobs.
+        """
+        self.controller, self.limit, self.max_workers = self.parallelism(
+            scanparallel, None
+        )
+        if self.controller is not None:
+            logger.info(
+                "Starting to work endlessly with scanparallel=auto (%s to %s)",
+                self.controller.minimum,
+                self.controller.maximum,
+            )
+        else:
+            logger.info("Starting to work endlessly with scanparallel=%s", self.limit)
+        self.slots.configure(self.limit)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.resumed = list(resumed)
+        self.prefetcher = self.start_prefetcher(self.limit)
+        METRICS.track("plum_jobs_queued", self.queued)
+        try:
+            while self._round():
+                pass
+        except KeyboardInterrupt:
+            logger.warning("Stopping running scans")
+            self.terminate_running()
+            raise
+        finally:
+            METRICS.track("plum_jobs_queued", None)
+            if self.prefetcher is not None:
+                self.prefetcher.stop()
+            if self.running:
+                self.terminate_running()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def queued(self):
+        """
+        Return the resumed and prefetched jobs waiting for a slot.
+        """
+        prefetched = len(self.prefetcher) if self.prefetcher is not None else 0
+        return len(self.resumed) + prefetched
+
+    def free_slots(self):
+        """
+        Return the number of free scan slots.
+        """
+        return max(self.limit - self.slots.busy(), 0)
+
+    def _round(self):
+        """
+        Run one scheduling round, return False once drained.
+        """
+        self.drain_finished()
+        if self.reload_requested.is_set():
+            self.reload_requested.clear()
+            self._reload()
+
+        if self.drain_requested.is_set():
+            return self._drain()
+
+        if self.controller is not None:
+            self.limit = self.controller.update(
+                self.slots.busy(), self.hosts_reported()
+            )
+            self.slots.configure(self.limit)
+
+        delay = self._standby_delay()
+        if delay is None:
+            delay = self._start_jobs()
+        if delay:
+            self.wait(delay)
+        return True
+
+    def _reload(self):
+        """
+        Apply a configuration reload to the slots, the pool and the prefetcher.
+        """
+        scanparallel = self.reload()
+        if scanparallel is None:
+            return
+        self.controller, self.limit, workers = self.parallelism(
+            scanparallel, self.controller
+        )
+        self.slots.configure(self.limit)
+        if workers > self.max_workers:
+            # Running jobs finish on the threads of the old pool.
+            self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+            self.max_workers = workers
+        if self.prefetcher is None and not self.drain_requested.is_set():
+            self.prefetcher = self.start_prefetcher(self.limit)
+
+    def _drain(self):
+        """
+        Stop prefetching and wait for the running jobs, return False once
+        none is left.
+        """
+        if self.prefetcher is not None:
+            logger.info(
+                "Draining, %s prefetched jobs left to their lease",
+                len(self.prefetcher),
+            )
+            self.prefetcher.stop()
+            self.prefetcher = None
+        if not self.running:
+            logger.info("Drain complete, stopping")
+            return False
+        logger.info("Draining, waiting for %s running jobs", len(self.running))
+        self.wait(STANDBY_SLEEP)
+        return True
+
+    def _standby_delay(self):
+        """
+        Return the standby delay outside scanhours or without any slot, None
+        when jobs may start.
+        """
+        if not self.scanhours_enabled():
+            now = time.monotonic()
+            if (
+                self.last_standby_log is None
+                or now - self.last_standby_log >= STANDBY_LOG_INTERVAL
+            ):
+                logger.info("Outside scanhours %s GMT, standby", self.scanhours())
+                self.last_standby_log = now
+            return STANDBY_SLEEP
+
+        if self.limit == 0:
+            logger.info("scanparallel is 0, standby")
+            return STANDBY_SLEEP
+        return None
+
+    def _start_jobs(self):
+        """
+        Start jobs on the free slots, return the delay before the next round.
+        """
+        # Interrupted jobs are resumed before any new job starts.
+        while self.resumed and self.free_slots():
+            self.submit(self.resumed.pop(0))
+
+        if not self.free_slots():
+            return STANDBY_SLEEP
+
+        if self.prefetcher is not None:
+            while self.free_slots():
+                job_message = self.prefetcher.get()
+                if job_message is None:
+                    break
+                self.submit(job_message)
+            return STANDBY_SLEEP
+
+        return self._fetch_and_start()
+
+    def _fetch_and_start(self):
+        """
+        Fetch jobs for the free slots, return the delay before the next round.
+        """
+        while self.free_slots():
+            free_slots = self.free_slots()
+            try:
+                jobs = self.fetch_jobs(free_slots)
+            except RuntimeError as error:
+                logger.error("%s", error)
+                logger.info("Controller backoff %ss", self.backoff_delay)
+                delay = self.backoff_delay
+                self.backoff_delay = min(self.backoff_delay * 2, BACKOFF_MAX)
+                return delay
+            self.backoff_delay = BACKOFF_START
+
+            for job_message in jobs:
+                self.submit(job_message)
+
+            # A short batch means the controller queue is drained.
+            if not jobs or (self.batch_supported() and len(jobs) < free_slots):
+                logger.info("Sleeping %ss", NO_JOB_SLEEP)
+                return NO_JOB_SLEEP
+        return 0
+
+    def submit(self, job_message):
+        """
+        Start a scan job on a free slot.
+        """
+        job_uid = short_uid(job_message.get("job_uid"))
+        self.slots.job_started()
+        future = self.executor.submit(self.run_job, job_message)
+        future.add_done_callback(lambda _future: self.slots.job_finished())
+        self.running[future] = job_uid
+        logger.info(
+            "Job %s queued (%s/%s running)", job_uid, len(self.running), self.limit
+        )
+
+    def drain_finished(self):
+        """
+        Forget finished jobs and log their failures.
+        """
+        for future in [future for future in self.running if future.done()]:
+            job_uid = self.running.pop(future, "unknown")
+            try:
+                if not future.result():
+                    logger.error("Job %s failed", job_uid)
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Job %s worker failed", job_uid)
+
+    def wait(self, delay):
+        """
+        Sleep until a job finishes, a prefetched job arrives, a control
+        request is set or delay expires.
+        """
+        started = time.monotonic()
+        self.wakeup.wait(delay)
+        self.wakeup.clear()
+        METRICS.inc("plum_scheduler_wait_seconds_total", time.monotonic() - started)
+        self.drain_finished()
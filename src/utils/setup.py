@@ -9,13 +9,71 @@ import uuid
 import yaml
 from utils.meta import get_bot_info
 from utils.mutils import locate_elf, Dict2obj
-from utils.netutils import get_ext_ip, robust_request
+from utils.netutils import (
+    WIRE_FORMAT_JSON,
+    WIRE_FORMAT_LEGACY,
+    get_ext_ip,
+    parse_ext_ip_cache_ttl,
+    parse_ext_ip_quorum,
+    robust_request,
+)
+from utils.httpsession import (
+    configure_session,
+    parse_http_keepalive,
+    parse_http_pool_size,
+)
 from utils.logrotation import parse_logrotation
-from utils.scanparallel import parse_scanparallel
-from utils.scanhours import normalize_scanhours
+from utils.resultstream import (
+    parse_result_batch_hosts,
+    parse_result_batch_seconds,
+    parse_result_streaming,
+)
+from utils.prefetch import parse_prefetch_depth, parse_prefetch_lease
+from utils.nsestore import parse_nse_cache_max_mb
+from utils.nmapoutput import parse_nmap_output_rate, parse_nmap_trace
+from utils.postprocess import parse_result_workers
+from utils.sharding import parse_shard_hosts
+from utils.ratebudget import parse_max_rate
+from utils.checkpoint import parse_scan_checkpoint
+from utils.metrics import parse_metrics_listen
+from utils.tracing import parse_job_trace
+from utils.compression import (
+    available_encodings,
+    compression_level_setting,
+    parse_compression_level,
+    parse_compression_threshold,
+    parse_result_compression,
+)
+from utils.scanparallel import (
+    max_scanparallel,
+    parse_scanparallel,
+    parse_scanparallel_bounds,
+)
+from utils.scanhours import is_scanhours_active, normalize_scanhours
 
 logger = logging.getLogger("Plum_Agent")
 
+# Optional protocol features advertised in the register beacon.
+CAPABILITY_JSON_BODY = "json_body"
+CAPABILITY_PARTIAL_RESULTS = "partial_results"
+CAPABILITY_BATCH_GETJOB = "batch_getjob"
+CAPABILITY_NSE_DIGEST = "nse_digest"
+AGENT_CAPABILITIES = (
+    CAPABILITY_JSON_BODY,
+    CAPABILITY_BATCH_GETJOB,
+    CAPABILITY_NSE_DIGEST,
+)
+# Result upload compression, one capability per content encoding.
+COMPRESSION_CAPABILITY_SUFFIX = "_results"
+# Settings re-read from config/config.yaml on SIGHUP.
+RELOADABLE_SETTINGS = (
+    "scanparallel",
+    "scanparallel_min",
+    "scanparallel_max",
+    "scanhours",
+    "logrotation",
+)
+
 
 class APIPath:
     """
@@ -36,7 +94,15 @@ def save_config(curr_config):
     # Never save some paramaters.
     svg_config = curr_config.copy()
     config_file = os.path.join(svg_config.get("THIS_DIR"), "config", "config.yaml")
-    for item in ["verbose", "curr_ip", "THIS_DIR", "APIPATH"]:
+    for item in [
+        "verbose",
+        "curr_ip",
+        "THIS_DIR",
+        "APIPATH",
+        "island_capabilities",
+        "wire_format",
+        "result_encoding",
+    ]:
         svg_config.pop(item, None)
 
     with open(config_file, "w", encoding="utf-8") as of:
@@ -44,6 +110,97 @@ def save_config(curr_config):
     logger.debug("Saved configuration: %s", svg_config)
 
 
+def _compression_encodings(cfg):
+    """
+    Return the result encodings allowed by configuration, preferred first.
+    """
+    compression = parse_result_compression(cfg.get("result_compression"))
+    if compression == "none":
+        return []
+    if compression == "auto":
+        return available_encodings()
+    return [compression]
+
+
+def agent_capabilities(cfg):
+    """
+    Return the capabilities advertised in the register beacon.
+    """
+    capabilities = list(AGENT_CAPABILITIES)
+    if parse_result_streaming(cfg.get("result_streaming")):
+        capabilities.append(CAPABILITY_PARTIAL_RESULTS)
+    return capabilities + [
+        f"{encoding}{COMPRESSION_CAPABILITY_SUFFIX}"
+        for encoding in _compression_encodings(cfg)
+    ]
+
+
+def negotiate_capabilities(cfg, ready_msg):
+    """
+    Keep the optional features both the agent and the island support.
+    Older islands do not answer with capabilities and keep the legacy protocol.
+    """
+    island_capabilities = getattr(ready_msg, "capabilities", None)
+    if not isinstance(island_capabilities, list):
+        island_capabilities = []
+
+    cfg["island_capabilities"] = [
+        capability
+        for capability in agent_capabilities(cfg)
+        if capability in island_capabilities
+    ]
+    if CAPABILITY_JSON_BODY in cfg["island_capabilities"]:
+        cfg["wire_format"] = WIRE_FORMAT_JSON
+    else:
+        cfg["wire_format"] = WIRE_FORMAT_LEGACY
+
+    cfg["result_encoding"] = None
+    for encoding in _compression_encodings(cfg):
+        if f"{encoding}{COMPRESSION_CAPABILITY_SUFFIX}" in cfg["island_capabilities"]:
+            cfg["result_encoding"] = encoding
+            break
+    if cfg["result_encoding"]:
+        try:
+            parse_compression_level(
+                compression_level_setting(cfg, cfg["result_encoding"]),
+                cfg["result_encoding"],
+            )
+        except ValueError as error:
+            logger.error("Invalid result compression configuration: %s", error)
+            sys.exit(10)
+    logger.info(
+        "Island capabilities: %s", ", ".join(cfg["island_capabilities"]) or "legacy"
+    )
+
+
+def reload_settings(cfg, config_file):
+    """
+    Re-read the reloadable settings of config_file into cfg. Return the log
+    retention and the changed settings. Raise OSError or yaml.YAMLError when
+    the file cannot be read, ValueError for invalid settings, cfg is then left
+    unchanged.
+    """
+    with open(config_file, "r", encoding="utf-8") as handle:
+        new_config = yaml.safe_load(handle) or {}
+
+    parse_scanparallel(new_config.get("scanparallel"))
+    parse_scanparallel_bounds(
+        new_config.get("scanparallel_min"), new_config.get("scanparallel_max")
+    )
+    is_scanhours_active(new_config.get("scanhours"))
+    keep_days = parse_logrotation(new_config.get("logrotation"))
+
+    changed = []
+    for key in RELOADABLE_SETTINGS:
+        if new_config.get(key) != cfg.get(key):
+            changed.append(f"{key}={new_config.get(key)}")
+        if new_config.get(key) is None:
+            cfg.pop(key, None)
+        else:
+            cfg[key] = new_config[key]
+    return keep_days, changed
+
+
 def setup(cfg, cmd_args):
     """
     Agent setup before execution
@@ -114,6 +271,13 @@ def setup(cfg, cmd_args):
         except ValueError as error:
             logger.error("Invalid scanparallel: %s", error)
             sys.exit(7)
+    try:
+        scanparallel_bounds = parse_scanparallel_bounds(
+            cfg.get("scanparallel_min"), cfg.get("scanparallel_max")
+        )
+    except ValueError as error:
+        logger.error("Invalid scanparallel: %s", error)
+        sys.exit(7)
     if cfg.get("logrotation") is not None:
         try:
             cfg["logrotation"] = parse_logrotation(cfg.get("logrotation"))
@@ -121,6 +285,94 @@ def setup(cfg, cmd_args):
             logger.error("Invalid logrotation: %s", error)
             sys.exit(8)
 
+    try:
+        http_pool_size = parse_http_pool_size(
+            cfg.get("http_pool_size"),
+            max_scanparallel(
+                parse_scanparallel(cfg.get("scanparallel")), scanparallel_bounds
+            ),
+        )
+        http_keepalive = parse_http_keepalive(cfg.get("http_keepalive"))
+    except ValueError as error:
+        logger.error("Invalid HTTP session configuration: %s", error)
+        sys.exit(9)
+    try:
+        # The shared level is checked once the encoding is known, see
+        # negotiate_capabilities, unless a single encoding is possible.
+        encodings = _compression_encodings(cfg)
+        for encoding in encodings:
+            parse_compression_level(
+                cfg.get(f"result_compression_level_{encoding}"), encoding
+            )
+        if len(encodings) == 1:
+            parse_compression_level(
+                compression_level_setting(cfg, encodings[0]), encodings[0]
+            )
+        parse_compression_threshold(cfg.get("result_compression_threshold"))
+    except ValueError as error:
+        logger.error("Invalid result compression configuration: %s", error)
+        sys.exit(10)
+    try:
+        parse_result_streaming(cfg.get("result_streaming"))
+        parse_result_batch_hosts(cfg.get("result_batch_hosts"))
+        parse_result_batch_seconds(cfg.get("result_batch_seconds"))
+    except ValueError as error:
+        logger.error("Invalid result streaming configuration: %s", error)
+        sys.exit(11)
+    try:
+        parse_prefetch_depth(cfg.get("prefetch_depth"))
+        parse_prefetch_lease(cfg.get("prefetch_lease"))
+    except ValueError as error:
+        logger.error("Invalid prefetch configuration: %s", error)
+        sys.exit(12)
+    try:
+        parse_nse_cache_max_mb(cfg.get("nse_cache_max_mb"))
+    except ValueError as error:
+        logger.error("Invalid NSE cache configuration: %s", error)
+        sys.exit(13)
+    try:
+        parse_nmap_output_rate(cfg.get("nmap_output_rate"))
+        parse_nmap_trace(cfg.get("nmap_trace"))
+    except ValueError as error:
+        logger.error("Invalid Nmap output configuration: %s", error)
+        sys.exit(14)
+    try:
+        parse_result_workers(cfg.get("result_workers"))
+    except ValueError as error:
+        logger.error("Invalid result_workers configuration: %s", error)
+        sys.exit(16)
+    try:
+        parse_shard_hosts(cfg.get("shard_hosts"))
+    except ValueError as error:
+        logger.error("Invalid shard_hosts configuration: %s", error)
+        sys.exit(17)
+    try:
+        parse_max_rate(cfg.get("max_rate"))
+    except ValueError as error:
+        logger.error("Invalid max_rate configuration: %s", error)
+        sys.exit(18)
+    try:
+        parse_scan_checkpoint(cfg.get("scan_checkpoint"))
+    except ValueError as error:
+        logger.error("Invalid scan_checkpoint configuration: %s", error)
+        sys.exit(19)
+    try:
+        ext_ip_quorum = parse_ext_ip_quorum(cfg.get("ext_ip_quorum"))
+        ext_ip_cache_ttl = parse_ext_ip_cache_ttl(cfg.get("ext_ip_cache_ttl"))
+    except ValueError as error:
+        logger.error("Invalid external IP discovery configuration: %s", error)
+        sys.exit(20)
+    try:
+        parse_metrics_listen(cfg.get("metrics_listen"))
+    except ValueError as error:
+        logger.error("Invalid metrics_listen configuration: %s", error)
+        sys.exit(21)
+    try:
+        parse_job_trace(cfg.get("job_trace"))
+    except ValueError as error:
+        logger.error("Invalid job_trace configuration: %s", error)
+        sys.exit(22)
+
     if flag_setupchanged:
         logger.debug("Setup changed, saving it")
         save_config(cfg)
@@ -147,7 +399,11 @@ def setup(cfg, cmd_args):
         logger.debug("Static external IP set: %s", cfg.get("ext_ip"))
         cfg["curr_ip"] = cfg.get("ext_ip")
     else:
-        cfg["curr_ip"] = get_ext_ip()
+        cfg["curr_ip"] = get_ext_ip(
+            quorum=ext_ip_quorum,
+            cache_path=os.path.join(cfg.get("THIS_DIR"), "ext_ip_cache.json"),
+            cache_ttl=ext_ip_cache_ttl,
+        )
         if not cfg.get("curr_ip"):
             logger.error("External IP could not be determined")
             sys.exit(2)
@@ -172,19 +428,22 @@ def setup(cfg, cmd_args):
             cfg.get("uid"), cfg.get("curr_ip")
         )  # Create BOT report infoblock
         cfg["APIPATH"] = APIPath(cfg.get("island"))  # Setup PATHs
+        configure_session(pool_size=http_pool_size, keepalive=http_keepalive)
         logger.info("Check if Island reachable")
         logger.debug("Validation address %s", cfg.get("APIPATH").register)
 
         bot_report = cfg.get("botinfo")
         bot_report["AGENT_KEY"] = cfg.get("agent_key")
+        beacon = bot_report | {"AGENT_CAPABILITIES": agent_capabilities(cfg)}
         ready_msg = robust_request(
-            cfg.get("APIPATH").register, method="POST", data=bot_report, max_retries=3
+            cfg.get("APIPATH").register, method="POST", data=beacon, max_retries=3
         )
         if ready_msg:
             ready_msg = Dict2obj(ready_msg)  # convert to obj.
             if not ready_msg.message == "ready":
                 logger.error("Island is not ready or bad host configured")
                 sys.exit(5)
+            negotiate_capabilities(cfg, ready_msg)
         else:
             logger.error("Island is not ready or bad host configured")
             sys.exit(5)
@@ -0,0 +1,221 @@
+"""
+Target sharding: split large scan jobs across parallel Nmap processes.
+"""
+
+import ipaddress
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.xmlstream import merge_nmap_reports
+
+logger = logging.getLogger("Plum_Agent")
+
+# Upper bound of shards per job, larger jobs get larger shards.
+MAX_SHARDS = 64
+
+
+def parse_shard_hosts(value, default=0):
+    """
+    Parse the number of target addresses per Nmap process, 0 disables sharding.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        raise ValueError("shard_hosts must be an integer >= 0")
+
+    if isinstance(value, str) and not value.strip():
+        return default
+
+    try:
+        shard_hosts = int(value)
+    except (TypeError, ValueError) as error:
+        raise ValueError("shard_hosts must be an integer >= 0") from error
+
+    if shard_hosts < 0:
+        raise ValueError("shard_hosts must be an integer >= 0")
+
+    return shard_hosts
+
+
+def _target_pieces(token, size):
+    """
+    Yield (target, address count) pieces of at most size addresses when the
+    target is an address or a CIDR block. Host names and Nmap range
+    expressions are kept whole and count as one address.
+    """
+    try:
+        network = ipaddress.ip_network(token, strict=False)
+    except ValueError:
+        yield token, 1
+        return
+
+    if network.num_addresses <= size:
+        yield token, network.num_addresses
+        return
+
+    new_prefix = network.max_prefixlen - int(math.log2(size))
+    for subnet in network.subnets(new_prefix=new_prefix):
+        yield str(subnet), subnet.num_addresses
+
+
+def split_targets(targets, shard_hosts, max_shards=MAX_SHARDS):
+    """
+    Split comma-separated Nmap targets into shards of about shard_hosts
+    addresses, keeping the target order. Return the shard target strings.
+    """
+    tokens = [token.strip() for token in targets.split(",") if token.strip()]
+    if shard_hosts <= 0 or not tokens:
+        return [targets]
+
+    total = 0
+    for token in tokens:
+        try:
+            total += ipaddress.ip_network(token, strict=False).num_addresses
+        except ValueError:
+            total += 1
+    size = max(shard_hosts, math.ceil(total / max_shards))
+
+    shards = []
+    current = []
+    current_hosts = 0
+    for token in tokens:
+        for piece, hosts in _target_pieces(token, size):
+            if current and current_hosts + hosts > size:
+                shards.append(",".join(current))
+                current = []
+                current_hosts = 0
+            current.append(piece)
+            current_hosts += hosts
+    shards.append(",".join(current))
+    return shards
+
+
+class ScanSlots:
+    """
+    Count scan jobs and the extra Nmap processes of sharded jobs against
+    the scanparallel limit.
+
+    Each job holds one slot. A sharded job borrows the slots left idle for
+    its other shards and gives them back as soon as its shard queue is empty.
+    """
+
+    def __init__(self, limit=1, wakeup=None):
+        self.limit = limit
+        self.jobs = 0
+        self.borrowed = 0
+        self.wakeup = wakeup
+        self._lock = threading.Lock()
+
+    def configure(self, limit):
+        """
+        Set the number of slots.
+        """
+        with self._lock:
+            self.limit = limit
+
+    def busy(self):
+        """
+        Return the number of slots in use.
+        """
+        with self._lock:
+            return self.jobs + self.borrowed
+
+    def job_started(self):
+        """
+        Take the slot of a starting job.
+        """
+        with self._lock:
+            self.jobs += 1
+
+    def job_finished(self):
+        """
+        Free the slot of a finished job.
+        """
+        with self._lock:
+            self.jobs = max(self.jobs - 1, 0)
+        self._wake()
+
+    def borrow(self, wanted):
+        """
+        Borrow up to wanted idle slots, return the number obtained.
+        """
+        with self._lock:
+            count = max(0, min(wanted, self.limit - self.jobs - self.borrowed))
+            self.borrowed += count
+            return count
+
+    def give_back(self, count=1):
+        """
+        Return borrowed slots.
+        """
+        with self._lock:
+            self.borrowed = max(self.borrowed - count, 0)
+        self._wake()
+
+    def _wake(self):
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+
+def run_shards(job_uid, slots, shard_runs):
+    """
+    Run the shard_runs() Nmap processes of a sharded job on its own slot and
+    on the idle slots it can borrow. Return the exit code of each shard, None
+    for shards not started after an interruption.
+    """
+    borrowed = slots.borrow(len(shard_runs) - 1)
+    logger.info(
+        "Job %s running %s shards on %s slots",
+        job_uid,
+        len(shard_runs),
+        borrowed + 1,
+    )
+    pending = iter(enumerate(shard_runs))
+    pending_lock = threading.Lock()
+    return_codes = [None] * len(shard_runs)
+    interrupted = threading.Event()
+
+    def work(borrowed_slot):
+        try:
+            while not interrupted.is_set():
+                with pending_lock:
+                    index, shard_run = next(pending, (None, None))
+                if index is None:
+                    return
+                return_code = shard_run()
+                return_codes[index] = return_code
+                if return_code < 0:
+                    interrupted.set()
+        finally:
+            if borrowed_slot:
+                slots.give_back()
+
+    with ThreadPoolExecutor(max_workers=max(borrowed, 1)) as shard_executor:
+        futures = [shard_executor.submit(work, True) for _ in range(borrowed)]
+        try:
+            work(False)
+        finally:
+            interrupted.set()
+            for future in futures:
+                future.result()
+    return return_codes
+
+
+def merge_shard_reports(job_uid, shards, output_xml, partial_xml=None):
+    """
+    Merge the partial report of a resumed job and the (targets, report path)
+    shard reports into the job report, then remove the shard reports.
+    """
+    reports = [path for _, path in shards if os.path.isfile(path)]
+    if not reports and not partial_xml:
+        return
+    for path in merge_nmap_reports(
+        ([partial_xml] if partial_xml else []) + reports,
+        output_xml,
+        unique=bool(partial_xml),
+    ):
+        logger.error("Job %s shard report %s is incomplete", job_uid, path)
+    for path in reports:
+        os.remove(path)
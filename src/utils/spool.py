@@ -0,0 +1,171 @@
+"""
+Crash-safe local spool of result uploads and its background uploader.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger("Plum_Agent")
+
+SPOOL_SUFFIX = ".result"
+SPOOL_BATCH = 16
+SPOOL_BACKOFF_START = 5
+SPOOL_BACKOFF_MAX = 300
+
+
+class ResultSpool:
+    """
+    Store one ready-to-send upload per file.
+
+    Each file holds a JSON metadata line followed by the request body bytes.
+    Files are written to a temporary name, synced, then renamed, so a crash
+    never leaves a truncated entry behind.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        for entry in os.listdir(self.directory):
+            if entry.endswith(".tmp"):
+                self.remove(os.path.join(self.directory, entry))
+
+    def put(self, meta, body):
+        """
+        Persist an upload, return its spool path.
+        """
+        name = f"{time.time_ns():020d}-{uuid.uuid4().hex}{SPOOL_SUFFIX}"
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as handle:
+            handle.write(json.dumps(meta).encode("utf-8") + b"\n")
+            handle.write(body)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp_path, path)
+        return path
+
+    def pending(self):
+        """
+        Return spooled upload paths, oldest first.
+        """
+        return [
+            os.path.join(self.directory, entry)
+            for entry in sorted(os.listdir(self.directory))
+            if entry.endswith(SPOOL_SUFFIX)
+        ]
+
+    @staticmethod
+    def load(path):
+        """
+        Return the metadata and body of a spooled upload.
+        """
+        with open(path, "rb") as handle:
+            meta = json.loads(handle.readline())
+            return meta, handle.read()
+
+    @staticmethod
+    def remove(path):
+        """
+        Forget a delivered upload.
+        """
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return len(self.pending())
+
+
+class SpoolUploader:
+    """
+    Drain a ResultSpool in a background thread with send(meta, body) -> bool.
+    Failed uploads stay spooled and are retried with an exponential backoff.
+    """
+
+    def __init__(self, spool, send):
+        self.spool = spool
+        self.send = send
+        self._wakeup = threading.Event()
+        self._idle = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """
+        Start the uploader thread.
+        """
+        pending = len(self.spool)
+        if pending:
+            logger.info("Result spool has %s pending uploads", pending)
+        self._thread.start()
+
+    def notify(self):
+        """
+        Wake the uploader after a new upload was spooled.
+        """
+        self._wakeup.set()
+
+    def drain(self, limit=None):
+        """
+        Upload spooled entries oldest first, return False on the first failure.
+        """
+        for path in self.spool.pending()[:limit]:
+            try:
+                meta, body = self.spool.load(path)
+            except (OSError, ValueError) as error:
+                logger.error("Dropping unreadable spooled result %s: %s", path, error)
+                self.spool.remove(path)
+                continue
+
+            if not self.send(meta, body):
+                return False
+            self.spool.remove(path)
+        return True
+
+    def _run(self):
+        backoff = SPOOL_BACKOFF_START
+        delay = 0
+        while not self._stop.is_set():
+            self._wakeup.wait(delay)
+            self._wakeup.clear()
+            if self._stop.is_set():
+                break
+
+            if self.drain(SPOOL_BATCH):
+                backoff = SPOOL_BACKOFF_START
+                delay = 0 if self.spool.pending() else None
+            else:
+                logger.warning("Result upload backoff %ss", backoff)
+                delay = backoff
+                backoff = min(backoff * 2, SPOOL_BACKOFF_MAX)
+
+            if delay is None:
+                with self._idle:
+                    self._idle.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """
+        Wait until every spooled upload was delivered, return True when empty.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self.spool.pending():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stop(self):
+        """
+        Stop the uploader thread, pending uploads stay spooled.
+        """
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread.is_alive():
+            self._thread.join()
@@ -0,0 +1,153 @@
+"""
+Phase timing of scan jobs, traced as one JSON line per job.
+"""
+
+import contextlib
+import json
+import logging
+import threading
+import time
+from utils.logrotation import DailyLogFileHandler
+
+TIMING_FIELD = "TIMING"
+
+# Job trace records, one JSON line per job, skip the agent log handlers.
+trace_logger = logging.getLogger("Plum_Agent.trace")
+trace_logger.setLevel(logging.INFO)
+trace_logger.propagate = False
+
+
+def parse_job_trace(value, default=False):
+    """
+    Parse the job trace switch.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+
+    value = str(value).strip().lower()
+    if not value:
+        return default
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise ValueError("job_trace must be a boolean")
+
+
+def append_span(record, phase, started, ended):
+    """
+    Add a span measured in wall clock seconds to a job trace record.
+    """
+    duration = round(ended - started, 3)
+    record["spans"].append(
+        {
+            "phase": phase,
+            "start": round(started - record["start"], 3),
+            "duration": duration,
+        }
+    )
+    record["phases"][phase] = round(record["phases"].get(phase, 0) + duration, 3)
+    record["elapsed"] = round(ended - record["start"], 3)
+
+
+def trace_span(trace, phase):
+    """
+    Return the timing context of a job phase, a no-op without a job trace.
+    """
+    if trace is None:
+        return contextlib.nullcontext()
+    return trace.span(phase)
+
+
+class JobTrace:
+    """
+    Timing spans of the phases of one scan job.
+
+    Each span keeps its phase, its start offset from the job start and its
+    duration in seconds. A phase may repeat: a sharded job has one nmap span
+    per shard, some of them running at the same time.
+    """
+
+    def __init__(self, job_uid):
+        self.job_uid = job_uid
+        self.started = time.time()
+        self._origin = time.monotonic()
+        self._spans = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, phase):
+        """
+        Time the body of the with statement as one span of phase.
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            ended = time.monotonic()
+            with self._lock:
+                self._spans.append((phase, started - self._origin, ended - started))
+
+    def summary(self):
+        """
+        Return the total seconds spent in each phase so far.
+        """
+        totals = {}
+        with self._lock:
+            for phase, _, duration in self._spans:
+                totals[phase] = totals.get(phase, 0) + duration
+        return {phase: round(total, 3) for phase, total in totals.items()}
+
+    def record(self, **fields):
+        """
+        Return the trace record of the job, extended with fields.
+        """
+        with self._lock:
+            spans = sorted(self._spans, key=lambda span: span[1])
+        return {
+            "job_uid": self.job_uid,
+            "start": round(self.started, 3),
+            "elapsed": round(time.monotonic() - self._origin, 3),
+            "phases": self.summary(),
+            "spans": [
+                {
+                    "phase": phase,
+                    "start": round(offset, 3),
+                    "duration": round(duration, 3),
+                }
+                for phase, offset, duration in spans
+            ],
+        } | fields
+
+
+class JobTraceLog:
+    """
+    Append job trace records to the daily trace-*.jsonl files of log_dir.
+    """
+
+    def __init__(self, log_dir, keep_days):
+        self.handler = DailyLogFileHandler(
+            log_dir, keep_days=keep_days, prefix="trace", suffix=".jsonl"
+        )
+        trace_logger.addHandler(self.handler)
+
+    def write(self, record):
+        """
+        Append one job trace record.
+        """
+        trace_logger.info("%s", json.dumps(record))
+
+    def set_keep_days(self, keep_days):
+        """
+        Apply a new retention to the trace files.
+        """
+        self.handler.set_keep_days(keep_days)
+
+    def close(self):
+        """
+        Close the trace file.
+        """
+        trace_logger.removeHandler(self.handler)
+        self.handler.close()
@@ -0,0 +1,175 @@
+"""
+Incremental Nmap XML report conversion.
+
+Hosts are converted one <host> element at a time with iterparse and freed right
+after conversion, so memory does not grow with the report size. Each host goes
+through the nmap2json converter, so records are identical to nmap_file_to_json.
+The same conversion can follow a report that Nmap is still writing.
+"""
+
+import xml.etree.ElementTree as ET
+
+
+def convert_host_element(host, wipe_notopen=False, wipe_deadhost=False):
+    """
+    Convert a single <host> element, return a list of zero or one host record.
+    """
+    # Imported on first use, setup and --help never convert a report.
+    from nmap2json.nmap2json import (  # pylint: disable=import-outside-toplevel
+        nmap_to_json,
+    )
+
+    wrapper = ET.Element("nmaprun")
+    wrapper.append(host)
+    return nmap_to_json(ET.ElementTree(wrapper), wipe_notopen, wipe_deadhost)
+
+
+class _TopLevelHosts:
+    """
+    Convert <host> elements as soon as they are complete and free every
+    top-level element of the report once it has been processed.
+    """
+
+    def __init__(self, wipe_notopen=False, wipe_deadhost=False):
+        self.wipe_notopen = wipe_notopen
+        self.wipe_deadhost = wipe_deadhost
+        self.root = None
+        self.depth = 0
+
+    def process(self, events):
+        """
+        Consume (event, element) pairs and yield converted host records.
+        """
+        for event, element in events:
+            if event == "start":
+                if self.root is None:
+                    self.root = element
+                self.depth += 1
+                continue
+
+            self.depth -= 1
+            if self.depth != 1:
+                continue
+
+            # Top level element complete, detach it from the root to free it.
+            self.root.remove(element)
+            if element.tag == "host":
+                yield from convert_host_element(
+                    element, self.wipe_notopen, self.wipe_deadhost
+                )
+            element.clear()
+
+
+def iter_nmap_hosts(xml_file, wipe_notopen=False, wipe_deadhost=False):
+    """
+    Yield converted host records from an Nmap XML report path or file object.
+    """
+    hosts = _TopLevelHosts(wipe_notopen, wipe_deadhost)
+    yield from hosts.process(ET.iterparse(xml_file, events=("start", "end")))
+
+
+class NmapXmlTail:
+    """
+    Follow an Nmap XML report while Nmap is still writing it.
+    Each poll returns the host records completed since the previous poll.
+    """
+
+    def __init__(self, path, wipe_notopen=False, wipe_deadhost=False):
+        self.path = path
+        self._handle = None
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._hosts = _TopLevelHosts(wipe_notopen, wipe_deadhost)
+
+    def poll(self, chunk_size=65536):
+        """
+        Read newly written bytes and return the newly completed host records.
+        """
+        if self._handle is None:
+            try:
+                # The handle follows the report across polls, close() releases it.
+                self._handle = open(  # pylint: disable=consider-using-with
+                    self.path, "rb"
+                )
+            except FileNotFoundError:
+                return []
+
+        records = []
+        for chunk in iter(lambda: self._handle.read(chunk_size), b""):
+            self._parser.feed(chunk)
+            records.extend(self._hosts.process(self._parser.read_events()))
+        return records
+
+    def close(self):
+        """
+        Release the report file handle.
+        """
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+def nmap_stream_to_json(xml_file, wipe_notopen=False, wipe_deadhost=False):
+    """
+    Streaming drop-in for nmap2json.nmap_file_to_json.
+    """
+    return list(iter_nmap_hosts(xml_file, wipe_notopen, wipe_deadhost))
+
+
+def merge_nmap_reports(paths, output_path, unique=False):
+    """
+    Write the <host> elements of several Nmap XML reports into one report.
+    The root attributes are taken from the first readable report. With
+    unique, a host whose first address was already written is skipped. Return
+    the paths that could not be read completely, their complete hosts are kept.
+    """
+    incomplete = []
+    written = set()
+    root_written = False
+    with open(output_path, "wb") as output:
+        output.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        for path in paths:
+            root = None
+            depth = 0
+            try:
+                for event, element in ET.iterparse(path, events=("start", "end")):
+                    if event == "start":
+                        if root is None:
+                            root = element
+                            if not root_written:
+                                output.write(_start_tag(element))
+                                root_written = True
+                        depth += 1
+                        continue
+
+                    depth -= 1
+                    if depth != 1:
+                        continue
+                    root.remove(element)
+                    address = _host_address(element)
+                    if element.tag == "host" and address not in written:
+                        if unique and address is not None:
+                            written.add(address)
+                        element.tail = None
+                        output.write(ET.tostring(element) + b"\n")
+                    element.clear()
+            except (ET.ParseError, OSError):
+                incomplete.append(path)
+        if not root_written:
+            output.write(b"<nmaprun>\n")
+        output.write(b"</nmaprun>\n")
+    return incomplete
+
+
+def _host_address(host):
+    address = host.find("address")
+    return None if address is None else address.get("addr")
+
+
+def _start_tag(element):
+    # saxutils pulls in urllib.request, only needed once per merge.
+    from xml.sax.saxutils import quoteattr  # pylint: disable=import-outside-toplevel
+
+    attributes = "".join(
+        f" {name}={quoteattr(value)}" for name, value in element.attrib.items()
+    )
+    return f"<{element.tag}{attributes}>\n".encode("utf-8")
@@ -0,0 +1,157 @@
+"""Tests for the automatic scan parallelism controller."""
+
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils import scanparallel, tracing  # pylint: disable=wrong-import-position
+
+
+class HostLoad:
+    """Stand-in for the load average and /proc/stat readers."""
+
+    def __init__(self):
+        self.load = 0.2
+        self.busy = 0
+        self.total = 0
+        self.cpu = 0.2
+
+    def load_per_cpu(self):
+        return self.load
+
+    def cpu_times(self):
+        self.busy += int(self.cpu * 100)
+        self.total += 100
+        return self.busy, self.total
+
+
+class AdaptiveParallelismTests(unittest.TestCase):
+    """Verify settings and the AIMD policy."""
+
+    def setUp(self):
+        self.host = HostLoad()
+        self.controller = scanparallel.AdaptiveParallelism(
+            1,
+            8,
+            interval=60,
+            load_per_cpu=self.host.load_per_cpu,
+            cpu_times=self.host.cpu_times,
+        )
+        self.now = 0
+        self.hosts = 0
+        self.controller.update(0, 0, now=self.now)
+
+    def step(self, busy, hosts_per_minute):
+        """
+        Advance one interval and return the new limit.
+        """
+        self.now += 60
+        self.hosts += hosts_per_minute
+        return self.controller.update(busy, self.hosts, now=self.now)
+
+    def test_settings_parsing(self):
+        """auto is accepted next to integers, bounds must be ordered."""
+        self.assertEqual(scanparallel.parse_scanparallel(" Auto "), "auto")
+        self.assertEqual(scanparallel.parse_scanparallel("3"), 3)
+        self.assertEqual(scanparallel.parse_scanparallel_bounds("2", 6), (2, 6))
+        self.assertEqual(
+            scanparallel.parse_scanparallel_bounds(None, None),
+            (1, os.cpu_count() or 1),
+        )
+        self.assertEqual(scanparallel.max_scanparallel("auto", (2, 6)), 6)
+        self.assertEqual(scanparallel.max_scanparallel(3, (2, 6)), 3)
+        for minimum, maximum in ((0, 4), (4, 2), ("x", 4), (True, 4)):
+            with self.subTest(minimum=minimum, maximum=maximum):
+                with self.assertRaises(ValueError):
+                    scanparallel.parse_scanparallel_bounds(minimum, maximum)
+        with self.assertRaises(ValueError):
+            scanparallel.parse_scanparallel("many")
+
+    def test_additive_increase_while_slots_are_busy(self):
+        """The limit grows by one per interval up to the maximum."""
+        with self.assertLogs(scanparallel.logger, level="INFO") as captured:
+            limits = [self.step(busy, 100 * busy) for busy in (1, 2, 3)]
+        self.assertEqual(limits, [2, 3, 4])
+        self.assertIn("scanparallel auto 1 -> 2, all slots busy", captured.output[0])
+        self.assertEqual(self.step(2, 200), 4)
+        self.controller.limit = 8
+        self.assertEqual(self.step(8, 800), 8)
+
+    def test_no_change_before_the_interval(self):
+        """Updates within the interval keep the limit."""
+        self.assertEqual(self.controller.update(1, 10, now=30), 1)
+
+    def test_multiplicative_decrease_on_overload(self):
+        """High load or CPU use halve the limit, not below the minimum."""
+        self.controller.limit = 6
+        self.host.load = 1.5
+        with self.assertLogs(scanparallel.logger, level="INFO") as captured:
+            self.assertEqual(self.step(6, 600), 3)
+        self.assertIn("host overloaded (load 1.50/cpu", captured.output[0])
+        self.host.load = 0.2
+        self.host.cpu = 0.95
+        with self.assertLogs(scanparallel.logger, level="INFO"):
+            self.assertEqual(self.step(3, 300), 1)
+            self.assertEqual(self.step(1, 100), 1)
+
+    def test_increase_undone_when_host_rate_falls(self):
+        """A lower host rate after an increase means the link is saturated."""
+        self.controller.limit = 4
+        with self.assertLogs(scanparallel.logger, level="INFO") as captured:
+            self.assertEqual(self.step(4, 400), 5)
+            self.assertEqual(self.step(5, 200), 2)
+        self.assertIn("host rate fell", captured.output[1])
+
+    def test_rate_drop_without_work_is_not_saturation(self):
+        """Fewer busy slots lower the rate without reducing the limit."""
+        self.controller.limit = 4
+        with self.assertLogs(scanparallel.logger, level="INFO"):
+            self.assertEqual(self.step(4, 400), 5)
+        self.assertEqual(self.step(1, 50), 5)
+
+
+class HostsReportedTests(unittest.TestCase):
+    """Verify the host count read by the scheduler while scans start."""
+
+    def test_count_while_scans_start_and_finish(self):
+        """Nmap processes starting meanwhile never break the count."""
+        nmap_output = mock.Mock()
+        nmap_output.progress.return_value = {"hosts_reported": 0}
+        stop = threading.Event()
+
+        def start_scans():
+            trace = tracing.JobTrace("job")
+            index = 0
+            while not stop.is_set():
+                index += 1
+                agent._run_nmap(  # pylint: disable=protected-access
+                    "job", f"job/{index}", lambda **_kwargs: [], trace
+                )
+
+        with mock.patch.object(
+            agent, "_nmap_output_processor", return_value=nmap_output
+        ), mock.patch.object(agent, "run_elf", return_value=0):
+            # Switch threads often to interleave them with the iteration.
+            self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+            sys.setswitchinterval(1e-6)
+            threads = [threading.Thread(target=start_scans) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            try:
+                for _ in range(20000):
+                    agent.RUNNING_OUTPUTS.hosts_reported()
+            finally:
+                stop.set()
+                for thread in threads:
+                    thread.join()
+        self.assertEqual(agent.RUNNING_OUTPUTS.progress(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
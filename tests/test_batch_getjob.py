@@ -0,0 +1,79 @@
+"""Tests for batch job leasing."""
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils.setup import APIPath  # pylint: disable=wrong-import-position
+
+
+def job(index):
+    """Return a minimal job message."""
+    return {"job": f"192.0.2.{index}", "job_uid": f"uid-{index}"}
+
+
+class BatchGetjobTests(unittest.TestCase):
+    """Verify batch requests and the single-job fallback."""
+
+    def _fetch(self, capabilities, response, count):
+        config = {
+            "island_capabilities": capabilities,
+            "APIPATH": APIPath("https://island.test"),
+            "botinfo": {"UID": "agent"},
+        }
+        with mock.patch.dict(agent.CONFIG, config, clear=False), mock.patch.object(
+            agent, "_nse_store"
+        ), mock.patch.object(
+            agent, "_nse_cache_report", return_value={"NSE_HASHES": {}}
+        ) as report_mock, mock.patch.object(
+            agent, "robust_request", return_value=response
+        ) as request_mock:
+            jobs = agent.fetch_jobs(count)
+        report_mock.assert_called_once()
+        request_mock.assert_called_once()
+        return jobs, request_mock.call_args.kwargs["data"]
+
+    def test_batch_request_returns_several_jobs(self):
+        """Islands with batch_getjob lease up to the free slot count."""
+        response = {"messages": [job(1), job(2), {"job": ""}]}
+        jobs, request = self._fetch(["batch_getjob"], response, 4)
+        self.assertEqual(request["JOB_COUNT"], 4)
+        self.assertEqual(jobs, [job(1), job(2)])
+
+    def test_batch_responses_are_capped_to_count(self):
+        """Extra jobs beyond the requested count are ignored."""
+        response = {"messages": [job(1), job(2), job(3)]}
+        jobs, _ = self._fetch(["batch_getjob"], response, 2)
+        self.assertEqual(jobs, [job(1), job(2)])
+
+    def test_legacy_island_receives_single_job_request(self):
+        """Without the capability the request and response stay single-job."""
+        jobs, request = self._fetch([], {"message": job(1)}, 4)
+        self.assertNotIn("JOB_COUNT", request)
+        self.assertEqual(jobs, [job(1)])
+
+    def test_batch_island_answering_single_message(self):
+        """A single message answer is accepted from batch islands."""
+        jobs, _ = self._fetch(["batch_getjob"], {"message": job(3)}, 4)
+        self.assertEqual(jobs, [job(3)])
+
+    def test_empty_queue_and_invalid_responses(self):
+        """Empty queues return no jobs and malformed answers raise."""
+        with self.assertLogs(agent.logger, level="INFO"):
+            jobs, _ = self._fetch([], {"message": {"job": ""}}, 1)
+        self.assertEqual(jobs, [])
+        for response in (None, {}, {"message": ["x"]}):
+            with self.subTest(response=response):
+                with self.assertRaises(RuntimeError):
+                    self._fetch([], response, 1)
+        with self.assertRaises(RuntimeError):
+            self._fetch(["batch_getjob"], {"messages": "x"}, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,245 @@
+"""Tests for the checkpoint and resume of interrupted scan jobs."""
+
+import contextlib
+import ipaddress
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils import checkpoint, delivery  # pylint: disable=wrong-import-position
+from utils.netutils import WIRE_FORMAT_JSON  # pylint: disable=wrong-import-position
+from utils.setup import APIPath  # pylint: disable=wrong-import-position
+
+RANGE_UID = "f5813ec7-b36b-4fe7-b662-cca3d281725c"
+HOST_XML = (
+    '<host><status state="up"/><address addr="{addr}" addrtype="ipv4"/>'
+    '<hostnames><hostname name="{name}" type="user"/></hostnames>'
+    '<ports><port protocol="tcp" portid="443"><state state="open"/>'
+    "</port></ports></host>\n"
+)
+
+
+def write_report(path, addresses, complete=True, name=""):
+    """
+    Write an Nmap XML report with one open port per address.
+    """
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write('<?xml version="1.0"?>\n<nmaprun scanner="nmap" args="x">\n')
+        for addr in addresses:
+            handle.write(HOST_XML.format(addr=addr, name=name))
+        if complete:
+            handle.write("</nmaprun>\n")
+        else:
+            handle.write("<host><status")
+
+
+class RemainingTargetsTests(unittest.TestCase):
+    """Verify settings parsing and the targets left to scan."""
+
+    def test_settings_parsing(self):
+        """Checkpoints are disabled by default."""
+        self.assertFalse(checkpoint.parse_scan_checkpoint(None))
+        self.assertTrue(checkpoint.parse_scan_checkpoint("yes"))
+        self.assertFalse(checkpoint.parse_scan_checkpoint(False))
+        with self.assertRaises(ValueError):
+            checkpoint.parse_scan_checkpoint("sometimes")
+
+    def test_scanned_addresses_removed_from_networks(self):
+        """CIDR blocks shrink to the subnets Nmap has not reported."""
+        scanned = {f"192.0.2.{octet}" for octet in range(0, 64)} | {"192.0.2.70"}
+        self.assertEqual(
+            checkpoint.remaining_targets("192.0.2.0/24,198.51.100.7", scanned, set()),
+            "192.0.2.64/30,192.0.2.68/31,192.0.2.71,192.0.2.72/29,"
+            "192.0.2.80/28,192.0.2.96/27,192.0.2.128/25,198.51.100.7",
+        )
+        self.assertEqual(
+            checkpoint.remaining_targets(
+                "192.0.2.1,192.0.2.0/31", {"192.0.2.1"}, set()
+            ),
+            "192.0.2.0",
+        )
+
+    def test_names_and_ranges(self):
+        """Reported names are dropped, Nmap ranges and IPv6 are handled."""
+        self.assertEqual(
+            checkpoint.remaining_targets(
+                "Scanme.test,other.test,10.0.0.1-20,2001:db8::/127",
+                {"10.0.0.1", "2001:db8::1"},
+                {"scanme.test"},
+            ),
+            "other.test,10.0.0.1-20,2001:db8::",
+        )
+
+    def test_truncated_report_is_read(self):
+        """Only complete hosts of an interrupted report count as scanned."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, "report.xml")
+        write_report(path, ["192.0.2.1", "192.0.2.2"], complete=False, name="a.test")
+        self.assertEqual(
+            checkpoint.scanned_targets(path), ({"192.0.2.1", "192.0.2.2"}, {"a.test"})
+        )
+
+    def test_store_keeps_messages_until_cleared(self):
+        """Saved job messages are listed until the job ends."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        store = checkpoint.JobCheckpoints(tmp_dir)
+        store.save(RANGE_UID, {"job_uid": RANGE_UID})
+        with open(
+            os.path.join(tmp_dir, "broken.json"), "w", encoding="utf-8"
+        ) as handle:
+            handle.write("{")
+        with self.assertLogs(checkpoint.logger, level="ERROR"):
+            self.assertEqual(store.jobs(), [{"job_uid": RANGE_UID}])
+        store.clear(RANGE_UID)
+        self.assertEqual(os.listdir(tmp_dir), [])
+
+
+class ResumeScanTests(unittest.TestCase):
+    """Verify an interrupted job is resumed on the unscanned targets."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.config = {
+            "nmap_path": "nmap",
+            "THIS_DIR": self.tmp_dir,
+            "wire_format": WIRE_FORMAT_JSON,
+            "APIPATH": APIPath("https://island.test"),
+        }
+        self.store = checkpoint.JobCheckpoints(os.path.join(self.tmp_dir, "state"))
+        self.job = {"job_uid": RANGE_UID, "job": "192.0.2.0/29", "nmap_ports": [443]}
+
+    def _run(self, fake_run_elf, job_message):
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.dict(agent.CONFIG, self.config))
+            stack.enter_context(mock.patch.object(agent, "JOB_CHECKPOINTS", self.store))
+            stack.enter_context(
+                mock.patch.object(agent, "run_elf", side_effect=fake_run_elf)
+            )
+            request_mock = stack.enter_context(
+                mock.patch.object(
+                    delivery, "robust_request", return_value={"message": "ok"}
+                )
+            )
+            stack.enter_context(self.assertLogs(agent.logger, level="INFO"))
+            return agent.run_scan_job(job_message), request_mock
+
+    def test_interrupted_job_resumes_unscanned_targets(self):
+        """The resumed job scans the rest and sends every host once."""
+
+        def interrupted(_executable, arguments, **_kwargs):
+            output_xml = arguments[arguments.index("-oX") + 1]
+            write_report(output_xml, ["192.0.2.0", "192.0.2.1"], complete=False)
+            return -15
+
+        delivered, request_mock = self._run(interrupted, self.job)
+        self.assertFalse(delivered)
+        request_mock.assert_not_called()
+        self.assertEqual(self.store.jobs(), [self.job])
+
+        scanned_targets = []
+
+        def resumed(_executable, arguments, **_kwargs):
+            output_xml = arguments[arguments.index("-oX") + 1]
+            targets = arguments[arguments.index("--no-stylesheet") + 1 :]
+            scanned_targets.extend(targets)
+            addresses = [
+                str(address)
+                for target in targets
+                for address in ipaddress.ip_network(target)
+            ]
+            write_report(output_xml, ["192.0.2.1"] + addresses)
+            return 0
+
+        delivered, request_mock = self._run(resumed, self.store.jobs()[0])
+        self.assertTrue(delivered)
+        self.assertEqual(scanned_targets, ["192.0.2.2/31", "192.0.2.4/30"])
+        payload = json.loads(request_mock.call_args.kwargs["body"])
+        self.assertEqual(
+            [host["addr"] for host in payload["RESULT"]],
+            [f"192.0.2.{octet}" for octet in range(8)],
+        )
+        self.assertEqual(self.store.jobs(), [])
+        self.assertEqual(os.listdir(self.tmp_dir), ["state"])
+        self.assertEqual(os.listdir(self.store.directory), [])
+
+    def test_fully_scanned_job_is_sent_without_nmap(self):
+        """A job interrupted after its last host only sends its results."""
+        write_report(
+            os.path.join(self.tmp_dir, f"{RANGE_UID}.xml"),
+            [f"192.0.2.{octet}" for octet in range(8)],
+            complete=False,
+        )
+        self.store.save(RANGE_UID, self.job)
+        run_elf = mock.Mock()
+        delivered, request_mock = self._run(run_elf, self.job)
+        self.assertTrue(delivered)
+        run_elf.assert_not_called()
+        payload = json.loads(request_mock.call_args.kwargs["body"])
+        self.assertEqual(len(payload["RESULT"]), 8)
+
+    def test_streamed_hosts_are_not_sent_again(self):
+        """Batches streamed before the interruption are skipped on resume."""
+        self.config["island_capabilities"] = ["partial_results"]
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.dict(agent.CONFIG, self.config))
+            stack.enter_context(mock.patch.object(agent, "JOB_CHECKPOINTS", self.store))
+            stack.enter_context(
+                mock.patch.object(
+                    delivery, "robust_request", return_value={"message": "ok"}
+                )
+            )
+            stack.enter_context(self.assertLogs(agent.logger, level="INFO"))
+            streamer = agent._start_result_streamer(  # pylint: disable=W0212
+                RANGE_UID, os.path.join(self.tmp_dir, f"{RANGE_UID}.xml")
+            )
+            self.assertTrue(streamer.send_batch([{"addr": "192.0.2.0"}], 0))
+            streamer.finish()
+        self.assertEqual(self.store.streamed(RANGE_UID), (1, 1))
+
+        write_report(
+            os.path.join(self.tmp_dir, f"{RANGE_UID}.xml"),
+            [f"192.0.2.{octet}" for octet in range(8)],
+            complete=False,
+        )
+        self.store.save(RANGE_UID, self.job)
+        delivered, request_mock = self._run(mock.Mock(), self.job)
+        self.assertTrue(delivered)
+        payload = json.loads(request_mock.call_args.kwargs["body"])
+        self.assertEqual(
+            [host["addr"] for host in payload["RESULT"]],
+            [f"192.0.2.{octet}" for octet in range(1, 8)],
+        )
+        self.assertEqual((payload["BATCH"], payload["JOB_COMPLETE"]), (1, True))
+        self.assertEqual(self.store.streamed(RANGE_UID), (0, 0))
+
+    def test_resumed_jobs_run_before_new_work(self):
+        """A one-time run resumes an interrupted job instead of fetching."""
+        self.store.save(RANGE_UID, self.job)
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.object(agent, "JOB_CHECKPOINTS", self.store))
+            stack.enter_context(
+                mock.patch.object(agent, "_scanhours_enabled", return_value=True)
+            )
+            run_scan_job = stack.enter_context(
+                mock.patch.object(agent, "run_scan_job", return_value=True)
+            )
+            fetch_job = stack.enter_context(mock.patch.object(agent, "fetch_job"))
+            stack.enter_context(self.assertLogs(agent.logger, level="INFO"))
+            agent._run_once(1)  # pylint: disable=protected-access
+        run_scan_job.assert_called_once_with(self.job)
+        fetch_job.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+"""Tests for configuration reload and drain mode of the daemon."""
+
+import contextlib
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import yaml
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils import controlsignals  # pylint: disable=wrong-import-position
+from utils.sharding import ScanSlots  # pylint: disable=wrong-import-position
+
+RANGE_UID = "f5813ec7-b36b-4fe7-b662-cca3d281725c"
+
+
+class ControlSignalTests(unittest.TestCase):
+    """Verify SIGHUP reloads and SIGUSR1 drains the scheduler."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        os.makedirs(os.path.join(self.tmp_dir, "config"))
+        self.addCleanup(agent.RELOAD_REQUESTED.clear)
+        self.addCleanup(agent.DRAIN_REQUESTED.clear)
+
+    def write_config(self, **settings):
+        """
+        Write config/config.yaml with settings.
+        """
+        path = os.path.join(self.tmp_dir, "config", "config.yaml")
+        with open(path, "w", encoding="utf-8") as handle:
+            yaml.safe_dump(settings, handle)
+
+    def test_signals_set_control_requests(self):
+        """SIGHUP requests a reload, SIGUSR1 a drain."""
+        for signum in (signal.SIGHUP, signal.SIGUSR1):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        agent._install_control_signals()  # pylint: disable=protected-access
+        os.kill(os.getpid(), signal.SIGHUP)
+        self.assertTrue(agent.RELOAD_REQUESTED.wait(5))
+        self.assertFalse(agent.DRAIN_REQUESTED.is_set())
+        os.kill(os.getpid(), signal.SIGUSR1)
+        self.assertTrue(agent.DRAIN_REQUESTED.wait(5))
+
+    def test_handler_does_not_take_event_locks(self):
+        """A signal landing while its thread holds an event lock cannot block."""
+        for signum in (signal.SIGHUP, signal.SIGUSR1):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        agent._install_control_signals()  # pylint: disable=protected-access
+        # pylint: disable=protected-access
+        with agent.RELOAD_REQUESTED._cond, agent.SCHEDULER_WAKEUP._cond:
+            controlsignals.forward_control_signal(signal.SIGHUP, None)
+        self.assertTrue(agent.RELOAD_REQUESTED.wait(5))
+
+    def test_reload_applies_valid_settings_only(self):
+        """Reloadable settings are replaced, invalid files keep the old ones."""
+        config = {"THIS_DIR": self.tmp_dir, "scanparallel": 1, "island": "a"}
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.dict(agent.CONFIG, config, clear=True))
+            keep_days = stack.enter_context(
+                mock.patch.object(agent.file_handler, "set_keep_days")
+            )
+            stack.enter_context(self.assertLogs(agent.logger, level="INFO"))
+
+            self.write_config(
+                scanparallel=4, scanhours="08-18", logrotation=7, island="b"
+            )
+            self.assertTrue(agent._reload_config())  # pylint: disable=W0212
+            self.assertEqual(agent.CONFIG["scanparallel"], 4)
+            self.assertEqual(agent.CONFIG["scanhours"], "08-18")
+            self.assertEqual(agent.CONFIG["island"], "a")
+            keep_days.assert_called_once_with(7)
+
+            self.write_config(scanparallel=2, scanhours="25-99")
+            self.assertFalse(agent._reload_config())  # pylint: disable=W0212
+            self.assertEqual(agent.CONFIG["scanparallel"], 4)
+
+    def test_auto_bounds_follow_reload(self):
+        """A running auto controller keeps its limit within new bounds."""
+        scan_parallelism = agent._scan_parallelism  # pylint: disable=W0212
+        with mock.patch.dict(agent.CONFIG, {"scanparallel_max": 8}):
+            controller, limit, workers = scan_parallelism("auto")
+            self.assertEqual((limit, workers), (1, 8))
+            controller.limit = 6
+        with mock.patch.dict(agent.CONFIG, {"scanparallel_max": 4}):
+            self.assertEqual(scan_parallelism("auto", controller), (controller, 4, 4))
+        self.assertEqual(scan_parallelism(3, controller), (None, 3, 3))
+
+    def test_reload_then_drain_in_daemon_loop(self):
+        """SIGHUP widens the slots, SIGUSR1 stops fetching and returns."""
+        calls = []
+        limits = []
+        lock = threading.Lock()
+
+        def fake_run_scan_job(_job_message):
+            with lock:
+                calls.append(True)
+                limits.append(agent.SCAN_SLOTS.limit)
+                if len(calls) == 1:
+                    self.write_config(scanparallel=2)
+                    controlsignals.request_control(
+                        agent.RELOAD_REQUESTED, agent.SCHEDULER_WAKEUP
+                    )
+                elif len(calls) == 3:
+                    controlsignals.request_control(
+                        agent.DRAIN_REQUESTED, agent.SCHEDULER_WAKEUP
+                    )
+            return True
+
+        config = {"THIS_DIR": self.tmp_dir, "scanparallel": 1}
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.dict(agent.CONFIG, config, clear=True))
+            stack.enter_context(
+                mock.patch.object(
+                    agent, "SCAN_SLOTS", ScanSlots(wakeup=agent.SCHEDULER_WAKEUP)
+                )
+            )
+            stack.enter_context(mock.patch.object(agent.file_handler, "set_keep_days"))
+            stack.enter_context(
+                mock.patch.object(agent, "run_scan_job", side_effect=fake_run_scan_job)
+            )
+            stack.enter_context(
+                mock.patch.object(agent, "_batch_getjob_supported", return_value=False)
+            )
+            fetch_jobs = stack.enter_context(
+                mock.patch.object(
+                    agent,
+                    "fetch_jobs",
+                    side_effect=lambda count: [{"job_uid": RANGE_UID}] * count,
+                )
+            )
+            stack.enter_context(self.assertLogs(agent.logger, level="INFO"))
+            agent._run_daemon_loop(1)  # pylint: disable=protected-access
+
+            self.assertEqual(agent.SCAN_SLOTS.limit, 2)
+            self.assertEqual(agent.SCAN_SLOTS.busy(), 0)
+        self.assertEqual(limits[0], 1)
+        self.assertEqual(limits[-1], 2)
+        fetched = sum(call.args[0] for call in fetch_jobs.call_args_list)
+        self.assertEqual(fetched, len(calls))
+
+
+if __name__ == "__main__":
+    unittest.main()
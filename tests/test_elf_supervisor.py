@@ -0,0 +1,133 @@
+"""Tests for the shared subprocess supervisor behind run_elf."""
+
+import os
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+from utils import mutils  # pylint: disable=wrong-import-position
+from utils.elfsupervisor import SUPERVISOR  # pylint: disable=wrong-import-position
+
+PRINT_BOTH = "import sys; print('out line'); print('err line', file=sys.stderr)"
+PRINT_AND_SLEEP = "import time; print('ready', flush=True); time.sleep(60)"
+IGNORE_TERM = (
+    "import signal, sys, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); "
+    "print('ready', flush=True); time.sleep(60)"
+)
+
+
+class ElfSupervisorTests(unittest.TestCase):
+    """Verify exit codes, pipe logging, and termination."""
+
+    def _wait_for(self, predicate, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                self.fail("condition not reached")
+            time.sleep(0.01)
+
+    def test_exit_code_and_pipes_are_reported(self):
+        """Stdout is logged as info, stderr as error, the exit code returned."""
+        script = PRINT_BOTH + "; sys.exit(3)"
+        with self.assertLogs(mutils.logger, level="INFO") as captured:
+            return_code = mutils.run_elf(sys.executable, ["-c", script])
+        self.assertEqual(return_code, 3)
+        self.assertIn("INFO:Plum_Agent:out line", captured.output)
+        self.assertIn("ERROR:Plum_Agent:err line", captured.output)
+
+    def test_parallel_scans_share_one_supervisor_thread(self):
+        """Concurrent processes do not start reader threads of their own."""
+        mutils.run_elf(sys.executable, ["-c", "pass"])
+        baseline = threading.active_count()
+        peak = []
+
+        def run(_index):
+            return mutils.run_elf(
+                sys.executable, ["-c", "import time; time.sleep(0.3)"]
+            )
+
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            futures = [executor.submit(run, index) for index in range(6)]
+            self._wait_for(lambda: len(SUPERVISOR.running()) == 6)
+            peak.append(threading.active_count())
+            self.assertEqual([future.result() for future in futures], [0] * 6)
+        self.assertLessEqual(peak[0], baseline + 6)
+
+    def test_terminate_kills_after_grace_period(self):
+        """Processes ignoring SIGTERM are killed once the grace period expires."""
+        results = []
+        with self.assertLogs(mutils.logger, level="INFO") as captured:
+            worker = threading.Thread(
+                target=lambda: results.append(
+                    mutils.run_elf(sys.executable, ["-c", IGNORE_TERM])
+                )
+            )
+            worker.start()
+            self._wait_for(lambda: "INFO:Plum_Agent:ready" in captured.output)
+            started = time.monotonic()
+            mutils.terminate_running_elfs(grace_period=0.2)
+            worker.join(timeout=5)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(results, [-9])
+        self.assertEqual(SUPERVISOR.running(), [])
+        self.assertTrue(
+            any("Terminating process pid=" in line for line in captured.output)
+        )
+
+    def test_long_lines_without_newline_are_logged(self):
+        """Output longer than the line limit is still drained."""
+        script = "import sys; sys.stdout.write('x' * 3000000)"
+        with self.assertLogs(mutils.logger, level="INFO") as captured:
+            self.assertEqual(mutils.run_elf(sys.executable, ["-c", script]), 0)
+        logged = "".join(record.getMessage() for record in captured.records)
+        self.assertEqual(logged, "x" * 3000000)
+        self.assertGreater(len(captured.records), 1)
+
+    def test_failing_line_handler_terminates_the_process(self):
+        """An exception while reading the pipes does not leak the process."""
+
+        def explode(_stream, _line):
+            raise RuntimeError("handler failure")
+
+        with self.assertRaises(RuntimeError):
+            mutils.run_elf(
+                sys.executable, ["-c", PRINT_AND_SLEEP], line_handler=explode
+            )
+        self.assertEqual(SUPERVISOR.running(), [])
+
+    def test_interrupt_only_terminates_its_own_process(self):
+        """KeyboardInterrupt in one caller leaves the other scans running."""
+        ready = threading.Event()
+        other = SUPERVISOR.submit(
+            [sys.executable, "-c", "import time; time.sleep(1)"], lambda *_: None
+        )
+        real_submit = SUPERVISOR.submit
+
+        def interrupt_when_ready():
+            ready.wait(5)
+            raise KeyboardInterrupt
+
+        def interrupted_submit(*args):
+            interrupted = mock.Mock(wraps=real_submit(*args))
+            interrupted.result.side_effect = interrupt_when_ready
+            return interrupted
+
+        with mock.patch.object(SUPERVISOR, "submit", interrupted_submit):
+            with self.assertRaises(KeyboardInterrupt):
+                SUPERVISOR.run(
+                    [sys.executable, "-c", PRINT_AND_SLEEP],
+                    lambda _stream, _line: ready.set(),
+                )
+        self.assertEqual(len(SUPERVISOR.running()), 1)
+        self.assertEqual(other.result(timeout=5), 0)
+        self.assertEqual(SUPERVISOR.running(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""Tests for the concurrent external IP discovery."""
+
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+from utils import netutils  # pylint: disable=wrong-import-position
+
+SLOW_ANSWER = 1
+
+
+class ExtIpTests(unittest.TestCase):
+    """Verify provider racing, quorum and the disk cache."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.cache_path = os.path.join(self.tmp_dir, "ext_ip_cache.json")
+        self.queried = []
+        self.lock = threading.Lock()
+
+    def discover(self, answers, **kwargs):
+        """
+        Run get_ext_ip against providers answering (delay, address), return
+        the address, the elapsed seconds and the log records.
+        """
+
+        def fake_query(provider):
+            with self.lock:
+                self.queried.append(provider)
+            delay, address = answers[provider]
+            time.sleep(delay)
+            return address
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(
+                mock.patch.object(netutils, "EXT_IP_PROVIDERS", tuple(answers))
+            )
+            stack.enter_context(
+                mock.patch.object(netutils, "_query_ext_ip", side_effect=fake_query)
+            )
+            logs = stack.enter_context(self.assertLogs(netutils.logger, level="INFO"))
+            started = time.monotonic()
+            ip = netutils.get_ext_ip(**kwargs)
+            return ip, time.monotonic() - started, logs.output
+
+    def test_settings_parsing(self):
+        """Quorum is bounded by the provider count, the TTL may be 0."""
+        self.assertEqual(netutils.parse_ext_ip_quorum(None), 1)
+        self.assertEqual(netutils.parse_ext_ip_quorum("2"), 2)
+        self.assertEqual(netutils.parse_ext_ip_cache_ttl(None), 0)
+        self.assertEqual(netutils.parse_ext_ip_cache_ttl("3600"), 3600)
+        self.assertEqual(netutils.parse_ext_ip_cache_ttl("0"), 0)
+        for value in (0, 9, "x", True):
+            with self.subTest(quorum=value):
+                with self.assertRaises(ValueError):
+                    netutils.parse_ext_ip_quorum(value)
+        with self.assertRaises(ValueError):
+            netutils.parse_ext_ip_cache_ttl(-1)
+
+    def test_first_valid_answer_wins(self):
+        """Blocked providers do not delay the fastest valid answer."""
+        ip, elapsed, _ = self.discover(
+            {
+                "blocked-1": (SLOW_ANSWER, None),
+                "blocked-2": (SLOW_ANSWER, None),
+                "failing": (0, None),
+                "fast": (0.05, "192.0.2.10"),
+            }
+        )
+        self.assertEqual(ip, "192.0.2.10")
+        self.assertLess(elapsed, SLOW_ANSWER)
+        self.assertEqual(len(self.queried), 4)
+
+    def test_quorum_requires_agreeing_answers(self):
+        """A lone diverging answer is outvoted."""
+        answers = {
+            "odd": (0, "198.51.100.1"),
+            "first": (0.05, "192.0.2.10"),
+            "second": (0.1, "192.0.2.10"),
+            "slow": (SLOW_ANSWER, "192.0.2.10"),
+        }
+        ip, elapsed, _ = self.discover(answers, quorum=2)
+        self.assertEqual(ip, "192.0.2.10")
+        self.assertLess(elapsed, SLOW_ANSWER)
+
+        answers["second"] = (0, None)
+        answers["slow"] = (0, "203.0.113.5")
+        ip, _, output = self.discover(answers, quorum=2)
+        self.assertIsNone(ip)
+        self.assertIn("No external IP answered by 2 providers", output[0])
+
+    def test_cache_skips_discovery_within_ttl(self):
+        """A fresh cached address is reused, an expired one is refreshed."""
+        answers = {"fast": (0, "192.0.2.10")}
+        ip, _, _ = self.discover(answers, cache_path=self.cache_path, cache_ttl=60)
+        self.assertEqual(ip, "192.0.2.10")
+        self.queried.clear()
+
+        ip, _, _ = self.discover(
+            {"fast": (0, "192.0.2.99")}, cache_path=self.cache_path, cache_ttl=60
+        )
+        self.assertEqual(ip, "192.0.2.10")
+        self.assertEqual(self.queried, [])
+
+        with open(self.cache_path, "w", encoding="utf-8") as handle:
+            json.dump({"ip": "192.0.2.10", "time": time.time() - 120}, handle)
+        ip, _, _ = self.discover(
+            {"fast": (0, "192.0.2.99")}, cache_path=self.cache_path, cache_ttl=60
+        )
+        self.assertEqual(ip, "192.0.2.99")
+
+    def test_private_and_invalid_answers_are_rejected(self):
+        """Provider answers must be public addresses."""
+        for text in ("10.1.2.3", "<html>blocked</html>"):
+            with self.subTest(text=text):
+                session = mock.MagicMock()
+                session.get.return_value.__enter__.return_value.text = text
+                with mock.patch.object(netutils, "get_session", return_value=session):
+                    with self.assertLogs(netutils.logger, level="WARNING"):
+                        self.assertIsNone(
+                            netutils._query_ext_ip(  # pylint: disable=W0212
+                                "https://ip.test"
+                            )
+                        )
+
+
+if __name__ == "__main__":
+    unittest.main()
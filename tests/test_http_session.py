@@ -0,0 +1,83 @@
+"""Tests for the pooled controller HTTP session."""
+
+import json
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+from utils import httpsession, httpstats  # pylint: disable=wrong-import-position
+from utils.netutils import robust_request  # pylint: disable=wrong-import-position
+
+
+class _ReadyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Answer every POST with a small JSON document."""
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps({"message": "ready"}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        return
+
+
+class HttpSessionTests(unittest.TestCase):
+    """Verify configuration parsing and connection reuse."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _ReadyHandler)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/bot_api/beacon"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_pool_size_defaults_from_scanparallel(self):
+        """Unset pool size follows scan parallelism."""
+        self.assertEqual(httpsession.parse_http_pool_size(None, 8), 9)
+        self.assertEqual(httpsession.parse_http_pool_size("", 0), 2)
+        self.assertEqual(httpsession.parse_http_pool_size("4", 8), 4)
+        for value in (0, "-1", "many", True):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    httpsession.parse_http_pool_size(value)
+
+    def test_keepalive_parsing(self):
+        """Keep-alive accepts YAML booleans and common strings."""
+        self.assertTrue(httpsession.parse_http_keepalive(None))
+        self.assertFalse(httpsession.parse_http_keepalive(False))
+        self.assertFalse(httpsession.parse_http_keepalive("off"))
+        with self.assertRaises(ValueError):
+            httpsession.parse_http_keepalive("maybe")
+
+    def test_sequential_requests_reuse_connection(self):
+        """Keep-alive requests share one pooled connection."""
+        httpsession.configure_session(pool_size=2, keepalive=True)
+        before = httpstats.connection_stats()
+        for _ in range(3):
+            self.assertEqual(
+                robust_request(self.url, method="POST", data={}, max_retries=1),
+                {"message": "ready"},
+            )
+        after = httpstats.connection_stats()
+        self.assertEqual(after["requests"] - before["requests"], 3)
+        self.assertEqual(after["opened"] - before["opened"], 1)
+        self.assertEqual(after["reused"] - before["reused"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
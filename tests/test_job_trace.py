@@ -0,0 +1,156 @@
+"""Tests for the per-job phase timing and trace records."""
+
+import contextlib
+import glob
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils import delivery, spool, tracing  # pylint: disable=C0413
+from utils.netutils import WIRE_FORMAT_JSON  # pylint: disable=wrong-import-position
+from utils.setup import APIPath  # pylint: disable=wrong-import-position
+
+RANGE_UID = "f5813ec7-b36b-4fe7-b662-cca3d281725c"
+REPORT = (
+    '<?xml version="1.0"?>\n<nmaprun scanner="nmap" args="x">\n'
+    '<host><status state="up"/><address addr="192.0.2.1" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="443"><state state="open"/>'
+    "</port></ports></host>\n</nmaprun>\n"
+)
+
+
+class JobTraceTests(unittest.TestCase):
+    """Verify settings parsing and the span bookkeeping."""
+
+    def test_settings_parsing(self):
+        """Tracing is disabled by default."""
+        self.assertFalse(tracing.parse_job_trace(None))
+        self.assertTrue(tracing.parse_job_trace("on"))
+        with self.assertRaises(ValueError):
+            tracing.parse_job_trace("verbose")
+
+    def test_repeated_phases_are_summed(self):
+        """Spans keep their order, the summary totals each phase."""
+        trace = tracing.JobTrace(RANGE_UID)
+        with mock.patch.object(tracing.time, "monotonic", side_effect=[1, 3, 4, 5]):
+            with trace.span("nmap"):
+                pass
+            with trace.span("nmap"):
+                pass
+        with mock.patch.object(tracing.time, "monotonic", side_effect=[6, 7]):
+            with trace.span("parse"):
+                pass
+        self.assertEqual(trace.summary(), {"nmap": 3, "parse": 1})
+
+        record = trace.record(status="failed")
+        self.assertEqual([span["phase"] for span in record["spans"]][-1], "parse")
+        self.assertEqual(record["status"], "failed")
+        tracing.append_span(
+            record, "upload", record["start"] + 10, record["start"] + 12
+        )
+        self.assertEqual(record["phases"]["upload"], 2)
+        self.assertEqual(record["spans"][-1]["start"], 10)
+        self.assertEqual(record["elapsed"], 12)
+
+
+class TracedScanTests(unittest.TestCase):
+    """Verify the phases of a scan job reach the payload and the trace file."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.config = {
+            "nmap_path": "nmap",
+            "THIS_DIR": self.tmp_dir,
+            "wire_format": WIRE_FORMAT_JSON,
+            "APIPATH": APIPath("https://island.test"),
+            "job_trace": True,
+        }
+        self.job = {"job_uid": RANGE_UID, "job": "192.0.2.1", "nmap_ports": [443]}
+
+    def fake_run_elf(self, _executable, arguments, **_kwargs):
+        """Write the report of a finished Nmap process."""
+        with open(arguments[arguments.index("-oX") + 1], "w", encoding="utf-8") as out:
+            out.write(REPORT)
+        return 0
+
+    def run_job(self, stack, run_elf):
+        """
+        Run the job with tracing enabled, return the robust_request mock.
+        """
+        stack.enter_context(mock.patch.dict(agent.CONFIG, self.config))
+        stack.enter_context(mock.patch.object(agent, "run_elf", side_effect=run_elf))
+        request_mock = stack.enter_context(
+            mock.patch.object(
+                delivery, "robust_request", return_value={"message": "ok"}
+            )
+        )
+        stack.enter_context(self.assertLogs(agent.logger, level="INFO"))
+        self.assertIsNotNone(agent._start_job_trace())  # pylint: disable=W0212
+        stack.callback(agent.RESULT_DELIVERY.stop_trace)
+        agent.run_scan_job(self.job)
+        return request_mock
+
+    def trace_records(self):
+        """Return the records of the trace file."""
+        (path,) = glob.glob(os.path.join(self.tmp_dir, "log", "trace-*.jsonl"))
+        with open(path, encoding="utf-8") as handle:
+            return [json.loads(line) for line in handle]
+
+    def test_inline_delivery_traces_every_phase(self):
+        """The payload holds the phases before upload, the trace all of them."""
+        with contextlib.ExitStack() as stack:
+            request_mock = self.run_job(stack, self.fake_run_elf)
+        payload = json.loads(request_mock.call_args.kwargs["body"])
+        self.assertEqual(
+            sorted(payload[tracing.TIMING_FIELD]), ["argv", "nmap", "nse", "parse"]
+        )
+        (record,) = self.trace_records()
+        self.assertEqual(record["job_uid"], RANGE_UID)
+        self.assertEqual(record["status"], "delivered")
+        self.assertEqual(
+            [span["phase"] for span in record["spans"]],
+            ["nse", "argv", "nmap", "parse", "serialize", "upload"],
+        )
+
+    def test_spooled_result_is_traced_on_delivery(self):
+        """The trace travels in the spool until the uploader delivers it."""
+        uploader = mock.Mock()
+        uploader.spool = spool.ResultSpool(os.path.join(self.tmp_dir, "spool"))
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(
+                mock.patch.object(agent.RESULT_DELIVERY, "uploader", uploader)
+            )
+            request_mock = self.run_job(stack, self.fake_run_elf)
+            request_mock.assert_not_called()
+            self.assertEqual(self.trace_records(), [])
+
+            meta, body = uploader.spool.load(uploader.spool.pending()[0])
+            self.assertTrue(agent.RESULT_DELIVERY.upload_spooled(meta, body))
+            (record,) = self.trace_records()
+        self.assertEqual(record["spans"][-1]["phase"], "upload")
+        self.assertIn("upload", record["phases"])
+        body = request_mock.call_args.kwargs["body"]
+        self.assertIn(tracing.TIMING_FIELD, json.loads(body))
+        self.assertNotIn(b'"spans"', body)
+
+    def test_interrupted_job_is_traced(self):
+        """Jobs ending without a result are traced with their status."""
+        with contextlib.ExitStack() as stack:
+            request_mock = self.run_job(stack, lambda *_args, **_kwargs: -15)
+            request_mock.assert_not_called()
+            (record,) = self.trace_records()
+        self.assertEqual(record["status"], "interrupted")
+        self.assertEqual(sorted(record["phases"]), ["argv", "nmap", "nse"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Tests for the background logging pipeline."""
+
+import logging
+import os
+import sys
+import threading
+import unittest
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+from utils import logqueue  # pylint: disable=wrong-import-position
+
+
+class ListHandler(logging.Handler):
+    """Collect formatted messages, optionally waiting for a gate event."""
+
+    def __init__(self, level=logging.NOTSET, gate=None):
+        super().__init__(level)
+        self.messages = []
+        self.gate = gate
+
+    def emit(self, record):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.messages.append(f"{record.levelname}:{record.getMessage()}")
+
+
+class LogPipelineTests(unittest.TestCase):
+    """Verify delivery, overflow accounting, and shutdown."""
+
+    def setUp(self):
+        self.logger = logging.getLogger(f"pipeline-test-{self.id()}")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
+
+    def test_settings_parsing(self):
+        """The queue size defaults to 10000 records and must be positive."""
+        self.assertEqual(logqueue.parse_log_queue_size(None), 10000)
+        self.assertEqual(logqueue.parse_log_queue_size("50"), 50)
+        for value in (0, "x", True):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    logqueue.parse_log_queue_size(value)
+
+    def test_records_are_delivered_and_handlers_restored(self):
+        """Handlers receive records from the listener and return on stop."""
+        console = ListHandler(logging.INFO)
+        self.logger.addHandler(console)
+        pipeline = logqueue.LogPipeline(self.logger, 100).start()
+        self.assertEqual(self.logger.handlers, [pipeline.handler])
+        self.logger.debug("filtered %s", 1)
+        self.logger.info("hello %s", "world")
+        pipeline.stop()
+        self.assertEqual(console.messages, ["INFO:hello world"])
+        self.assertEqual(self.logger.handlers, [console])
+
+    def test_full_queue_drops_and_reports(self):
+        """A stalled handler makes new records drop instead of blocking."""
+        release = threading.Event()
+        slow = ListHandler(gate=release)
+        self.logger.addHandler(slow)
+        pipeline = logqueue.LogPipeline(self.logger, 2).start()
+        for index in range(20):
+            self.logger.info("record %s", index)
+        self.assertGreaterEqual(pipeline.dropped, 16)
+        release.set()
+        pipeline.stop()
+        delivered = [line for line in slow.messages if line.startswith("INFO:")]
+        self.assertEqual(len(delivered) + pipeline.dropped, 20)
+        self.assertIn(
+            f"WARNING:Log queue full, dropped {pipeline.dropped} records"
+            f" ({pipeline.dropped} in total)",
+            slow.messages,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
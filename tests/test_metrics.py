@@ -0,0 +1,145 @@
+"""Tests for the agent metrics endpoint and its hooks."""
+
+import os
+import sys
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils import delivery, metrics, netutils  # pylint: disable=C0413
+from utils.setup import APIPath  # pylint: disable=wrong-import-position
+
+
+class RegistryTests(unittest.TestCase):
+    """Verify settings parsing and the text exposition format."""
+
+    def test_settings_parsing(self):
+        """The endpoint is disabled by default, a bare port is local."""
+        self.assertIsNone(metrics.parse_metrics_listen(None))
+        self.assertIsNone(metrics.parse_metrics_listen(""))
+        self.assertEqual(metrics.parse_metrics_listen(9464), ("127.0.0.1", 9464))
+        self.assertEqual(
+            metrics.parse_metrics_listen("0.0.0.0:9464"), ("0.0.0.0", 9464)
+        )
+        self.assertEqual(metrics.parse_metrics_listen("[::1]:9464"), ("::1", 9464))
+        for value in (True, "host:port", "127.0.0.1:0", 70000):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    metrics.parse_metrics_listen(value)
+
+    def test_render_counters_gauges_and_histograms(self):
+        """Histogram buckets are cumulative, label values are escaped."""
+        registry = metrics.MetricsRegistry()
+        registry.counter("test_total", "Events")
+        registry.gauge("test_running", "Running")
+        registry.histogram("test_seconds", "Durations", (0.1, 1))
+        registry.inc("test_total", endpoint='get"job')
+        registry.inc("test_total", 2, endpoint='get"job')
+        registry.track("test_running", lambda: 3)
+        for value in (0.05, 0.5, 0.5, 5):
+            registry.observe("test_seconds", value)
+
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE test_total counter", lines)
+        self.assertIn('test_total{endpoint="get\\"job"} 3', lines)
+        self.assertIn("test_running 3", lines)
+        self.assertIn('test_seconds_bucket{le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn("test_seconds_sum 6.05", lines)
+        self.assertIn("test_seconds_count 4", lines)
+        with self.assertRaises(KeyError):
+            registry.inc("undeclared_total")
+
+    def test_server_answers_scrapes(self):
+        """GET /metrics returns the registry, other paths are not found."""
+        registry = metrics.MetricsRegistry()
+        registry.counter("test_total", "Events")
+        registry.inc("test_total")
+        server = metrics.MetricsServer(registry, "127.0.0.1", 0).start()
+        self.addCleanup(server.stop)
+        url = f"http://127.0.0.1:{server.port}"
+        with urllib.request.urlopen(f"{url}/metrics", timeout=5) as response:
+            self.assertEqual(response.headers["Content-Type"], metrics.CONTENT_TYPE)
+            self.assertIn("test_total 1", response.read().decode())
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other", timeout=5).close()
+
+
+class HookTests(unittest.TestCase):
+    """Verify the agent and controller request hooks feed the registry."""
+
+    def test_robust_request_counts_retries_and_failures(self):
+        """Each retried attempt and each abandoned request is counted."""
+        session = mock.Mock()
+        session.post.return_value = mock.Mock(status_code=503)
+        retries = metrics.METRICS.value("plum_http_retries_total", endpoint="sndjob")
+        failures = metrics.METRICS.value("plum_http_failures_total", endpoint="sndjob")
+        with mock.patch.object(
+            netutils, "get_session", return_value=session
+        ), mock.patch.object(netutils.time, "sleep"), self.assertLogs(
+            netutils.logger, level="ERROR"
+        ):
+            self.assertIsNone(
+                netutils.robust_request(
+                    "https://island.test/bot_api/sndjob/",
+                    method="POST",
+                    body=b"{}",
+                    max_retries=3,
+                )
+            )
+        self.assertEqual(
+            metrics.METRICS.value("plum_http_retries_total", endpoint="sndjob"),
+            retries + 2,
+        )
+        self.assertEqual(
+            metrics.METRICS.value("plum_http_failures_total", endpoint="sndjob"),
+            failures + 1,
+        )
+
+    def test_getjob_and_sndjob_are_measured(self):
+        """Polls, empty polls and uploads are recorded."""
+        config = {"APIPATH": APIPath("https://island.test"), "botinfo": {}}
+        before = {
+            name: metrics.METRICS.value(name)
+            for name in (
+                "plum_getjob_requests_total",
+                "plum_getjob_empty_total",
+                "plum_getjob_seconds",
+                "plum_sndjob_bytes_total",
+                "plum_sndjob_seconds",
+            )
+        }
+        with mock.patch.dict(agent.CONFIG, config), mock.patch.object(
+            agent, "_nse_store"
+        ), mock.patch.object(
+            agent, "_nse_cache_report", return_value={}
+        ), mock.patch.object(
+            agent, "robust_request", return_value={"message": {}}
+        ), mock.patch.object(
+            delivery, "robust_request", return_value={"message": {}}
+        ), self.assertLogs(
+            agent.logger, level="INFO"
+        ):
+            self.assertEqual(agent.fetch_jobs(1), [])
+            agent.RESULT_DELIVERY.post({}, b"0123456789", 1)
+        after = {name: metrics.METRICS.value(name) for name in before}
+        self.assertEqual(
+            {name: after[name] - before[name] for name in before},
+            {
+                "plum_getjob_requests_total": 1,
+                "plum_getjob_empty_total": 1,
+                "plum_getjob_seconds": 1,
+                "plum_sndjob_bytes_total": 10,
+                "plum_sndjob_seconds": 1,
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -103,7 +103,7 @@ class NmapAdditionalParamsTests(unittest.TestCase):
         ):
             with self.assertLogs(agent.logger, level="DEBUG") as captured:
 
-                def fake_run_elf(executable, arguments):
+                def fake_run_elf(executable, arguments, **_kwargs):
                     executed_args.extend([executable, *arguments])
                     messages_seen_at_execution.extend(captured.output)
                     return -1
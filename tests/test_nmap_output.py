@@ -0,0 +1,158 @@
+"""Tests for the structured Nmap output processor."""
+
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+from utils import nmapoutput  # pylint: disable=wrong-import-position
+
+STATS_LINE = (
+    "Stats: 0:01:23 elapsed; 12 hosts completed (34 up), 22 undergoing "
+    "SYN Stealth Scan"
+)
+TIMING_LINE = (
+    "SYN Stealth Scan Timing: About {percent}% done; ETC: 12:34 (0:00:15 remaining)"
+)
+
+
+class NmapOutputProcessorTests(unittest.TestCase):
+    """Verify progress parsing, coalescing, rate limiting, and traces."""
+
+    def test_settings_parsing(self):
+        """The rate defaults to 20 lines per second and the trace to off."""
+        self.assertEqual(nmapoutput.parse_nmap_output_rate(None), 20)
+        self.assertEqual(nmapoutput.parse_nmap_output_rate("0"), 0)
+        self.assertFalse(nmapoutput.parse_nmap_trace(""))
+        self.assertTrue(nmapoutput.parse_nmap_trace("yes"))
+        for parser, value in (
+            (nmapoutput.parse_nmap_output_rate, -1),
+            (nmapoutput.parse_nmap_output_rate, True),
+            (nmapoutput.parse_nmap_trace, "maybe"),
+        ):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    parser(value)
+
+    def test_progress_lines_update_state(self):
+        """Stats and timing lines are parsed instead of being logged raw."""
+        processor = nmapoutput.NmapOutputProcessor("job", rate=100)
+        with self.assertLogs(nmapoutput.logger, level="INFO") as captured:
+            processor.feed("stdout", STATS_LINE)
+            for percent in ("5.00", "7.50", "45.50"):
+                processor.feed("stdout", TIMING_LINE.format(percent=percent))
+            processor.feed("stdout", "Nmap scan report for 192.0.2.1")
+            processor.feed(
+                "stdout",
+                "Nmap done: 256 IP addresses (12 hosts up) scanned in 5.23 seconds",
+            )
+            processor.close()
+        self.assertEqual(
+            processor.progress(),
+            {
+                "elapsed": "0:01:23",
+                "hosts_completed": 12,
+                "hosts_up": 12,
+                "hosts_undergoing": 22,
+                "phase": "SYN Stealth Scan",
+                "percent": 100.0,
+                "etc": "12:34",
+                "remaining": "0:00:15",
+                "hosts_reported": 1,
+                "addresses": 256,
+                "seconds": 5.23,
+            },
+        )
+        self.assertEqual(
+            [line for line in captured.output if "progress" in line],
+            [
+                "INFO:Plum_Agent:Job job progress: SYN Stealth Scan 5.0% ETC 12:34",
+                "INFO:Plum_Agent:Job job progress: SYN Stealth Scan 45.5% ETC 12:34",
+            ],
+        )
+        self.assertFalse(any("Stats:" in line for line in captured.output))
+
+    def test_phase_change_restarts_progress_logging(self):
+        """A new phase is logged even when Stats lines announced it first."""
+        processor = nmapoutput.NmapOutputProcessor("job", rate=100)
+        ping_stats = STATS_LINE.replace("SYN Stealth Scan", "Ping Scan")
+        ping_timing = TIMING_LINE.replace("SYN Stealth Scan", "Ping Scan")
+        with self.assertLogs(nmapoutput.logger, level="INFO") as captured:
+            processor.feed("stdout", ping_stats)
+            processor.feed("stdout", ping_timing.format(percent="90.00"))
+            for percent in ("5.00", "30.00", "60.00", "95.00"):
+                processor.feed("stdout", STATS_LINE)
+                processor.feed("stdout", TIMING_LINE.format(percent=percent))
+        self.assertEqual(
+            [line.rsplit(": ", 1)[1] for line in captured.output],
+            [
+                "Ping Scan 90.0% ETC 12:34",
+                "SYN Stealth Scan 5.0% ETC 12:34",
+                "SYN Stealth Scan 30.0% ETC 12:34",
+                "SYN Stealth Scan 60.0% ETC 12:34",
+                "SYN Stealth Scan 95.0% ETC 12:34",
+            ],
+        )
+
+    def test_repeated_lines_are_coalesced(self):
+        """Consecutive duplicates are logged once with a repeat count."""
+        processor = nmapoutput.NmapOutputProcessor("job", rate=100)
+        with self.assertLogs(nmapoutput.logger, level="INFO") as captured:
+            for _ in range(5):
+                processor.feed("stdout", "NSE: Script scanning 192.0.2.1.")
+            processor.feed("stderr", "WARNING: bad")
+            processor.close()
+        self.assertEqual(
+            captured.output,
+            [
+                "INFO:Plum_Agent:Job job nmap: NSE: Script scanning 192.0.2.1.",
+                "INFO:Plum_Agent:Job job nmap: NSE: Script scanning 192.0.2.1."
+                " (repeated 4 times)",
+                "ERROR:Plum_Agent:Job job nmap: WARNING: bad",
+            ],
+        )
+
+    def test_raw_output_is_rate_limited(self):
+        """Lines above the rate are counted, stderr is always logged."""
+        processor = nmapoutput.NmapOutputProcessor("job", rate=2)
+        with self.assertLogs(nmapoutput.logger, level="INFO") as captured:
+            for index in range(10):
+                processor.feed("stdout", f"line {index}")
+            processor.feed("stderr", "failure")
+            processor.close()
+        self.assertEqual(processor.suppressed, 8)
+        self.assertEqual(
+            captured.output,
+            [
+                "INFO:Plum_Agent:Job job nmap: line 0",
+                "INFO:Plum_Agent:Job job nmap: line 1",
+                "ERROR:Plum_Agent:Job job nmap: failure",
+                "INFO:Plum_Agent:Job job suppressed 8 of 11 Nmap output lines",
+            ],
+        )
+
+    def test_trace_keeps_every_line(self):
+        """The gzip trace receives the full stream, progress lines included."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        trace_path = os.path.join(tmp_dir, "job.log.gz")
+        processor = nmapoutput.NmapOutputProcessor("job", rate=0, trace_path=trace_path)
+        with self.assertLogs(nmapoutput.logger, level="INFO"):
+            processor.feed("stdout", STATS_LINE)
+            processor.feed("stdout", "line")
+            processor.feed("stderr", "failure")
+            processor.close()
+        with gzip.open(trace_path, "rt", encoding="utf-8") as handle:
+            self.assertEqual(
+                handle.read().splitlines(),
+                [f"stdout: {STATS_LINE}", "stdout: line", "stderr: failure"],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,285 @@
+"""Tests for the content-addressed NSE store and script resolution."""
+
+import base64
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import uuid
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils import nsestore  # pylint: disable=wrong-import-position
+from utils.setup import APIPath  # pylint: disable=wrong-import-position
+
+
+def descriptor(name, content):
+    """Return a controller NSE descriptor for content."""
+    return {
+        "name": name,
+        "hash": hashlib.sha256(content).hexdigest(),
+        "content_b64": base64.b64encode(content).decode(),
+    }
+
+
+class NseCacheTests(unittest.TestCase):
+    """Verify the content-addressed store and script resolution."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.cache_dir = os.path.join(self.tmp_dir, "nse_cache")
+        os.makedirs(self.cache_dir)
+        patcher = mock.patch.dict(agent.CONFIG, {"THIS_DIR": self.tmp_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(agent, "NSE_STORE", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _store(self, max_bytes=1 << 20):
+        with self.assertNoLogs(nsestore.logger, level="WARNING"):
+            return nsestore.NseStore(self.cache_dir, max_bytes)
+
+    def test_settings_parsing(self):
+        """The size cap defaults to 256 MB and must be positive."""
+        self.assertEqual(nsestore.parse_nse_cache_max_mb(None), 256)
+        self.assertEqual(nsestore.parse_nse_cache_max_mb("64"), 64)
+        for value in (0, "x", True):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    nsestore.parse_nse_cache_max_mb(value)
+
+    def test_versions_of_one_name_coexist(self):
+        """Two jobs can use different versions of the same script name."""
+        store = self._store()
+        old, new = descriptor("probe.nse", b"-- v1"), descriptor("probe.nse", b"-- v2")
+        store.put("job-a", old["hash"], b"-- v1")
+        store.put("job-b", new["hash"], b"-- v2")
+        path_a = store.link("job-a", "probe.nse", old["hash"])
+        path_b = store.link("job-b", "probe.nse", new["hash"])
+        self.assertEqual(os.path.basename(path_a), "probe.nse")
+        with open(path_a, "rb") as handle_a, open(path_b, "rb") as handle_b:
+            self.assertEqual((handle_a.read(), handle_b.read()), (b"-- v1", b"-- v2"))
+        self.assertEqual(store.hashes(), {"probe.nse": new["hash"]})
+
+        store.release("job-a")
+        self.assertFalse(os.path.exists(path_a))
+        self.assertIn(old["hash"], store)
+
+    def test_least_recently_used_unpinned_objects_are_evicted(self):
+        """Eviction under the size cap skips objects pinned by a running job."""
+        store = self._store(max_bytes=10)
+        digests = [
+            descriptor(f"{name}.nse", name.encode() * 4)["hash"] for name in "abc"
+        ]
+        for offset, (name, digest) in enumerate(zip("abc", digests)):
+            store.put("job", digest, name.encode() * 4)
+            os.utime(
+                store._object_path(digest), (offset, offset)
+            )  # pylint: disable=protected-access
+        self.assertEqual(store.size(), 12)
+
+        with self.assertLogs(nsestore.logger, level="INFO") as captured:
+            store.release("job")
+        self.assertEqual(len(captured.output), 1)
+        self.assertNotIn(digests[0], store)
+        self.assertEqual(store.size(), 8)
+
+        store.pin("running", digests[1])
+        store.put("job", descriptor("d.nse", b"dddd")["hash"], b"dddd")
+        store.release("job")
+        self.assertIn(digests[1], store)
+        self.assertNotIn(digests[2], store)
+
+    def test_advertised_objects_survive_until_leased_jobs_resolve(self):
+        """Scripts advertised at getjob are not evicted before the job runs."""
+        store = self._store(max_bytes=8)
+        probe = descriptor("probe.nse", b"-- probe")
+        store.put("old-job", probe["hash"], b"-- probe")
+        store.release("old-job")
+        leased = {"job": "192.0.2.1", "nse_scripts": [probe | {"content_b64": ""}]}
+
+        def getjob(*_args, **_kwargs):
+            # Another job stores a new script while getjob is in flight.
+            store.put("other-job", "f" * 64, b"-- other")
+            store.release("other-job")
+            return {"message": leased}
+
+        config = {"APIPATH": APIPath("https://island.test"), "botinfo": {}}
+        with mock.patch.dict(agent.CONFIG, config), mock.patch.object(
+            agent, "NSE_STORE", store
+        ), mock.patch.object(agent, "robust_request", side_effect=getjob):
+            with self.assertLogs(nsestore.logger, level="INFO"):
+                self.assertEqual(agent.fetch_jobs(1), [leased])
+                store.put("later-job", "e" * 64, b"-- later")
+                store.release("later-job")
+            self.assertIn(probe["hash"], store)
+            with self.assertLogs(agent.logger, level="INFO") as captured:
+                agent._resolve_nse_targets(  # pylint: disable=protected-access
+                    leased, "leased-job"
+                )
+        self.assertIn("INFO:Plum_Agent:NSE cache hit: probe.nse", captured.output)
+
+        store.release("leased-job")
+        os.utime(
+            store._object_path(probe["hash"]), (0, 0)
+        )  # pylint: disable=protected-access
+        with mock.patch.object(nsestore.time, "monotonic", return_value=1e12):
+            with self.assertLogs(nsestore.logger, level="INFO"):
+                store.put("next-job", "d" * 64, b"-- next!")
+                store.release("next-job")
+        self.assertNotIn(probe["hash"], store)
+
+    def test_store_survives_restart_and_migrates_legacy_files(self):
+        """Scripts cached by basename are imported, names persist."""
+        with open(os.path.join(self.cache_dir, "legacy.nse"), "wb") as handle:
+            handle.write(b"-- legacy")
+        with open(os.path.join(self.cache_dir, ".nse_index.json"), "w") as handle:
+            handle.write("{}")
+        with self.assertLogs(nsestore.logger, level="INFO"):
+            nsestore.NseStore(self.cache_dir, 1 << 20)
+        legacy_hash = hashlib.sha256(b"-- legacy").hexdigest()
+
+        restarted = self._store()
+        self.assertEqual(restarted.hashes(), {"legacy.nse": legacy_hash})
+        self.assertIn(legacy_hash, restarted)
+        self.assertEqual(
+            sorted(os.listdir(self.cache_dir)), ["names.json", "objects", "views"]
+        )
+
+    def test_bloom_digest_membership(self):
+        """The advertised filter answers for every stored hash."""
+        hashes = [
+            hashlib.sha256(str(index).encode()).hexdigest() for index in range(200)
+        ]
+        bloom = nsestore.bloom_digest(hashes)
+        self.assertEqual(
+            (bloom["type"], bloom["count"], bloom["m"] % 8), ("bloom", 200, 0)
+        )
+        self.assertTrue(
+            all(nsestore.bloom_contains(bloom, digest) for digest in hashes)
+        )
+        absent = [
+            hashlib.sha256(f"x{index}".encode()).hexdigest() for index in range(2000)
+        ]
+        self.assertFalse(
+            any(nsestore.bloom_contains(bloom, digest) for digest in absent)
+        )
+        self.assertLess(len(bloom["bits"]), len(json.dumps(dict.fromkeys(hashes))) / 10)
+
+    def test_getjob_reports_digest_or_legacy_hashes(self):
+        """Islands without nse_digest keep receiving NSE_HASHES."""
+        store = agent._nse_store()  # pylint: disable=protected-access
+        probe = descriptor("probe.nse", b"-- probe")
+        store.put("job", probe["hash"], b"-- probe")
+        store.link("job", "probe.nse", probe["hash"])
+        with mock.patch.dict(agent.CONFIG, {"island_capabilities": []}):
+            report = agent._nse_cache_report()  # pylint: disable=protected-access
+        self.assertEqual(report, {"NSE_HASHES": {"probe.nse": probe["hash"]}})
+        with mock.patch.dict(agent.CONFIG, {"island_capabilities": ["nse_digest"]}):
+            report = agent._nse_cache_report()  # pylint: disable=protected-access
+        self.assertTrue(nsestore.bloom_contains(report["NSE_DIGEST"], probe["hash"]))
+
+    def test_resolution_refreshes_then_hits_cache(self):
+        """Downloaded scripts are stored once and linked into each job view."""
+        job_message = {"nse_scripts": [descriptor("probe.nse", b"-- probe")]}
+        with self.assertLogs(agent.logger, level="INFO") as captured:
+            paths = agent._resolve_nse_targets(  # pylint: disable=protected-access
+                job_message, "job-a"
+            )
+            agent._resolve_nse_targets(  # pylint: disable=protected-access
+                job_message, "job-b"
+            )
+        self.assertEqual(
+            paths, [os.path.join(self.cache_dir, "views", "job-a", "probe.nse")]
+        )
+        self.assertIn("INFO:Plum_Agent:NSE cache refresh: probe.nse", captured.output)
+        self.assertIn("INFO:Plum_Agent:NSE cache hit: probe.nse", captured.output)
+        agent._release_nse_view("job-a")  # pylint: disable=protected-access
+        self.assertFalse(os.path.exists(paths[0]))
+
+    def test_invalid_descriptors_are_rejected(self):
+        """Payloads not matching their hash, or malformed hashes, fail resolution."""
+        bad = descriptor("probe.nse", b"-- probe") | {"hash": "0" * 64}
+        for nse_descriptor in (bad, bad | {"hash": "../../escape"}):
+            with self.subTest(hash=nse_descriptor["hash"]):
+                with self.assertRaises(ValueError):
+                    agent._resolve_nse_targets(  # pylint: disable=protected-access
+                        {"nse_scripts": [nse_descriptor]}, "job"
+                    )
+
+    def test_concurrent_jobs_refresh_each_script_once(self):
+        """Overlapping descriptor sets are downloaded and verified once."""
+        scripts = {
+            f"s{index}.nse": descriptor(f"s{index}.nse", os.urandom(4096))
+            for index in range(8)
+        }
+        names = sorted(scripts)
+        jobs = [
+            {"nse_scripts": [scripts[name] for name in names[start : start + 4]]}
+            for start in range(5)
+        ] * 6
+        barrier = threading.Barrier(len(jobs))
+        errors = []
+
+        def resolve(job_message):
+            barrier.wait()
+            try:
+                agent._resolve_nse_targets(  # pylint: disable=protected-access
+                    job_message, uuid.uuid4().hex
+                )
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                errors.append(error)
+
+        threads = [threading.Thread(target=resolve, args=(job,)) for job in jobs]
+        with self.assertLogs(agent.logger, level="INFO") as captured:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        refreshed = [line for line in captured.output if "NSE cache refresh" in line]
+        self.assertEqual(
+            sorted(refreshed),
+            [f"INFO:Plum_Agent:NSE cache refresh: {name}" for name in names],
+        )
+        self.assertEqual(
+            agent.NSE_STORE.hashes(),
+            {name: script["hash"] for name, script in scripts.items()},
+        )
+
+    def test_unrelated_scripts_do_not_wait(self):
+        """A script being refreshed does not block other scripts."""
+        job_message = {"nse_scripts": [descriptor("other.nse", b"-- other")]}
+        busy_hash = hashlib.sha256(b"-- busy").hexdigest()
+        with nsestore.download_lock(busy_hash):
+            worker = threading.Thread(
+                target=agent._resolve_nse_targets,  # pylint: disable=protected-access
+                args=(job_message, "job"),
+            )
+            with self.assertLogs(agent.logger, level="INFO"):
+                worker.start()
+                worker.join(timeout=5)
+            self.assertFalse(worker.is_alive())
+
+    def test_script_locks_are_bounded(self):
+        """Digests map to a fixed pool of locks, the same digest to one lock."""
+        script_lock = nsestore.download_lock
+        digests = [
+            hashlib.sha256(str(index).encode()).hexdigest() for index in range(1000)
+        ]
+        locks = {id(script_lock(digest)) for digest in digests}
+        self.assertLessEqual(len(locks), len(nsestore.DOWNLOAD_LOCKS))
+        self.assertIs(script_lock(digests[0]), script_lock(digests[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""Tests for the job prefetch buffer."""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+from utils import prefetch  # pylint: disable=wrong-import-position
+
+
+class JobPrefetcherTests(unittest.TestCase):
+    """Verify buffering depth, ordering, and lease expiry."""
+
+    def _wait_for(self, predicate, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not predicate():
+            if time.monotonic() > deadline:
+                self.fail("condition not reached")
+            time.sleep(0.01)
+
+    def test_settings_parsing(self):
+        """Depth defaults to disabled and lease must be positive."""
+        self.assertEqual(prefetch.parse_prefetch_depth(None), 0)
+        self.assertEqual(prefetch.parse_prefetch_depth("3"), 3)
+        self.assertEqual(prefetch.parse_prefetch_lease(""), 600)
+        for parser, value in (
+            (prefetch.parse_prefetch_depth, -1),
+            (prefetch.parse_prefetch_lease, 0),
+            (prefetch.parse_prefetch_lease, True),
+        ):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    parser(value)
+
+    def test_buffer_is_topped_up_to_depth(self):
+        """The fetcher stops at depth and resumes once a job is taken."""
+        counter = iter(range(100))
+        wakeup = threading.Event()
+        prefetcher = prefetch.JobPrefetcher(
+            lambda count: [{"job_uid": f"job-{next(counter)}"}], 2, 60, wakeup=wakeup
+        )
+        with self.assertLogs(prefetch.logger, level="INFO"):
+            prefetcher.start()
+            self._wait_for(lambda: len(prefetcher) == 2)
+            self.assertTrue(wakeup.is_set())
+            time.sleep(0.05)
+            self.assertEqual(len(prefetcher), 2)
+            self.assertEqual(prefetcher.get(), {"job_uid": "job-0"})
+            self._wait_for(lambda: len(prefetcher) == 2)
+            prefetcher.stop()
+        self.assertEqual(prefetcher.get(), {"job_uid": "job-1"})
+        self.assertEqual(prefetcher.get(), {"job_uid": "job-2"})
+        self.assertIsNone(prefetcher.get())
+
+    def test_expired_leases_are_dropped(self):
+        """Jobs past their lease are skipped in favor of valid ones."""
+        prefetcher = prefetch.JobPrefetcher(lambda count: [], 3, 60)
+        prefetcher.put({"job_uid": "expired", "lease_expires": time.time() - 1})
+        prefetcher.put({"job_uid": "valid"})
+        with self.assertLogs(prefetch.logger, level="WARNING") as captured:
+            self.assertEqual(prefetcher.get(), {"job_uid": "valid"})
+        self.assertIn("lease expired", captured.output[0])
+
+    def test_inactive_agent_does_not_fetch(self):
+        """Outside scan hours the fetcher does not lease jobs."""
+        calls = []
+        prefetcher = prefetch.JobPrefetcher(
+            lambda count: calls.append(count), 2, 60, active=lambda: False
+        )
+        prefetcher.start()
+        time.sleep(0.05)
+        prefetcher.stop()
+        self.assertEqual(calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+"""Tests for the agent-wide Nmap packet rate budget."""
+
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils import (  # pylint: disable=wrong-import-position
+    delivery,
+    nmapargs,
+    ratebudget,
+)
+from utils.setup import APIPath  # pylint: disable=wrong-import-position
+
+RANGE_UID = "f5813ec7-b36b-4fe7-b662-cca3d281725c"
+
+
+class RateBudgetTests(unittest.TestCase):
+    """Verify settings and the split of the budget."""
+
+    def test_settings_parsing(self):
+        """The budget is disabled by default and must be >= 0."""
+        self.assertEqual(ratebudget.parse_max_rate(None), 0)
+        self.assertEqual(ratebudget.parse_max_rate("5000"), 5000)
+        for value in (-1, "fast", True):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    ratebudget.parse_max_rate(value)
+
+    def test_shares_split_the_budget(self):
+        """Each process gets the free budget divided by the free slots."""
+        budget = ratebudget.RateBudget(1000, slots=lambda: 4)
+        with contextlib.ExitStack() as stack:
+            shares = [stack.enter_context(budget.share()) for _ in range(3)]
+            self.assertEqual(shares, [250, 250, 250])
+            with budget.share() as last:
+                self.assertEqual(last, 250)
+                self.assertEqual(budget.allocated, 1000)
+        self.assertEqual((budget.allocated, budget.holders), (0, 0))
+
+    def test_exhausted_budget_overshoots_by_one_per_process(self):
+        """Processes beyond the budget start at one packet per second each."""
+        budget = ratebudget.RateBudget(2, slots=lambda: 4)
+        with contextlib.ExitStack() as stack:
+            shares = [stack.enter_context(budget.share()) for _ in range(4)]
+            self.assertEqual(shares, [1, 1, 1, 1])
+            self.assertEqual(budget.allocated, 4)
+        self.assertEqual((budget.allocated, budget.holders), (0, 0))
+
+    def test_finished_shares_go_to_the_next_processes(self):
+        """A smaller slot count later gives larger shares from freed budget."""
+        slots = [4]
+        budget = ratebudget.RateBudget(1000, slots=lambda: slots[0])
+        with budget.share() as first:
+            self.assertEqual(first, 250)
+            slots[0] = 2
+            with budget.share() as second:
+                self.assertEqual(second, 750)
+
+    def test_disabled_budget_yields_none(self):
+        """Without a budget Nmap keeps its own rate."""
+        with ratebudget.RateBudget(0).share() as share:
+            self.assertIsNone(share)
+
+
+class RateArgumentTests(unittest.TestCase):
+    """Verify --max-rate injection and profile clamping."""
+
+    @staticmethod
+    def _build_args(params=None, max_rate=250):
+        job_message = {"job": "192.0.2.0/24", "nmap_additional_params": params}
+        return agent._build_nmap_args(  # pylint: disable=protected-access
+            job_message, "/tmp/result.xml", "443", [], max_rate
+        )
+
+    def test_share_injected_as_max_rate(self):
+        """The share becomes --max-rate, no budget leaves the rate free."""
+        self.assertIn("--max-rate", self._build_args())
+        arguments = self._build_args()
+        self.assertEqual(arguments[arguments.index("--max-rate") + 1], "250")
+        self.assertNotIn("--max-rate", self._build_args(max_rate=None))
+
+    def test_profile_rates_are_clamped(self):
+        """Profile rates above the share are lowered, lower ones are kept."""
+        for params, expected in (
+            ("--max-rate 5000", ["--max-rate", "250"]),
+            ("--max-rate=100", ["--max-rate", "100"]),
+            ("--min-rate 1000", ["--max-rate", "250", "--min-rate", "250"]),
+            (
+                "--min-rate 10 --max-rate 20.5",
+                ["--min-rate", "10", "--max-rate", "20.5"],
+            ),
+        ):
+            with self.subTest(params=params):
+                arguments = self._build_args(params)
+                rates = [
+                    token
+                    for index, token in enumerate(arguments)
+                    if token in nmapargs.NMAP_RATE_OPTIONS
+                    or arguments[index - 1] in nmapargs.NMAP_RATE_OPTIONS
+                ]
+                self.assertEqual(rates, expected)
+        self.assertIn("--max-rate=5000", self._build_args("--max-rate=5000", None))
+
+    def test_large_rates_are_written_as_integers(self):
+        """Nmap does not accept exponent notation for rates."""
+        arguments = self._build_args("--max-rate 5000000", max_rate=1000000)
+        self.assertEqual(
+            arguments[
+                arguments.index("--max-rate") : arguments.index("--max-rate") + 2
+            ],
+            ["--max-rate", "1000000"],
+        )
+        self.assertNotIn("1e+06", arguments)
+
+    def test_invalid_profile_rate_is_rejected(self):
+        """Rates must be numbers and carry a value."""
+        for params in ("--max-rate fast", "--min-rate"):
+            with self.subTest(params=params):
+                with self.assertRaises(ValueError):
+                    self._build_args(params)
+
+    def test_scan_job_runs_with_its_share(self):
+        """run_scan_job passes the budget share to Nmap."""
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        config = {
+            "nmap_path": "nmap",
+            "THIS_DIR": tmp_dir,
+            "APIPATH": APIPath("https://island.test"),
+        }
+        budget = ratebudget.RateBudget(600, slots=lambda: 3)
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.dict(agent.CONFIG, config, clear=False))
+            stack.enter_context(mock.patch.object(agent, "RATE_BUDGET", budget))
+            run_elf = stack.enter_context(
+                mock.patch.object(agent, "run_elf", return_value=0)
+            )
+            stack.enter_context(
+                mock.patch.object(delivery, "robust_request", return_value={})
+            )
+            captured = stack.enter_context(self.assertLogs(agent.logger, level="INFO"))
+            agent.run_scan_job(
+                {"job_uid": RANGE_UID, "job": "192.0.2.1", "nmap_ports": [443]}
+            )
+        arguments = run_elf.call_args.args[1]
+        self.assertEqual(arguments[arguments.index("--max-rate") + 1], "200")
+        self.assertEqual(budget.allocated, 0)
+        (command,) = [line for line in captured.output if "Nmap command" in line]
+        self.assertIn("--max-rate 200", command)
+
+
+if __name__ == "__main__":
+    unittest.main()
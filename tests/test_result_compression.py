@@ -0,0 +1,116 @@
+"""Tests for compressed result uploads."""
+
+import gzip
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils import compression  # pylint: disable=wrong-import-position
+from utils.mutils import Dict2obj  # pylint: disable=wrong-import-position
+from utils.netutils import WIRE_FORMAT_JSON  # pylint: disable=wrong-import-position
+from utils import setup as agent_setup  # pylint: disable=wrong-import-position
+from utils.setup import (  # pylint: disable=wrong-import-position
+    agent_capabilities,
+    negotiate_capabilities,
+)
+
+PAYLOAD = {"JOB_UID": "uid", "RESULT": [{"addr": "192.0.2.1"}] * 200}
+
+
+class ResultCompressionTests(unittest.TestCase):
+    """Verify configuration, negotiation, and body encoding."""
+
+    def test_compression_settings_parsing(self):
+        """Compression settings accept defaults and reject invalid values."""
+        self.assertEqual(compression.parse_result_compression(None), "auto")
+        self.assertEqual(compression.parse_result_compression(False), "none")
+        self.assertEqual(compression.parse_result_compression("GZIP"), "gzip")
+        self.assertEqual(compression.parse_compression_threshold(None), 65536)
+        self.assertEqual(compression.parse_compression_level(None, "gzip"), 6)
+        for parser, value in (
+            (compression.parse_result_compression, "brotli"),
+            (compression.parse_compression_threshold, "-1"),
+            (lambda value: compression.parse_compression_level(value, "gzip"), 12),
+        ):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    parser(value)
+
+    def test_shared_level_checked_against_negotiated_encoding(self):
+        """A zstd-only level does not fail when gzip is not the encoding."""
+        cfg = {"result_compression": "auto", "result_compression_level": 15}
+        with mock.patch.object(
+            agent_setup, "available_encodings", return_value=["zstd", "gzip"]
+        ):
+            negotiate_capabilities(cfg, Dict2obj({"capabilities": ["zstd_results"]}))
+            self.assertEqual(cfg["result_encoding"], "zstd")
+            with self.assertRaises(SystemExit) as raised:
+                negotiate_capabilities(
+                    cfg, Dict2obj({"capabilities": ["gzip_results"]})
+                )
+        self.assertEqual(raised.exception.code, 10)
+
+        cfg["result_compression_level_gzip"] = 9
+        with mock.patch.object(
+            agent_setup, "available_encodings", return_value=["zstd", "gzip"]
+        ):
+            negotiate_capabilities(cfg, Dict2obj({"capabilities": ["gzip_results"]}))
+        self.assertEqual(cfg["result_encoding"], "gzip")
+        self.assertEqual(compression.compression_level_setting(cfg, "gzip"), 9)
+        self.assertEqual(compression.compression_level_setting(cfg, "zstd"), 15)
+
+    def test_gzip_round_trip(self):
+        """Compressed bodies decode back to the original bytes."""
+        body = json.dumps(PAYLOAD).encode()
+        compressed = compression.compress_body(body, "gzip", 9)
+        self.assertLess(len(compressed), len(body))
+        self.assertEqual(compression.decompress_body(compressed, "gzip"), body)
+
+    def test_negotiation_selects_accepted_encoding(self):
+        """Only encodings accepted by the island are used."""
+        cfg = {"result_compression": "gzip"}
+        self.assertIn("gzip_results", agent_capabilities(cfg))
+        negotiate_capabilities(cfg, Dict2obj({"capabilities": ["gzip_results"]}))
+        self.assertEqual(cfg["result_encoding"], "gzip")
+
+        cfg = {"result_compression": "none"}
+        self.assertNotIn("gzip_results", agent_capabilities(cfg))
+        negotiate_capabilities(cfg, Dict2obj({"capabilities": ["gzip_results"]}))
+        self.assertIsNone(cfg["result_encoding"])
+
+    def test_body_compressed_above_threshold(self):
+        """Payloads over the threshold are gzip encoded with headers."""
+        config = {
+            "result_encoding": "gzip",
+            "result_compression_threshold": 100,
+            "wire_format": WIRE_FORMAT_JSON,
+        }
+        with mock.patch.dict(agent.CONFIG, config, clear=False):
+            with self.assertLogs(agent.logger, level="INFO") as captured:
+                meta, body = agent.RESULT_DELIVERY.body("uid", PAYLOAD["RESULT"])
+        self.assertEqual(meta["headers"]["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(body)), PAYLOAD)
+        self.assertIn("gzip compressed", captured.output[0])
+
+    def test_body_left_plain_below_threshold(self):
+        """Small payloads are sent uncompressed."""
+        config = {
+            "result_encoding": "gzip",
+            "result_compression_threshold": 10**9,
+            "wire_format": WIRE_FORMAT_JSON,
+        }
+        with mock.patch.dict(agent.CONFIG, config, clear=False):
+            with self.assertLogs(agent.logger, level="INFO"):
+                meta, body = agent.RESULT_DELIVERY.body("uid", PAYLOAD["RESULT"])
+        self.assertNotIn("Content-Encoding", meta["headers"])
+        self.assertEqual(json.loads(body), PAYLOAD)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+"""Tests for the durable result spool and its uploader."""
+
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils import delivery, spool  # pylint: disable=wrong-import-position
+from utils.setup import APIPath  # pylint: disable=wrong-import-position
+from utils.netutils import (  # pylint: disable=wrong-import-position
+    WIRE_FORMAT_JSON,
+    WIRE_FORMAT_LEGACY,
+)
+
+RANGE_UID = "f5813ec7-b36b-4fe7-b662-cca3d281725c"
+RESULTS = [{"addr": "192.0.2.1"}]
+
+
+class ResultSpoolTests(unittest.TestCase):
+    """Verify persistence, draining, and renegotiated formats."""
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.directory = os.path.join(tmp_dir, "result_spool")
+
+    def test_entries_survive_a_new_spool_instance(self):
+        """Spooled uploads are read back in order after a restart."""
+        first = spool.ResultSpool(self.directory)
+        first.put({"job_uid": "a"}, b"body-a")
+        first.put({"job_uid": "b"}, b"body-b\nwith newline")
+        with open(os.path.join(self.directory, "partial.result.tmp"), "wb") as handle:
+            handle.write(b"{")
+
+        restarted = spool.ResultSpool(self.directory)
+        loaded = [restarted.load(path) for path in restarted.pending()]
+        self.assertEqual(
+            loaded,
+            [
+                ({"job_uid": "a"}, b"body-a"),
+                ({"job_uid": "b"}, b"body-b\nwith newline"),
+            ],
+        )
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            sorted(map(os.path.basename, restarted.pending())),
+        )
+
+    def test_uploader_retries_until_delivered(self):
+        """Failed uploads stay spooled and are retried after backoff."""
+        attempts = []
+
+        def send(meta, _body):
+            attempts.append(meta["job_uid"])
+            return len(attempts) > 1
+
+        result_spool = spool.ResultSpool(self.directory)
+        result_spool.put({"job_uid": "a"}, b"body")
+        with mock.patch.object(spool, "SPOOL_BACKOFF_START", 0.01):
+            uploader = spool.SpoolUploader(result_spool, send)
+            with self.assertLogs(spool.logger, level="INFO"):
+                uploader.start()
+                self.assertTrue(uploader.wait_idle(timeout=5))
+                uploader.stop()
+        self.assertEqual(attempts, ["a", "a"])
+        self.assertEqual(result_spool.pending(), [])
+
+    def test_deliver_result_spools_when_uploader_runs(self):
+        """Workers only write to the spool when an uploader is active."""
+        uploader = mock.Mock()
+        uploader.spool = spool.ResultSpool(self.directory)
+        config = {"wire_format": WIRE_FORMAT_JSON, "botinfo": {"UID": "agent"}}
+        with mock.patch.dict(agent.CONFIG, config, clear=False), mock.patch.object(
+            agent.RESULT_DELIVERY, "uploader", uploader
+        ), mock.patch.object(delivery, "robust_request") as request_mock:
+            with self.assertLogs(agent.logger, level="INFO"):
+                meta, body = agent.RESULT_DELIVERY.body(RANGE_UID, RESULTS)
+                delivered = agent.RESULT_DELIVERY.deliver(meta, body)
+        self.assertTrue(delivered)
+        request_mock.assert_not_called()
+        uploader.notify.assert_called_once()
+        meta, body = uploader.spool.load(uploader.spool.pending()[0])
+        self.assertEqual(meta["job_uid"], RANGE_UID)
+        self.assertEqual(json.loads(body)["RESULT"], RESULTS)
+
+    def test_report_kept_when_spool_write_fails(self):
+        """The Nmap report is only removed once its result was spooled."""
+        uploader = mock.Mock()
+        uploader.spool.put.side_effect = OSError("No space left on device")
+        tmp_dir = os.path.dirname(self.directory)
+        config = {
+            "THIS_DIR": tmp_dir,
+            "nmap_path": "nmap",
+            "wire_format": WIRE_FORMAT_JSON,
+            "botinfo": {"UID": "agent"},
+            "APIPATH": APIPath("https://island.test"),
+        }
+        report = os.path.join(tmp_dir, f"{RANGE_UID}.xml")
+
+        def fake_run_elf(_executable, arguments, **_kwargs):
+            with open(arguments[arguments.index("-oX") + 1], "w") as handle:
+                handle.write('<?xml version="1.0"?><nmaprun></nmaprun>')
+            return 0
+
+        job_message = {"job": "192.0.2.1", "job_uid": RANGE_UID, "nmap_ports": [80]}
+        with mock.patch.dict(agent.CONFIG, config, clear=False), mock.patch.object(
+            agent.RESULT_DELIVERY, "uploader", uploader
+        ), mock.patch.object(
+            agent, "run_elf", side_effect=fake_run_elf
+        ), mock.patch.object(
+            delivery, "robust_request", return_value=None
+        ) as request_mock:
+            with self.assertLogs(agent.logger, level="INFO") as captured:
+                self.assertFalse(agent.run_scan_job(job_message))
+            self.assertTrue(os.path.exists(report))
+            request_mock.assert_called_once()
+            self.assertTrue(
+                any("result spool write failed" in line for line in captured.output)
+            )
+
+            request_mock.return_value = {"message": "ok"}
+            with self.assertLogs(agent.logger, level="INFO"):
+                self.assertTrue(agent.run_scan_job(job_message))
+            self.assertFalse(os.path.exists(report))
+
+    def test_spooled_result_reencoded_after_renegotiation(self):
+        """A compressed legacy body is rebuilt for a plain JSON island."""
+        data = {"JOB_UID": RANGE_UID, "RESULT": json.dumps(RESULTS), "UID": "agent"}
+        body = gzip.compress(json.dumps(json.dumps(data)).encode())
+        meta = {
+            "job_uid": RANGE_UID,
+            "wire_format": WIRE_FORMAT_LEGACY,
+            "headers": {"Content-Encoding": "gzip"},
+        }
+        config = {
+            "wire_format": WIRE_FORMAT_JSON,
+            "result_encoding": None,
+            "botinfo": {"UID": "agent"},
+        }
+        with mock.patch.dict(agent.CONFIG, config, clear=False):
+            with self.assertLogs(agent.logger, level="INFO"):
+                new_meta, new_body = agent.RESULT_DELIVERY.reencode_spooled(meta, body)
+        self.assertNotIn("Content-Encoding", new_meta["headers"])
+        self.assertEqual(json.loads(new_body), data | {"RESULT": RESULTS})
+
+
+if __name__ == "__main__":
+    unittest.main()
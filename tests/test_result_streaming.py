@@ -0,0 +1,191 @@
+"""Tests for per-host result streaming while Nmap runs."""
+
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+import xml.etree.ElementTree as ET
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils import delivery, resultstream  # pylint: disable=wrong-import-position
+from utils.netutils import WIRE_FORMAT_JSON  # pylint: disable=wrong-import-position
+from utils.setup import APIPath  # pylint: disable=wrong-import-position
+from utils.xmlstream import NmapXmlTail  # pylint: disable=wrong-import-position
+
+HEADER = '<?xml version="1.0"?>\n<nmaprun scanner="nmap">\n'
+FOOTER = "<runstats/>\n</nmaprun>\n"
+
+
+def host_xml(last_octet):
+    """Return an open-port host block."""
+    return (
+        '<host starttime="1" endtime="2"><status state="up"/>'
+        f'<address addr="192.0.2.{last_octet}" addrtype="ipv4"/>'
+        '<ports><port protocol="tcp" portid="80"><state state="open"/>'
+        '<service name="http"/></port></ports></host>\n'
+    )
+
+
+class ResultStreamingTests(unittest.TestCase):
+    """Verify tailing, batching, and the streaming job protocol."""
+
+    def setUp(self):
+        handle, self.xml_path = tempfile.mkstemp(suffix=".xml")
+        os.close(handle)
+        self.addCleanup(os.remove, self.xml_path)
+
+    def _append(self, text):
+        with open(self.xml_path, "a", encoding="utf-8") as handle:
+            handle.write(text)
+
+    def test_tail_returns_only_completed_hosts(self):
+        """Hosts are returned once their closing tag is written."""
+        tail = NmapXmlTail(self.xml_path, True, True)
+        self._append(HEADER + host_xml(1) + host_xml(2)[:40])
+        self.assertEqual([host["addr"] for host in tail.poll()], ["192.0.2.1"])
+        self.assertEqual(tail.poll(), [])
+        self._append(host_xml(2)[40:] + FOOTER)
+        self.assertEqual([host["addr"] for host in tail.poll()], ["192.0.2.2"])
+        tail.close()
+
+    def test_batcher_flushes_on_size_or_age(self):
+        """Batches are due when full or when the oldest record is too old."""
+        batcher = resultstream.ResultBatcher(max_hosts=2, max_seconds=10)
+        self.assertFalse(batcher.due())
+        batcher.add([{"addr": "a"}])
+        self.assertFalse(batcher.due(now=batcher.first_added + 5))
+        self.assertTrue(batcher.due(now=batcher.first_added + 10))
+        batcher.add([{"addr": "b"}])
+        self.assertTrue(batcher.due())
+        self.assertEqual(len(batcher.take()), 2)
+        self.assertFalse(batcher.due())
+
+    def test_streaming_job_sends_batches_then_completion(self):
+        """Hosts are pushed during the scan and the job ends with a marker."""
+        sent = []
+
+        def fake_run_elf(_executable, arguments, **_kwargs):
+            self.xml_path = arguments[arguments.index("-oX") + 1]
+            self._append(HEADER)
+            for octet in range(1, 4):
+                self._append(host_xml(octet))
+                time.sleep(0.05)
+            time.sleep(0.05)
+            self._append(host_xml(4) + FOOTER)
+            return 0
+
+        def fake_request(_url, **kwargs):
+            sent.append(json.loads(kwargs["body"]))
+            return {"message": "ok"}
+
+        config = {
+            "nmap_path": "nmap",
+            "wire_format": WIRE_FORMAT_JSON,
+            "island_capabilities": ["json_body", "partial_results"],
+            "result_batch_hosts": 2,
+            "APIPATH": APIPath("https://island.test"),
+        }
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.dict(agent.CONFIG, config, clear=False))
+            stack.enter_context(
+                mock.patch.object(resultstream, "TAIL_POLL_INTERVAL", 0.01)
+            )
+            stack.enter_context(
+                mock.patch.object(agent, "run_elf", side_effect=fake_run_elf)
+            )
+            stack.enter_context(
+                mock.patch.object(delivery, "robust_request", side_effect=fake_request)
+            )
+            stack.enter_context(self.assertLogs(agent.logger, level="INFO"))
+            self.assertTrue(
+                agent.run_scan_job(
+                    {
+                        "job": "192.0.2.0/29",
+                        "job_uid": "f5813ec7-b36b-4fe7-b662-cca3d281725c",
+                        "nmap_ports": [80],
+                    }
+                )
+            )
+
+        self.assertGreaterEqual(len(sent), 2)
+        self.assertTrue(sent[-1]["JOB_COMPLETE"])
+        self.assertTrue(all(not payload["JOB_COMPLETE"] for payload in sent[:-1]))
+        self.assertEqual(sent[-1]["BATCH"], len(sent) - 1)
+        addresses = [host["addr"] for payload in sent for host in payload["RESULT"]]
+        self.assertEqual(addresses, [f"192.0.2.{octet}" for octet in range(1, 5)])
+        self.assertFalse(os.path.exists(self.xml_path))
+
+    def test_broken_stream_completion_skips_sent_hosts(self):
+        """After a tail failure, the full report is read but sent hosts are skipped."""
+        sent = []
+        broken = []
+        real_poll = NmapXmlTail.poll
+
+        def poll(tail):
+            if broken:
+                raise ET.ParseError("tail failure")
+            return real_poll(tail)
+
+        def fake_run_elf(_executable, arguments, **_kwargs):
+            self.xml_path = arguments[arguments.index("-oX") + 1]
+            self._append(HEADER + host_xml(1) + host_xml(2))
+            deadline = time.monotonic() + 5
+            while not sent and time.monotonic() < deadline:
+                time.sleep(0.01)
+            broken.append(True)
+            self._append(host_xml(3) + host_xml(4) + FOOTER)
+            return 0
+
+        def fake_request(_url, **kwargs):
+            sent.append(json.loads(kwargs["body"]))
+            return {"message": "ok"}
+
+        config = {
+            "nmap_path": "nmap",
+            "wire_format": WIRE_FORMAT_JSON,
+            "island_capabilities": ["json_body", "partial_results"],
+            "result_batch_hosts": 2,
+            "APIPATH": APIPath("https://island.test"),
+        }
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.dict(agent.CONFIG, config, clear=False))
+            stack.enter_context(
+                mock.patch.object(resultstream, "TAIL_POLL_INTERVAL", 0.01)
+            )
+            stack.enter_context(mock.patch.object(NmapXmlTail, "poll", poll))
+            stack.enter_context(
+                mock.patch.object(agent, "run_elf", side_effect=fake_run_elf)
+            )
+            stack.enter_context(
+                mock.patch.object(delivery, "robust_request", side_effect=fake_request)
+            )
+            stack.enter_context(self.assertLogs(agent.logger, level="INFO"))
+            self.assertTrue(
+                agent.run_scan_job(
+                    {
+                        "job": "192.0.2.0/29",
+                        "job_uid": "f5813ec7-b36b-4fe7-b662-cca3d281725c",
+                        "nmap_ports": [80],
+                    }
+                )
+            )
+
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(
+            [host["addr"] for host in sent[0]["RESULT"]], ["192.0.2.1", "192.0.2.2"]
+        )
+        self.assertTrue(sent[1]["JOB_COMPLETE"])
+        self.assertEqual(
+            [host["addr"] for host in sent[1]["RESULT"]], ["192.0.2.3", "192.0.2.4"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+"""Tests for result conversion in worker processes."""
+
+import contextlib
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils import delivery, postprocess  # pylint: disable=wrong-import-position
+from utils.netutils import (  # pylint: disable=wrong-import-position
+    WIRE_FORMAT_JSON,
+    WIRE_FORMAT_LEGACY,
+)
+from utils.setup import APIPath  # pylint: disable=wrong-import-position
+
+RANGE_UID = "f5813ec7-b36b-4fe7-b662-cca3d281725c"
+HOST_XML = (
+    '<host><status state="up"/><address addr="192.0.2.{octet}" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="443"><state state="open"/>'
+    '<service name="https"/></port></ports></host>\n'
+)
+
+
+def write_report(path, hosts):
+    """
+    Write an Nmap XML report with hosts open HTTPS services.
+    """
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write('<?xml version="1.0"?>\n<nmaprun scanner="nmap">\n')
+        for octet in range(1, hosts + 1):
+            handle.write(HOST_XML.format(octet=octet))
+        handle.write("</nmaprun>\n")
+
+
+class ResultWorkerTests(unittest.TestCase):
+    """Verify settings, worker output, and the scan integration."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.xml_path = os.path.join(self.tmp_dir, "report.xml")
+        write_report(self.xml_path, 4)
+
+    def test_settings_parsing(self):
+        """The pool is disabled by default and the size must be >= 0."""
+        self.assertEqual(postprocess.parse_result_workers(None), 0)
+        self.assertEqual(postprocess.parse_result_workers("3"), 3)
+        for value in (-1, "x", True):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    postprocess.parse_result_workers(value)
+
+    def test_worker_body_matches_in_thread_body(self):
+        """The pool returns the bytes the in-thread conversion would send."""
+        settings = {
+            "wire_format": WIRE_FORMAT_LEGACY,
+            "encoding": "gzip",
+            "level": 6,
+            "threshold": 0,
+        }
+        data = {"AGENT_UID": "agent", "JOB_UID": RANGE_UID}
+        extra = {"BATCH": 1, "JOB_COMPLETE": True}
+        expected = postprocess.convert_report(self.xml_path, data, extra, 1, **settings)
+        converter = postprocess.ResultConverter(1).start()
+        self.addCleanup(converter.stop)
+        body, headers, raw_size = converter.convert(
+            self.xml_path, data, extra, 1, **settings
+        )
+        self.assertEqual((body, headers, raw_size), expected)
+        payload = json.loads(json.loads(gzip.decompress(body)))
+        self.assertEqual(
+            list(payload), ["AGENT_UID", "JOB_UID", "RESULT", "BATCH", "JOB_COMPLETE"]
+        )
+        self.assertEqual(
+            [host["addr"] for host in json.loads(payload["RESULT"])],
+            [f"192.0.2.{octet}" for octet in (2, 3, 4)],
+        )
+
+    def test_broken_pool_falls_back_to_in_thread_conversion(self):
+        """A dead worker does not lose the report."""
+        converter = postprocess.ResultConverter(1)
+        broken = mock.Mock()
+        broken.submit.side_effect = postprocess.BrokenProcessPool("dead")
+        converter._executor = broken  # pylint: disable=protected-access
+        with self.assertLogs(postprocess.logger, level="WARNING"):
+            body, headers, _ = converter.convert(
+                self.xml_path, {}, wire_format=WIRE_FORMAT_JSON
+            )
+        self.assertEqual(len(json.loads(body)["RESULT"]), 4)
+        self.assertEqual(headers, {"Content-Type": "application/json"})
+        broken.shutdown.assert_called_once()
+        self.assertIsNone(converter._executor)  # pylint: disable=protected-access
+
+    def test_scan_job_sends_the_worker_body(self):
+        """run_scan_job posts the body built by the result converter."""
+        config = {
+            "nmap_path": "nmap",
+            "THIS_DIR": self.tmp_dir,
+            "wire_format": WIRE_FORMAT_JSON,
+            "APIPATH": APIPath("https://island.test"),
+        }
+        converter = mock.Mock()
+        converter.convert.return_value = (b'{"RESULT": []}', {"X": "1"}, 14)
+
+        def fake_run_elf(_executable, arguments, **_kwargs):
+            write_report(arguments[arguments.index("-oX") + 1], 2)
+            return 0
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.dict(agent.CONFIG, config, clear=False))
+            stack.enter_context(
+                mock.patch.object(agent.RESULT_DELIVERY, "converter", converter)
+            )
+            stack.enter_context(
+                mock.patch.object(agent, "run_elf", side_effect=fake_run_elf)
+            )
+            request_mock = stack.enter_context(
+                mock.patch.object(
+                    delivery, "robust_request", return_value={"message": "ok"}
+                )
+            )
+            stack.enter_context(self.assertLogs(agent.logger, level="INFO"))
+            self.assertTrue(
+                agent.run_scan_job(
+                    {"job_uid": RANGE_UID, "job": "192.0.2.0/30", "nmap_ports": [443]}
+                )
+            )
+
+        output_xml, data, extra, skip_hosts = converter.convert.call_args.args
+        self.assertEqual(output_xml, os.path.join(self.tmp_dir, f"{RANGE_UID}.xml"))
+        self.assertEqual(data["JOB_UID"], RANGE_UID)
+        self.assertEqual((extra, skip_hosts), (None, 0))
+        self.assertEqual(request_mock.call_args.kwargs["body"], b'{"RESULT": []}')
+        self.assertEqual(request_mock.call_args.kwargs["headers"], {"X": "1"})
+        self.assertFalse(os.path.exists(output_xml))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,236 @@
+"""Tests for splitting large jobs across parallel Nmap processes."""
+
+import contextlib
+import ipaddress
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils import delivery, sharding  # pylint: disable=wrong-import-position
+from utils.netutils import WIRE_FORMAT_JSON  # pylint: disable=wrong-import-position
+from utils.setup import APIPath  # pylint: disable=wrong-import-position
+from utils.xmlstream import (  # pylint: disable=wrong-import-position
+    merge_nmap_reports,
+    nmap_stream_to_json,
+)
+
+RANGE_UID = "f5813ec7-b36b-4fe7-b662-cca3d281725c"
+HOST_XML = (
+    '<host><status state="up"/><address addr="{addr}" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="443"><state state="open"/>'
+    "</port></ports></host>\n"
+)
+
+
+def write_report(path, addresses, complete=True):
+    """
+    Write an Nmap XML report with one open port per address.
+    """
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write('<?xml version="1.0"?>\n<nmaprun scanner="nmap" args="x">\n')
+        for addr in addresses:
+            handle.write(HOST_XML.format(addr=addr))
+        if complete:
+            handle.write("</nmaprun>\n")
+
+
+class SplitTargetsTests(unittest.TestCase):
+    """Verify settings parsing and target splitting."""
+
+    def test_settings_parsing(self):
+        """Sharding is disabled by default and the size must be >= 0."""
+        self.assertEqual(sharding.parse_shard_hosts(None), 0)
+        self.assertEqual(sharding.parse_shard_hosts("256"), 256)
+        for value in (-1, "x", True):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    sharding.parse_shard_hosts(value)
+
+    def test_cidr_split_by_host_count(self):
+        """A network is split into subnets of at most shard_hosts addresses."""
+        self.assertEqual(
+            sharding.split_targets("192.0.2.0/24", 64),
+            ["192.0.2.0/26", "192.0.2.64/26", "192.0.2.128/26", "192.0.2.192/26"],
+        )
+        self.assertEqual(sharding.split_targets("192.0.2.0/24", 100)[0], "192.0.2.0/26")
+        self.assertEqual(sharding.split_targets("192.0.2.0/24", 0), ["192.0.2.0/24"])
+        self.assertEqual(sharding.split_targets("192.0.2.0/24", 256), ["192.0.2.0/24"])
+
+    def test_targets_packed_in_order(self):
+        """Small targets are grouped, names and Nmap ranges are kept whole."""
+        self.assertEqual(
+            sharding.split_targets(
+                "192.0.2.1,scanme.test,10.0.0.1-20,198.51.100.0/25", 64
+            ),
+            [
+                "192.0.2.1,scanme.test,10.0.0.1-20",
+                "198.51.100.0/26",
+                "198.51.100.64/26",
+            ],
+        )
+
+    def test_shard_count_is_bounded(self):
+        """Huge ranges get larger shards instead of thousands of processes."""
+        shards = sharding.split_targets("10.0.0.0/8", 1)
+        self.assertEqual(len(shards), sharding.MAX_SHARDS)
+        covered = sum(ipaddress.ip_network(shard).num_addresses for shard in shards)
+        self.assertEqual(covered, 2**24)
+
+    def test_slots_are_borrowed_within_the_limit(self):
+        """Borrowed slots never exceed the slots left by running jobs."""
+        wakeup = threading.Event()
+        slots = sharding.ScanSlots(4, wakeup)
+        slots.job_started()
+        slots.job_started()
+        self.assertEqual(slots.borrow(5), 2)
+        self.assertEqual(slots.borrow(1), 0)
+        self.assertEqual(slots.busy(), 4)
+        slots.give_back()
+        self.assertTrue(wakeup.is_set())
+        self.assertEqual(slots.busy(), 3)
+
+
+class MergeReportsTests(unittest.TestCase):
+    """Verify the merge of shard reports."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_hosts_merged_in_report_order(self):
+        """Hosts of every report are kept, a truncated report is reported."""
+        first = os.path.join(self.tmp_dir, "0.xml")
+        second = os.path.join(self.tmp_dir, "1.xml")
+        merged = os.path.join(self.tmp_dir, "merged.xml")
+        write_report(first, ["192.0.2.1", "192.0.2.2"])
+        write_report(second, ["192.0.2.3"], complete=False)
+        with open(second, "a", encoding="utf-8") as handle:
+            handle.write("<host><status")
+
+        self.assertEqual(merge_nmap_reports([first, second], merged), [second])
+        self.assertEqual(
+            [host["addr"] for host in nmap_stream_to_json(merged)],
+            ["192.0.2.1", "192.0.2.2", "192.0.2.3"],
+        )
+        with open(merged, encoding="utf-8") as handle:
+            self.assertIn('<nmaprun scanner="nmap" args="x">', handle.read())
+
+
+class ShardedScanTests(unittest.TestCase):
+    """Verify sharded jobs run in parallel and send one merged result."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def test_shards_run_in_parallel_and_merge(self):
+        """Idle slots run shards, the island receives one merged result."""
+        config = {
+            "nmap_path": "nmap",
+            "THIS_DIR": self.tmp_dir,
+            "shard_hosts": 2,
+            "wire_format": WIRE_FORMAT_JSON,
+            "APIPATH": APIPath("https://island.test"),
+        }
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def fake_run_elf(_executable, arguments, **_kwargs):
+            output_xml = arguments[arguments.index("-oX") + 1]
+            network = ipaddress.ip_network(arguments[-1])
+            with lock:
+                active.append(output_xml)
+                peak.append(len(active))
+            time.sleep(0.05)
+            write_report(output_xml, [str(addr) for addr in network])
+            with lock:
+                active.remove(output_xml)
+            return 0
+
+        slots = sharding.ScanSlots(3)
+        slots.job_started()
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.dict(agent.CONFIG, config, clear=False))
+            stack.enter_context(mock.patch.object(agent, "SCAN_SLOTS", slots))
+            stack.enter_context(
+                mock.patch.object(agent, "run_elf", side_effect=fake_run_elf)
+            )
+            request_mock = stack.enter_context(
+                mock.patch.object(
+                    delivery, "robust_request", return_value={"message": "ok"}
+                )
+            )
+            stack.enter_context(self.assertLogs(agent.logger, level="INFO"))
+            self.assertTrue(
+                agent.run_scan_job(
+                    {"job_uid": RANGE_UID, "job": "192.0.2.0/29", "nmap_ports": [443]}
+                )
+            )
+
+        self.assertEqual(max(peak), 3)
+        self.assertEqual(slots.borrowed, 0)
+        payload = json.loads(request_mock.call_args.kwargs["body"])
+        self.assertEqual(payload["JOB_UID"], RANGE_UID)
+        self.assertEqual(
+            [host["addr"] for host in payload["RESULT"]],
+            [f"192.0.2.{octet}" for octet in range(8)],
+        )
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_shard_nmap_traces_named_after_shard(self):
+        """Each shard writes its Nmap trace next to the traces of whole jobs."""
+        config = {
+            "nmap_path": "nmap",
+            "THIS_DIR": self.tmp_dir,
+            "shard_hosts": 4,
+            "nmap_trace": True,
+            "wire_format": WIRE_FORMAT_JSON,
+            "APIPATH": APIPath("https://island.test"),
+        }
+
+        def fake_run_elf(_executable, arguments, line_handler=None, **_kwargs):
+            output_xml = arguments[arguments.index("-oX") + 1]
+            network = ipaddress.ip_network(arguments[-1])
+            line_handler("stdout", f"Nmap scan report for {network}")
+            write_report(output_xml, [str(addr) for addr in network])
+            return 0
+
+        slots = sharding.ScanSlots(2)
+        slots.job_started()
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.dict(agent.CONFIG, config, clear=False))
+            stack.enter_context(mock.patch.object(agent, "SCAN_SLOTS", slots))
+            stack.enter_context(
+                mock.patch.object(agent, "run_elf", side_effect=fake_run_elf)
+            )
+            stack.enter_context(
+                mock.patch.object(
+                    delivery, "robust_request", return_value={"message": "ok"}
+                )
+            )
+            stack.enter_context(self.assertLogs(agent.logger, level="INFO"))
+            self.assertTrue(
+                agent.run_scan_job(
+                    {"job_uid": RANGE_UID, "job": "192.0.2.0/29", "nmap_ports": [443]}
+                )
+            )
+
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.tmp_dir, "nmap_traces"))),
+            [f"{RANGE_UID}.0.log.gz", f"{RANGE_UID}.1.log.gz"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Tests for the agent start-up cost."""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+from utils import mutils  # pylint: disable=wrong-import-position
+
+
+class StartupTests(unittest.TestCase):
+    """Verify version lookup and lazy imports."""
+
+    def test_stamped_version_skips_git(self):
+        """A build stamp is used without running git."""
+        with tempfile.NamedTemporaryFile("w", suffix="VERSION", delete=False) as stamp:
+            stamp.write("v2.1.0\n")
+        self.addCleanup(os.remove, stamp.name)
+        with mock.patch.object(mutils, "VERSION_FILE", stamp.name), mock.patch.object(
+            mutils.subprocess, "check_output"
+        ) as check_output:
+            self.assertEqual(mutils.get_version(), "v2.1.0")
+        check_output.assert_not_called()
+
+    def test_git_fallback_without_git(self):
+        """A missing git binary or a slow git gives unknown."""
+        for error in (
+            FileNotFoundError("git"),
+            subprocess.TimeoutExpired("git", mutils.GIT_TIMEOUT),
+        ):
+            with self.subTest(error=type(error).__name__):
+                with mock.patch.object(
+                    mutils, "VERSION_FILE", "/nonexistent/VERSION"
+                ), mock.patch.object(
+                    mutils.subprocess, "check_output", side_effect=error
+                ):
+                    self.assertEqual(mutils.get_version(), "unknown")
+
+    def test_agent_import_defers_heavy_subsystems(self):
+        """Importing the agent loads neither requests, asyncio nor nmap2json."""
+        loaded = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, agent; print(sorted(m for m in "
+                "('requests', 'asyncio', 'nmap2json', 'urllib3') "
+                "if m in sys.modules))",
+            ],
+            cwd=SRC_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        self.assertEqual(loaded, "[]")
+
+
+if __name__ == "__main__":
+    unittest.main()
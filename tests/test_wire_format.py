@@ -0,0 +1,100 @@
+"""Tests for the negotiated job payload wire format."""
+
+import contextlib
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+import agent  # pylint: disable=wrong-import-position
+from utils import delivery, netutils  # pylint: disable=wrong-import-position
+from utils.mutils import Dict2obj  # pylint: disable=wrong-import-position
+from utils.setup import (  # pylint: disable=wrong-import-position
+    APIPath,
+    negotiate_capabilities,
+)
+
+JOB_MESSAGE = {
+    "job": "192.0.2.1",
+    "job_uid": "f5813ec7-b36b-4fe7-b662-cca3d281725c",
+    "nmap_ports": [80],
+}
+RESULTS = [{"addr": "192.0.2.1", "ports": []}]
+
+
+class WireFormatTests(unittest.TestCase):
+    """Verify negotiation and both payload encodings."""
+
+    def test_encode_payload(self):
+        """Legacy keeps the JSON string body, json sends the object."""
+        data = {"RESULT": RESULTS}
+        self.assertEqual(netutils.encode_payload(data), json.dumps(data))
+        self.assertIs(netutils.encode_payload(data, netutils.WIRE_FORMAT_JSON), data)
+
+    def test_negotiation_falls_back_to_legacy(self):
+        """Islands without capabilities keep the legacy format."""
+        cfg = {}
+        negotiate_capabilities(cfg, Dict2obj({"message": "ready"}))
+        self.assertEqual(cfg["wire_format"], netutils.WIRE_FORMAT_LEGACY)
+        self.assertEqual(cfg["island_capabilities"], [])
+
+    def test_negotiation_selects_json_body(self):
+        """Islands advertising json_body receive plain JSON."""
+        cfg = {}
+        ready_msg = Dict2obj({"message": "ready", "capabilities": ["json_body", "x"]})
+        negotiate_capabilities(cfg, ready_msg)
+        self.assertEqual(cfg["wire_format"], netutils.WIRE_FORMAT_JSON)
+        self.assertEqual(cfg["island_capabilities"], ["json_body"])
+
+    def _sent_result(self, wire_format):
+        config = {
+            "nmap_path": "nmap",
+            "wire_format": wire_format,
+            "APIPATH": APIPath("https://island.test"),
+        }
+
+        def fake_run_elf(_executable, arguments, **_kwargs):
+            output_xml = arguments[arguments.index("-oX") + 1]
+            with open(output_xml, "w", encoding="utf-8") as handle:
+                handle.write("<nmaprun/>")
+            return 0
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(mock.patch.dict(agent.CONFIG, config, clear=False))
+            stack.enter_context(
+                mock.patch.object(agent, "run_elf", side_effect=fake_run_elf)
+            )
+            stack.enter_context(
+                mock.patch.object(delivery, "nmap_stream_to_json", return_value=RESULTS)
+            )
+            request_mock = stack.enter_context(
+                mock.patch.object(
+                    delivery, "robust_request", return_value={"message": "ok"}
+                )
+            )
+            stack.enter_context(self.assertLogs(agent.logger, level="INFO"))
+            self.assertTrue(agent.run_scan_job(dict(JOB_MESSAGE)))
+
+        payload = json.loads(request_mock.call_args.kwargs["body"])
+        if wire_format == netutils.WIRE_FORMAT_LEGACY:
+            self.assertIsInstance(payload, str)
+            payload = json.loads(payload)
+        return payload["RESULT"]
+
+    def test_result_embedded_natively_with_json_body(self):
+        """Negotiated islands receive the result as a JSON object."""
+        self.assertEqual(self._sent_result(netutils.WIRE_FORMAT_JSON), RESULTS)
+
+    def test_result_string_kept_for_legacy_islands(self):
+        """Legacy islands keep receiving the result as a JSON string."""
+        self.assertEqual(
+            self._sent_result(netutils.WIRE_FORMAT_LEGACY), json.dumps(RESULTS)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Tests for the streaming Nmap XML converter."""
+
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+from nmap2json import nmap_file_to_json
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+from utils.xmlstream import (  # pylint: disable=wrong-import-position
+    iter_nmap_hosts,
+    nmap_stream_to_json,
+)
+
+NMAP_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<nmaprun scanner="nmap" args="nmap -oX out.xml 192.0.2.0/30" start="1700000000">
+<scaninfo type="syn" protocol="tcp" numservices="2" services="80,443"/>
+<verbose level="0"/>
+<taskprogress task="SYN Stealth Scan" time="1700000005" percent="50.00"/>
+<host starttime="1700000001" endtime="1700000009">
+<status state="up" reason="user-set" reason_ttl="0"/>
+<address addr="192.0.2.1" addrtype="ipv4"/>
+<hostnames><hostname name="www.example.test" type="PTR"/></hostnames>
+<ports>
+<port protocol="tcp" portid="443"><state state="open" reason="syn-ack" reason_ttl="64"/>
+<service name="https" method="table" conf="3"/>
+<script id="ssl-cert" output="Subject: commonName=www.example.test">
+<table key="subject"><elem key="commonName">www.example.test</elem></table>
+<table key="extensions">
+<table><elem key="name">X509v3 Basic Constraints</elem><elem key="value">CA:FALSE</elem></table>
+<table><elem key="name">X509v3 Key Usage</elem><elem key="critical">true</elem></table>
+</table>
+<elem key="sig_algo">sha256WithRSAEncryption</elem>
+</script>
+<script id="http-methods" output="GET HEAD"><elem>GET</elem><elem>HEAD</elem></script>
+</port>
+<port protocol="tcp" portid="80"><state state="closed" reason="reset" reason_ttl="64"/>
+<service name="http" method="table" conf="3"/></port>
+</ports>
+</host>
+<host starttime="1700000001" endtime="1700000009">
+<status state="up" reason="user-set" reason_ttl="0"/>
+<address addr="192.0.2.2" addrtype="ipv4"/>
+<hostnames/>
+<ports><port protocol="tcp" portid="80"><state state="filtered" reason="no-response" reason_ttl="0"/>
+<service name="http" method="table" conf="3"/></port></ports>
+</host>
+<host starttime="1700000002" endtime="1700000010">
+<status state="up" reason="user-set" reason_ttl="0"/>
+<address addr="192.0.2.3" addrtype="ipv4"/>
+<ports><port protocol="tcp" portid="80"><state state="open" reason="syn-ack" reason_ttl="64"/>
+<service name="http" product="nginx" method="probed" conf="10"/></port></ports>
+</host>
+<runstats><finished time="1700000010" elapsed="10.00"/><hosts up="3" down="0" total="3"/></runstats>
+</nmaprun>
+"""
+
+
+class XmlStreamTests(unittest.TestCase):
+    """Streaming conversion matches nmap2json."""
+
+    def setUp(self):
+        handle, self.xml_path = tempfile.mkstemp(suffix=".xml")
+        with os.fdopen(handle, "w", encoding="utf-8") as output:
+            output.write(NMAP_XML)
+
+    def tearDown(self):
+        os.remove(self.xml_path)
+
+    def test_output_identical_to_nmap_file_to_json(self):
+        """Every wipe flag combination yields the same records."""
+        for wipe_notopen in (False, True):
+            for wipe_deadhost in (False, True):
+                with self.subTest(notopen=wipe_notopen, deadhost=wipe_deadhost):
+                    self.assertEqual(
+                        nmap_stream_to_json(self.xml_path, wipe_notopen, wipe_deadhost),
+                        nmap_file_to_json(self.xml_path, wipe_notopen, wipe_deadhost),
+                    )
+
+    def test_hosts_are_yielded_incrementally(self):
+        """Records are produced one host at a time from file objects."""
+        hosts = iter_nmap_hosts(io.BytesIO(NMAP_XML.encode()), True, True)
+        self.assertEqual(next(hosts)["addr"], "192.0.2.1")
+        self.assertEqual([host["addr"] for host in hosts], ["192.0.2.3"])
+
+
+if __name__ == "__main__":
+    unittest.main()